@@ -11,7 +11,6 @@ setup(
         "requests",
         "websockets",
         "PyYAML",
-        "GitPython"
     ],
     entry_points={
         "console_scripts": [
@@ -20,9 +19,15 @@ setup(
             "get-recent-trace-errors=get_recent_trace_errors:main",
             "generate-entity-state-doc=generate_entity_state_doc:main",
             "automation-watchdog=automation_watchdog:main",
+            "watchdog-log=watchdog_log:main",
+            "entity-refs=entity_refs:main",
             "decompose-automations=decompose_automations:main",
             "setup-ha-tools=setup_ha_tools:main",
             "pull-automations=pull_automations:main",
+            "mock-ha-server=mock_ha_server:main",
+            "ha-benchmark=ha_benchmark:main",
+            "ha-tools=ha_tools:main",
+            "ha-daemon=ha_daemon:main",
         ]
     },
     python_requires=">=3.9",
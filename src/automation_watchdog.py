@@ -5,25 +5,74 @@ Watches Home Assistant automations in real time and reports failures using the W
 
 - Connects to your Home Assistant instance via WebSocket.
 - Subscribes to automation trigger events and fetches traces for each run.
+- Fetches a trace as soon as state_changed shows the run finished, falling back
+  to adaptive polling when no completion signal arrives.
 - Reports errors and exceptions with timing information.
 - Supports filtering by automation entity_id (include/exclude).
+- Reconnects with exponential backoff and re-subscribes when the connection drops.
+- Fetches traces through a bounded queue and worker pool; duplicate runs are
+  coalesced and overflow is counted instead of flooding Home Assistant.
+- Optionally serves Prometheus metrics: per-automation runs, failures and run
+  duration histograms, trace-fetch latency, queue depth and reconnects.
+- Appends every run outcome to a size-rotated NDJSON log in the HA-Tools logs
+  folder through a background writer; query it with watchdog_log.py.
+- Watches every instance in config.json's "instances" list from one event
+  loop, each over its own connection with its own worker pool; output, metrics
+  and logged outcomes are tagged with the instance name.
+- Trace fetches go through the instance's adaptive limiter (config.json
+  "rate_limit"), so a burst of runs is fetched more slowly while HA is busy.
 
 Usage:
   python automation_watchdog.py --ha-path <HA_CONFIG_PATH> [--timeout SECONDS] [--include a,b] [--exclude x,y]
+                                [--workers N] [--queue-size N] [--max-backoff SECONDS] [--no-completion-events]
+                                [--metrics-port PORT] [--metrics-host HOST]
+                                [--no-event-log] [--event-log-dir DIR] [--event-log-max-mb N] [--event-log-keep N]
+                                [--instance a,b]
 
 Arguments:
   --ha-path <HA_CONFIG_PATH>   Path to the Home Assistant config directory (required)
-  --timeout SECONDS           Seconds to wait before fetching trace (default: 3)
+  --timeout SECONDS           Seconds to wait for a completion signal before polling (default: 3)
   --include a,b               Comma-separated list of automations to watch
   --exclude x,y               Comma-separated list of automations to ignore
+  --workers N                 Maximum concurrent trace fetches per instance, unless the instance sets
+                              "concurrency" (default: 4); the adaptive limiter may run fewer
+  --queue-size N              Maximum runs waiting for a trace before new ones are dropped (default: 1000)
+  --max-backoff SECONDS       Maximum delay between reconnect attempts (default: 60)
+  --no-completion-events      Don't subscribe to state_changed; rely on polling alone
+  --metrics-port PORT         Serve Prometheus metrics at http://HOST:PORT/metrics (default: off)
+  --metrics-host HOST         Address for the metrics endpoint (default: 127.0.0.1)
+  --no-event-log              Don't write run outcomes to the event log
+  --event-log-dir DIR         Where to keep the event log (default: the HA-Tools logs folder)
+  --event-log-max-mb N        Size at which a log segment is rotated (default: 16)
+  --event-log-keep N          Number of log segments to keep (default: 20)
+  --instance a,b              Only watch these instances from config.json's "instances" list (default: all)
 
 Requires: websockets==12.0
 """
-import argparse, asyncio, json, sys, datetime, os
+import argparse, asyncio, collections, json, sys, datetime, os, random, time
 import websockets
+from ha_helpers.client import HAAuthError, websocket_url
+from ha_helpers.ws_client import HAWebSocket
+from ha_helpers.metrics import Registry, MetricsServer
+from ha_helpers.ratelimit import AdaptiveLimiter, get_limiter
+from ha_helpers.event_log import EventLog, DEFAULT_SEGMENT_MB, DEFAULT_KEEP_SEGMENTS
+from ha_helpers.common import get_default_folders, get_instances, DEFAULT_INSTANCE
 
 BAD_STATES = {"error", "exception"}
 
+# Trace fetch pool and reconnect defaults
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_MAX_BACKOFF = 60.0
+
+# Prometheus endpoint (only served with --metrics-port)
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# Fallback polling for runs that finish without a completion signal
+POLL_MIN_DELAY = 0.25
+POLL_MAX_DELAY = 4.0
+POLL_MAX_ATTEMPTS = 8
+
 # ANSI color codes
 COLOR_RESET = "\033[0m"
 COLOR_RED = "\033[91m"
@@ -59,97 +108,411 @@ def load_ha_config(ha_path):
     with open(config_path, 'r') as f:
         return json.load(f)
 
-async def monitor(url: str, token: str, timeout: float,
-                  include: set[str] | None, exclude: set[str] | None):
-    async with websockets.connect(url) as ws:
-        await ws.recv()                                    # auth_required
-        await ws.send(json.dumps({"type": "auth", "access_token": token}))
-        auth_ok = json.loads(await ws.recv())
-        if auth_ok.get("type") != "auth_ok":
-            sys.exit("✖  WebSocket authentication failed")
-
-        await ws.send(json.dumps({
-            "id": 1, "type": "subscribe_events",
-            "event_type": "automation_triggered"
-        }))
-
-        pending: dict[str, tuple[str, float]] = {}
-        trace_futures: dict[str, asyncio.Future] = {}
-        log("★ Watchdog running…  (Ctrl-C to quit)")
-
-        async def trace_request(ctx, ent):
-            await asyncio.sleep(timeout)
-            max_retries = 3
-            reply = None
-            for attempt in range(max_retries):
-                req_id = f"trace_{ctx}_{attempt}"
-                fut = asyncio.get_event_loop().create_future()
-                trace_futures[req_id] = fut
-                await ws.send(json.dumps({
-                    "id": req_id,
-                    "type": "trace/get",
-                    "domain": "automation",
-                    "item_id": ent.split(".", 1)[1],
-                    "run_id": ctx
-                }))
+def run_duration_ms(timestamp: dict) -> float:
+    """Milliseconds between a trace's start and finish timestamps (0 if either is missing)."""
+    try:
+        start = datetime.datetime.fromisoformat(timestamp["start"])
+        finish = datetime.datetime.fromisoformat(timestamp["finish"])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+    return (finish - start).total_seconds() * 1000
+
+class Watchdog:
+    """Watches automation runs over one WebSocket and reports failed traces.
+
+    The connection is re-established with exponential backoff when it drops.
+    Trace fetches go through a bounded queue served by a fixed pool of
+    workers; repeated context ids are coalesced and runs that don't fit in the
+    queue are dropped and counted instead of piling up as tasks.
+
+    A run's trace is fetched as soon as the automation's state reports that a
+    run finished (its `current` attribute drops). Runs without such a signal
+    fall back to polling, first after `timeout` seconds (or sooner once the
+    automation's typical run time is known) and then with growing delays.
+
+    Run counts, failures, run durations and trace-fetch latency are always
+    aggregated in `self.metrics`, labelled with the `instance` name; pass a
+    shared Registry to watch several instances into one /metrics endpoint.
+    With an `event_log`, each run's outcome is also appended to it.
+    """
+
+    def __init__(self, url: str, token: str, timeout: float,
+                 include: set | None = None, exclude: set | None = None,
+                 workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, completion_events: bool = True,
+                 event_log: EventLog | None = None, instance: str = DEFAULT_INSTANCE,
+                 metrics: Registry | None = None, limiter: AdaptiveLimiter | None = None):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.include = include
+        self.exclude = exclude
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.max_backoff = max_backoff
+        self.completion_events = completion_events
+        self.limiter = limiter
+        self.pending: dict[str, tuple[str, float]] = {}
+        self.attempts: dict[str, int] = {}
+        self.queued: set[str] = set()
+        self.running: dict[str, collections.deque] = {}
+        self.avg_run: dict[str, float] = {}
+        self.stats = {"events": 0, "coalesced": 0, "dropped": 0, "reconnects": 0, "failures": 0,
+                      "signalled": 0, "polled": 0, "event_errors": 0}
+        self.conn: HAWebSocket | None = None
+        self._last_drop_log = 0.0
+        self.event_log = event_log
+        self.instance = instance
+        # Only tag output when watching something other than the single default instance
+        self.prefix = "" if instance == DEFAULT_INSTANCE else f"[{instance}] "
+        self._init_metrics(metrics if metrics is not None else Registry())
+
+    def _init_metrics(self, m: Registry):
+        self.metrics = m
+        stat = lambda key: lambda: self.stats[key]
+        self.m_runs = m.counter("ha_watchdog_runs_total", "Automation runs seen", ["instance", "automation"])
+        self.m_failures = m.counter("ha_watchdog_run_failures_total",
+                                    "Automation runs that ended in an error", ["instance", "automation"])
+        self.m_duration = m.histogram("ha_watchdog_run_duration_seconds",
+                                      "Automation run time from its trace", ["instance", "automation"])
+        self.m_fetch = m.histogram("ha_watchdog_trace_fetch_seconds", "Latency of trace/get requests", ["instance"])
+        watched = {
+            m.counter("ha_watchdog_trace_fetch_failures_total", "Runs whose trace could not be fetched",
+                      ["instance"]): stat("failures"),
+            m.gauge("ha_watchdog_pending_runs", "Runs waiting for their trace",
+                    ["instance"]): lambda: len(self.pending),
+            m.gauge("ha_watchdog_queue_depth", "Runs queued for a trace-fetch worker",
+                    ["instance"]): lambda: self.queue.qsize() if hasattr(self, "queue") else 0,
+            m.counter("ha_watchdog_dropped_runs_total", "Runs dropped because the queue was full",
+                      ["instance"]): stat("dropped"),
+            m.counter("ha_watchdog_coalesced_runs_total", "Duplicate run events coalesced",
+                      ["instance"]): stat("coalesced"),
+            m.counter("ha_watchdog_reconnects_total", "WebSocket reconnects", ["instance"]): stat("reconnects"),
+            m.counter("ha_watchdog_event_errors_total", "Events that could not be handled",
+                      ["instance"]): stat("event_errors"),
+            m.gauge("ha_watchdog_connected", "1 while connected to Home Assistant",
+                    ["instance"]): lambda: int(hasattr(self, "connected") and self.connected.is_set()),
+        }
+        if self.limiter:
+            watched[m.gauge("ha_watchdog_concurrency_limit", "Current adaptive limit on requests in flight",
+                            ["instance"])] = lambda: self.limiter.capacity
+            watched[m.counter("ha_watchdog_limit_backoffs_total",
+                              "Times the adaptive limit was lowered because HA slowed down or failed",
+                              ["instance"])] = lambda: self.limiter.decreases
+        for metric, callback in watched.items():
+            metric.watch(callback, self.instance)
+
+    async def run(self):
+        """Watches until cancelled; raises HAAuthError if Home Assistant rejects the token."""
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.connected = asyncio.Event()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        backoff = 1.0
+        try:
+            while True:
                 try:
-                    reply = await asyncio.wait_for(fut, timeout=2)
-                except asyncio.TimeoutError:
-                    reply = None
-                finally:
-                    trace_futures.pop(req_id, None)
-                if reply and reply.get("success"):
-                    break
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(0.5)
-            pending.pop(ctx, None)
-            if not reply or not reply.get("success"):
-                print_error(f"⚠  Couldn’t fetch trace for {ent} (run {ctx[:7]}) after {max_retries} attempts")
-                return
-            trace = reply["result"]["trace"]
-            outcome = trace[-1]["result"]
-            took_ms = trace[-1]["timestamp"] - trace[0]["timestamp"]
-            if outcome in BAD_STATES:
-                log(f"❌  {ent} failed after {took_ms:.0f} ms  (run {ctx[:7]})")
+                    await self._session()
+                    reason = "connection closed"
+                except (websockets.ConnectionClosed, websockets.InvalidHandshake, OSError,
+                        asyncio.TimeoutError) as e:
+                    # InvalidHandshake covers a proxy answering 502 while HA restarts
+                    reason = str(e) or type(e).__name__
+                if self.connected.is_set():
+                    # We got through the handshake, so start the backoff over
+                    backoff = 1.0
+                self._disconnected()
+                self.stats["reconnects"] += 1
+                delay = backoff * random.uniform(0.5, 1.0)
+                print_warning(f"{self.prefix}⚠  Lost connection to Home Assistant ({reason}); reconnecting in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            for w in workers:
+                w.cancel()
+
+    async def _session(self):
+        async with HAWebSocket(self.url, self.token, concurrency=self.workers, limiter=self.limiter) as conn:
+            self.conn = conn
+            await conn.subscribe("automation_triggered", self._guarded(self._triggered))
+            if self.completion_events:
+                await conn.subscribe("state_changed", self._guarded(self._state_changed))
+            self.connected.set()
+            if self.stats["reconnects"]:
+                log(f"{self.prefix}★ Reconnected and re-subscribed")
+            else:
+                log(f"{self.prefix}★ Watchdog running…  (Ctrl-C to quit)")
+            await conn.wait_closed()
+
+    def _guarded(self, handler):
+        # Callbacks run in the connection's reader; a malformed event must not stop it
+        def dispatch(event: dict):
+            try:
+                handler(event)
+            except Exception as e:
+                self.stats["event_errors"] += 1
+                print_error(f"{self.prefix}⚠  Ignoring malformed {handler.__name__.strip('_')} event: "
+                            f"{type(e).__name__}: {e}")
+        return dispatch
+
+    def _disconnected(self):
+        self.connected.clear()
+        self.conn = None
+
+    def _state_changed(self, event: dict):
+        data = event["data"]
+        ent = data.get("entity_id", "")
+        if ent in self.running:
+            self._run_finished(ent, data)
+
+    def _triggered(self, event: dict):
+        ent = event["data"].get("entity_id", "")
+        if self.include and ent not in self.include:
+            return
+        if self.exclude and ent in self.exclude:
+            return
+        self.stats["events"] += 1
+        self.m_runs.inc(self.instance, ent)
+        self._track(event["context"]["id"], ent)
+
+    def _track(self, ctx: str, ent: str):
+        if ctx in self.pending:
+            self.stats["coalesced"] += 1
+            return
+        if len(self.pending) >= self.queue_size:
+            self._drop(ent, ctx)
+            return
+        loop = asyncio.get_running_loop()
+        self.pending[ctx] = (ent, loop.time())
+        self.running.setdefault(ent, collections.deque()).append(ctx)
+        loop.call_later(self._first_poll_delay(ent), self._poll, ctx)
+
+    def _first_poll_delay(self, ent: str) -> float:
+        # Without a completion signal, poll a little after the automation usually finishes
+        avg = self.avg_run.get(ent)
+        if avg is None:
+            return self.timeout
+        return min(self.timeout, max(POLL_MIN_DELAY, avg * 1.5))
 
+    def _run_finished(self, ent: str, data: dict):
+        old_attrs = (data.get("old_state") or {}).get("attributes", {})
+        new_attrs = (data.get("new_state") or {}).get("attributes", {})
+        finished = old_attrs.get("current", 0) - new_attrs.get("current", 0)
+        runs = self.running[ent]
+        # Runs finish roughly in the order they started; oldest first
+        for _ in range(min(finished, len(runs))):
+            ctx = runs.popleft()
+            self.stats["signalled"] += 1
+            self._enqueue(ctx)
+        if not runs:
+            del self.running[ent]
+
+    def _poll(self, ctx: str):
+        if ctx in self.pending and ctx not in self.queued:
+            self.stats["polled"] += 1
+            self._enqueue(ctx)
+
+    def _enqueue(self, ctx: str):
+        if ctx not in self.pending or ctx in self.queued:
+            return
+        try:
+            self.queue.put_nowait(ctx)
+            self.queued.add(ctx)
+        except asyncio.QueueFull:
+            ent, _ = self.pending.get(ctx, ("?", 0))
+            self._forget(ctx)
+            self._drop(ent, ctx)
+
+    def _forget(self, ctx: str):
+        ent, _ = self.pending.pop(ctx, ("", 0))
+        self.attempts.pop(ctx, None)
+        runs = self.running.get(ent)
+        if runs and ctx in runs:
+            runs.remove(ctx)
+            if not runs:
+                del self.running[ent]
+
+    def _drop(self, ent: str, ctx: str):
+        self.stats["dropped"] += 1
+        now = time.monotonic()
+        if now - self._last_drop_log >= 10:
+            self._last_drop_log = now
+            print_warning(f"{self.prefix}⚠  Trace queue full, skipping {ent} (run {ctx[:7]}); "
+                          f"{self.stats['dropped']} run(s) dropped so far")
+
+    async def _worker(self):
         while True:
-            msg = json.loads(await ws.recv())
-            # Route trace responses to the correct future
-            if "id" in msg and str(msg["id"]).startswith("trace_"):
-                fut = trace_futures.get(str(msg["id"]))
-                if fut and not fut.done():
-                    fut.set_result(msg)
-                continue
-            if msg.get("type") == "event":
-                data = msg["event"]["data"]
-                ent  = data["entity_id"]
-                if include and ent not in include:
-                    continue
-                if exclude and ent in exclude:
-                    continue
-                ctx  = msg["event"]["context"]["id"]
-                pending[ctx] = (ent, asyncio.get_event_loop().time())
-                asyncio.create_task(trace_request(ctx, ent))
+            ctx = await self.queue.get()
+            self.queued.discard(ctx)
+            done = True
+            try:
+                done = await self.trace_request(ctx)
+            except Exception as e:
+                print_error(f"{self.prefix}⚠  Error while checking run {ctx[:7]}: {e}")
+            finally:
+                if done:
+                    self._forget(ctx)
+                self.queue.task_done()
 
-if __name__ == "__main__":
-    p = argparse.ArgumentParser()
+    async def _request(self, payload: dict, timeout: float):
+        await self.connected.wait()
+        try:
+            # Unanswered requests are retried by polling again, not by the client
+            return await self.conn.call(payload, timeout=timeout, retries=0)
+        except (ConnectionError, websockets.ConnectionClosed):
+            return None
+
+    async def trace_request(self, ctx: str) -> bool:
+        """Fetches and reports one run's trace.
+
+        Returns False when the run should be polled again later because the
+        trace isn't available or the run hasn't finished yet.
+        """
+        ent, started = self.pending[ctx]
+        fetch_start = time.perf_counter()
+        reply = await self._request({
+            "type": "trace/get",
+            "domain": "automation",
+            "item_id": ent.split(".", 1)[1],
+            "run_id": ctx
+        }, timeout=2)
+        self.m_fetch.observe(time.perf_counter() - fetch_start, self.instance)
+        finished = bool(reply and reply.get("success")) and reply["result"].get("state") != "running"
+        if not finished:
+            attempt = self.attempts.get(ctx, 0) + 1
+            if attempt < POLL_MAX_ATTEMPTS:
+                self.attempts[ctx] = attempt
+                delay = min(POLL_MIN_DELAY * 2 ** attempt, POLL_MAX_DELAY)
+                asyncio.get_running_loop().call_later(delay, self._poll, ctx)
+                return False
+            self.stats["failures"] += 1
+            self._log_outcome(ent, ctx, "fetch_failed")
+            print_error(f"{self.prefix}⚠  Couldn’t fetch trace for {ent} (run {ctx[:7]}) after {POLL_MAX_ATTEMPTS} attempts")
+            return True
+        elapsed = asyncio.get_running_loop().time() - started
+        prev = self.avg_run.get(ent)
+        self.avg_run[ent] = elapsed if prev is None else 0.8 * prev + 0.2 * elapsed
+        result = reply["result"]
+        took_ms = run_duration_ms(result.get("timestamp") or {})
+        if took_ms:
+            self.m_duration.observe(took_ms / 1000, self.instance, ent)
+        failed = bool(result.get("error")) or result.get("script_execution") in BAD_STATES
+        self._log_outcome(ent, ctx, result.get("script_execution") or "unknown", failed=failed,
+                          took_ms=took_ms or None, error=result.get("error"))
+        if failed:
+            self.m_failures.inc(self.instance, ent)
+            log(f"{self.prefix}❌  {ent} failed after {took_ms:.0f} ms  (run {ctx[:7]})")
+        return True
+
+    def _log_outcome(self, ent: str, ctx: str, outcome: str, failed: bool = True,
+                     took_ms: float | None = None, error: str | None = None):
+        if self.event_log is None:
+            return
+        self.event_log.write({"ts": time.time(), "instance": self.instance, "entity_id": ent, "context_id": ctx, "outcome": outcome,
+                              "failed": failed, "took_ms": took_ms, "error": error})
+
+async def _guard(watchdog: Watchdog) -> bool:
+    """Runs one instance's watchdog; returns False if it stopped (token rejected or another error).
+
+    Failures are kept to the instance, so the others keep being watched.
+    """
+    try:
+        await watchdog.run()
+    except HAAuthError:
+        print_error(f"{watchdog.prefix}✖  WebSocket authentication failed")
+        return False
+    except Exception as e:
+        # e.g. a non-admin token that may not subscribe to automation_triggered
+        print_error(f"{watchdog.prefix}✖  Stopped watching: {type(e).__name__}: {e}")
+        return False
+    return True
+
+async def monitor(instances: list[dict], timeout: float,
+                  include: set[str] | None, exclude: set[str] | None,
+                  workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                  max_backoff: float = DEFAULT_MAX_BACKOFF, completion_events: bool = True,
+                  metrics_port: int | None = None, metrics_host: str = DEFAULT_METRICS_HOST,
+                  event_log_dir: str | None = None, event_log_max_mb: float = DEFAULT_SEGMENT_MB,
+                  event_log_keep: int = DEFAULT_KEEP_SEGMENTS):
+    """Watches every instance (from get_instances) concurrently with a shared metrics endpoint and event log."""
+    event_log = EventLog(event_log_dir, max_mb=event_log_max_mb, keep=event_log_keep) if event_log_dir else None
+    registry = Registry()
+    watchdogs = [Watchdog(websocket_url(inst['HA_URL']), inst['HA_TOKEN'], timeout, include, exclude,
+                          workers=inst.get('concurrency') or workers, queue_size=queue_size,
+                          max_backoff=max_backoff, completion_events=completion_events,
+                          event_log=event_log, instance=inst['name'], metrics=registry,
+                          limiter=get_limiter(inst['HA_URL'], inst.get('rate_limit'),
+                                              inst.get('concurrency') or workers))
+                 for inst in instances]
+    server = None
+    try:
+        if metrics_port is not None:
+            server = await MetricsServer(registry, metrics_host, metrics_port).start()
+            log(f"Serving metrics at http://{metrics_host}:{server.port}/metrics")
+        results = await asyncio.gather(*(_guard(w) for w in watchdogs))
+        if not any(results):
+            sys.exit(1)
+    finally:
+        if server:
+            await server.close()
+        if event_log:
+            event_log.close()
+            log(f"Logged {event_log.written} run outcome(s) to {event_log_dir}")
+        for watchdog in watchdogs:
+            stats = watchdog.stats
+            log(f"{watchdog.prefix}Processed {stats['events']} run(s): {stats['signalled']} completion signal(s), "
+                f"{stats['polled']} poll(s), {stats['coalesced']} coalesced, "
+                f"{stats['dropped']} dropped, {stats['failures']} trace fetch failure(s), "
+                f"{stats['reconnects']} reconnect(s)")
+
+def main():
+    p = argparse.ArgumentParser(description="Watch Home Assistant automations in real time and report failures.")
     p.add_argument("--ha-path", type=str, default=os.path.expanduser('~/Documents/HA-Tools/config'),
                    help="Path to Home Assistant config directory (default: ~/Documents/HA-Tools/config)")
     p.add_argument("--timeout", type=float, default=3,
-                   help="Seconds to wait before fetching trace")
+                   help="Seconds to wait for a completion signal before polling for the trace")
     p.add_argument("--include", help="Comma-separated list of automations to watch")
     p.add_argument("--exclude", help="Comma-separated list of automations to ignore")
+    p.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                   help=f"Concurrent trace fetches per instance, unless the instance sets \"concurrency\" "
+                        f"(default: {DEFAULT_WORKERS})")
+    p.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                   help=f"Maximum runs waiting for a trace fetch before new ones are dropped (default: {DEFAULT_QUEUE_SIZE})")
+    p.add_argument("--max-backoff", type=float, default=DEFAULT_MAX_BACKOFF,
+                   help=f"Maximum seconds between reconnect attempts (default: {DEFAULT_MAX_BACKOFF:.0f})")
+    p.add_argument("--no-completion-events", action="store_true",
+                   help="Don't subscribe to state_changed; rely on polling alone")
+    p.add_argument("--metrics-port", type=int,
+                   help="Serve Prometheus metrics on this port at /metrics (default: off)")
+    p.add_argument("--metrics-host", default=DEFAULT_METRICS_HOST,
+                   help=f"Address for the metrics endpoint (default: {DEFAULT_METRICS_HOST})")
+    p.add_argument("--no-event-log", action="store_true", help="Don't write run outcomes to the event log")
+    p.add_argument("--event-log-dir", default=get_default_folders()[4],
+                   help="Where to keep the event log (default: the HA-Tools logs folder)")
+    p.add_argument("--event-log-max-mb", type=float, default=DEFAULT_SEGMENT_MB,
+                   help=f"Size at which a log segment is rotated (default: {DEFAULT_SEGMENT_MB})")
+    p.add_argument("--event-log-keep", type=int, default=DEFAULT_KEEP_SEGMENTS,
+                   help=f"Number of log segments to keep (default: {DEFAULT_KEEP_SEGMENTS})")
+    p.add_argument("--instance", help="Comma-separated instance names from config.json to watch (default: all)")
     args = p.parse_args()
 
     ha_config = load_ha_config(args.ha_path)
-    url = ha_config['HA_URL'].replace('https://', 'wss://').replace('http://', 'ws://')
-    if not url.endswith('/api/websocket'):
-        url = url.rstrip('/') + '/api/websocket'
-    token = ha_config['HA_TOKEN']
+    try:
+        instances = get_instances(ha_config, names=args.instance.split(",") if args.instance else None)
+    except ValueError as e:
+        print_error(str(e))
+        sys.exit(1)
 
     include = set(args.include.split(",")) if args.include else None
     exclude = set(args.exclude.split(",")) if args.exclude else None
     try:
-        asyncio.run(monitor(url, token, args.timeout, include, exclude))
+        asyncio.run(monitor(instances, args.timeout, include, exclude, workers=args.workers,
+                            queue_size=args.queue_size, max_backoff=args.max_backoff,
+                            completion_events=not args.no_completion_events,
+                            metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+                            event_log_dir=None if args.no_event_log else args.event_log_dir,
+                            event_log_max_mb=args.event_log_max_mb, event_log_keep=args.event_log_keep))
     except KeyboardInterrupt:
         print("\nBye!")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-utomations#!/usr/bin/env python3
+#!/usr/bin/env python3
 """
 decompose_automations.py
 
@@ -11,11 +11,44 @@ Arguments:
   --ha-path <HA_CONFIG_PATH>   Path to the Home Assistant config directory (required)
   --file <FILE_TO_DECOMPOSE>   Path to the automations.yaml or scripts.yaml file to decompose
   --output-dir <OUTPUT_DIR>    The directory to output the individual YAML files to.
+  --changed-only               Skip items whose output file already has identical content.
+  --workers N                  Number of items rendered and written concurrently (default: 8)
+
+Items are streamed out of the file one at a time (using the libyaml C parser
+and emitter when available) and written from a worker pool.
 """
 import os
 import argparse
+import concurrent.futures
+import threading
 import yaml
 import json
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.resolver import Resolver
+from ha_helpers.common import atomic_write, write_if_changed
+
+# Maximum number of items rendered/written at once
+DEFAULT_WORKERS = 8
+
+# Use the libyaml C parser and emitter when PyYAML was built with them
+if getattr(yaml, '__with_libyaml__', False):
+    from yaml.cyaml import CParser
+
+    class StreamingLoader(CParser, Composer, SafeConstructor, Resolver):
+        """Safe loader that pairs the C event parser with the Python composer,
+        so the items of a top-level sequence can be built one at a time."""
+
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+    Dumper = yaml.CSafeDumper
+else:
+    StreamingLoader = yaml.SafeLoader
+    Dumper = yaml.SafeDumper
 
 def print_error(msg):
     """Prints an error message to the console."""
@@ -31,6 +64,99 @@ def load_ha_config(ha_path):
     with open(config_path, 'r') as f:
         return json.load(f)
 
+def iter_items(path):
+    """Yields automations/scripts from a YAML file one at a time.
+
+    The items of a top-level list are constructed individually, so the whole
+    file is never held in memory. A document that isn't a list is yielded as
+    a single item.
+    """
+    with open(path, 'rb') as f:
+        loader = StreamingLoader(f)
+        try:
+            loader.get_event()                                  # StreamStart
+            while not loader.check_event(yaml.StreamEndEvent):
+                loader.get_event()                              # DocumentStart
+                if loader.check_event(yaml.SequenceStartEvent):
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        yield loader.construct_document(loader.compose_node(None, None))
+                    loader.get_event()                          # SequenceEnd
+                elif not loader.check_event(yaml.DocumentEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()                              # DocumentEnd
+                loader.anchors = {}
+        finally:
+            loader.dispose()
+
+def item_filename(item, idx, seen):
+    """Returns a unique, sanitized file name for an item based on its alias or id."""
+    # Use alias or id for filename if available
+    name = (item.get('alias') or item.get('id')) if isinstance(item, dict) else None
+    name = name or f'item_{idx+1}'
+    # Sanitize filename
+    safe_name = ''.join(c if c.isalnum() or c in ('-', '_') else '_' for c in str(name))
+    count = seen.get(safe_name, 0) + 1
+    seen[safe_name] = count
+    if count > 1:
+        print_error(f"Duplicate name '{safe_name}' for item {idx+1}; writing it as {safe_name}_{count}.yaml")
+        safe_name = f"{safe_name}_{count}"
+    return f'{safe_name}.yaml'
+
+def write_item(item, out_path, changed_only=False):
+    """Renders one item and writes it; returns False if skipped as unchanged."""
+    text = yaml.dump([item], Dumper=Dumper, sort_keys=False, allow_unicode=True)
+    if changed_only:
+        return write_if_changed(out_path, text)
+    atomic_write(out_path, text)
+    return True
+
+def decompose(path, output_dir, changed_only=False, workers=DEFAULT_WORKERS):
+    """Streams items out of `path` and writes each to its own file from a worker pool.
+
+    File names are assigned in input order, so results are stable across runs.
+
+    Returns (written, unchanged, failed) counts.
+    """
+    written = unchanged = failed = 0
+    seen = {}
+    # Bound the number of parsed items waiting for a worker
+    slots = threading.BoundedSemaphore(max(1, workers) * 4)
+    futures = {}
+
+    def done(fut):
+        slots.release()
+
+    # Rendering YAML is CPU-bound, so use processes when there is more than one core
+    executor = (concurrent.futures.ProcessPoolExecutor if (os.cpu_count() or 1) > 1
+                else concurrent.futures.ThreadPoolExecutor)
+    with executor(max_workers=max(1, workers)) as pool:
+        try:
+            for idx, item in enumerate(iter_items(path)):
+                if item is None:
+                    # Empty document, e.g. a trailing '---'
+                    continue
+                out_path = os.path.join(output_dir, item_filename(item, idx, seen))
+                slots.acquire()
+                fut = pool.submit(write_item, item, out_path, changed_only)
+                fut.add_done_callback(done)
+                futures[fut] = out_path
+        except (yaml.YAMLError, OSError) as e:
+            print_error(f"Failed to load YAML: {e}")
+            failed += 1
+        for fut in concurrent.futures.as_completed(futures):
+            out_path = futures[fut]
+            try:
+                if fut.result():
+                    written += 1
+                    print(f"Wrote: {out_path}")
+                else:
+                    unchanged += 1
+            except Exception as e:
+                failed += 1
+                print_error(f"Failed to write {out_path}: {e}")
+    return written, unchanged, failed
+
 def main():
     """Main function to decompose automations or scripts."""
     parser = argparse.ArgumentParser(description="Decompose Home Assistant automations or scripts into individual files.")
@@ -41,6 +167,10 @@ def main():
                         help='Path to the automations.yaml or scripts.yaml file to decompose.')
     parser.add_argument('--output-dir', type=str,
                         help='The directory to output the individual YAML files to.')
+    parser.add_argument('--changed-only', action='store_true',
+                        help='Skip items whose output file already has identical content.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Number of items rendered and written concurrently (default: {DEFAULT_WORKERS}).')
     args = parser.parse_args()
 
     ha_config = load_ha_config(args.ha_path)
@@ -76,37 +206,12 @@ def main():
             else:
                 args.output_dir = os.path.join(ha_path, 'decomposed')
             print(f"Auto-detected output directory: {args.output_dir}")
-    # Load the YAML file
-    try:
-        with open(args.file, 'r') as f:
-            docs = list(yaml.safe_load_all(f))
-    except Exception as e:
-        print_error(f"Failed to load YAML: {e}")
-        exit(1)
-
-    # If the YAML is a list, treat each item as an automation/script
-    if isinstance(docs, list) and len(docs) == 1 and isinstance(docs[0], list):
-        items = docs[0]
-    else:
-        items = docs
-
-    if not isinstance(items, list):
-        print_error("YAML file does not contain a list of automations/scripts.")
-        exit(1)
-
     os.makedirs(args.output_dir, exist_ok=True)
-    for idx, item in enumerate(items):
-        # Use alias or id for filename if available
-        name = item.get('alias') or item.get('id') or f'item_{idx+1}'
-        # Sanitize filename
-        safe_name = ''.join(c if c.isalnum() or c in ('-', '_') else '_' for c in str(name))
-        out_path = os.path.join(args.output_dir, f'{safe_name}.yaml')
-        try:
-            with open(out_path, 'w') as out_f:
-                yaml.safe_dump([item], out_f, sort_keys=False, allow_unicode=True)
-            print(f"Wrote: {out_path}")
-        except Exception as e:
-            print_error(f"Failed to write {out_path}: {e}")
+    written, unchanged, failed = decompose(args.file, args.output_dir,
+                                           changed_only=args.changed_only, workers=args.workers)
+    print(f"Decomposed into {args.output_dir}: {written} written, {unchanged} unchanged, {failed} failed")
+    if failed:
+        exit(1)
 
 if __name__ == '__main__':
     main()
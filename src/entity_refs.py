@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+entity_refs.py
+
+Answers "what uses this entity?" from the local automation and script files.
+
+- Keeps a persistent reference index (ref_index.sqlite3 next to config.json)
+  of every entity_id, service, device_id and area_id the YAML files use,
+  including entities read in templates.
+- Each run first refreshes the index; only files whose mtime/size changed
+  and whose content hash differs are parsed again, so queries stay fast on
+  large repositories.
+- --dangling joins the entity references against the ha_entities.json
+  snapshot and lists the ones Home Assistant doesn't know.
+
+Usage:
+  python entity_refs.py [PATTERN] [--kind KIND] [--item ITEM] [--dangling] [--stats]
+                        [--ha-path DIR] [--entities-file FILE] [--automations-dir DIR] [--scripts-dir DIR]
+                        [--index FILE] [--rebuild] [--no-update]
+
+Arguments:
+  PATTERN                  entity_id, service, device_id or area_id to look up; * and ? are wildcards (light.*)
+  --kind KIND              Only references of this kind: entity, service, device or area
+  --item ITEM              List what one automation/script references, e.g. automation.morning_lights
+  --dangling               List entity references missing from the ha_entities.json snapshot
+  --stats                  Print index size and what the last refresh did
+  --ha-path DIR            Folder holding ha_entities.json (default: ~/Documents/HA-Tools/config)
+  --entities-file FILE     ha_entities.json or ha_entities.ndjson to check against (default: newest in --ha-path)
+  --automations-dir DIR    Automations folder to index (default: AUTOMATIONS_DIR from config.json)
+  --scripts-dir DIR        Scripts folder to index (default: SCRIPTS_DIR from config.json)
+  --index FILE             Index database (default: ref_index.sqlite3 next to config.json)
+  --rebuild                Drop the index and parse every file again
+  --no-update              Query the index as it is, without checking files for changes
+"""
+import argparse
+import os
+import sys
+import time
+from ha_helpers.common import find_entities_file, get_config, iter_entities
+from ha_helpers.ref_index import RefIndex, KINDS, default_index_path
+
+def get_directories(args):
+    try:
+        config = get_config()
+    except FileNotFoundError:
+        config = {}
+    automations_dir = args.automations_dir or config.get('AUTOMATIONS_DIR') or os.path.expanduser('~/Documents/HA-Tools/automations')
+    scripts_dir = args.scripts_dir or config.get('SCRIPTS_DIR') or os.path.expanduser('~/Documents/HA-Tools/scripts')
+    return [d for d in (automations_dir, scripts_dir) if os.path.isdir(d)]
+
+def print_refs(rows, directories):
+    if not rows:
+        print("No references found.")
+        return
+    width = max(len(value) for _, value, _, _, _ in rows)
+    for kind, value, item, path, location in rows:
+        for directory in directories:
+            if path.startswith(os.path.abspath(directory) + os.sep):
+                path = os.path.relpath(path, directory)
+                break
+        print(f"{value:<{width}}  {item}  {location}  ({kind}, {path})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Find which automations and scripts reference an entity, service or device.")
+    parser.add_argument('pattern', nargs='?', help='entity_id, service, device_id or area_id; * and ? are wildcards')
+    parser.add_argument('--kind', choices=KINDS, help='Only references of this kind')
+    parser.add_argument('--item', type=str, help='List what one automation/script references')
+    parser.add_argument('--dangling', action='store_true', help='List entity references missing from the entity snapshot')
+    parser.add_argument('--stats', action='store_true', help='Print index size and what the last refresh did')
+    parser.add_argument('--ha-path', type=str, default=os.path.expanduser('~/Documents/HA-Tools/config'),
+                        help='Folder holding ha_entities.json (default: ~/Documents/HA-Tools/config)')
+    parser.add_argument('--entities-file', type=str, help='ha_entities.json or ha_entities.ndjson to check against')
+    parser.add_argument('--automations-dir', type=str, help='Automations folder to index (default: from config.json)')
+    parser.add_argument('--scripts-dir', type=str, help='Scripts folder to index (default: from config.json)')
+    parser.add_argument('--index', type=str, help='Index database (default: ref_index.sqlite3 next to config.json)')
+    parser.add_argument('--rebuild', action='store_true', help='Drop the index and parse every file again')
+    parser.add_argument('--no-update', action='store_true', help='Query the index without checking files for changes')
+    args = parser.parse_args()
+
+    if not (args.pattern or args.item or args.dangling or args.stats):
+        parser.error("give a PATTERN, --item, --dangling or --stats")
+
+    index_path = args.index or default_index_path()
+    if args.rebuild and os.path.exists(index_path):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(index_path + suffix):
+                os.remove(index_path + suffix)
+
+    directories = get_directories(args)
+    with RefIndex(index_path) as index:
+        if not args.no_update:
+            start = time.perf_counter()
+            stats = index.update(directories)
+            elapsed = (time.perf_counter() - start) * 1000
+            for path, message in stats['errors']:
+                print(f"⚠️ Could not parse {path}: {message}", file=sys.stderr)
+            if args.stats:
+                print(f"Refreshed in {elapsed:.1f} ms: {stats['files']} files, {stats['parsed']} checked, "
+                      f"{stats['changed']} re-indexed, {stats['removed']} removed")
+
+        if args.dangling:
+            entities_path = args.entities_file or find_entities_file(args.ha_path)
+            if not entities_path or not os.path.exists(entities_path):
+                print("ha_entities.json not found. Run get_ha_entities.py first.")
+                sys.exit(1)
+            index.load_entities(entities_path, lambda: (e['entity_id'] for e in iter_entities(entities_path)
+                                                        if e.get('entity_id')))
+
+        try:
+            if args.stats:
+                counts = index.counts()
+                print(f"Index {index_path}: {counts.pop('files')} files")
+                for kind in KINDS:
+                    label = 'entities' if kind == 'entity' else kind + 's'
+                    print(f"  {label:<9} {counts.get(kind, 0)}")
+            if args.pattern:
+                print_refs(index.find(args.pattern, args.kind), directories)
+            if args.item:
+                rows = index.item_refs(args.item)
+                print_refs([row for row in rows if not args.kind or row[0] == args.kind], directories)
+            if args.dangling:
+                rows = index.dangling()
+                print_refs(rows, directories)
+                if rows:
+                    print(f"\n{len({row[1] for row in rows})} unknown entities referenced from "
+                          f"{len({row[2] for row in rows})} automations/scripts.")
+        except BrokenPipeError:
+            # Output piped into head etc.
+            sys.stderr.close()
+
+if __name__ == "__main__":
+    main()
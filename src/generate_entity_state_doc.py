@@ -6,12 +6,17 @@ Generates documentation for observed Home Assistant entity states based on ha_en
 - Scans all entities and their states from ha_entities.json.
 - Compares observed states to known domain states.
 - Outputs a JSON file listing custom/unknown states by entity and domain.
+- Entities are loaded into interned, array-backed columns and grouped in a
+  single pass, so large snapshots (or a whole delta history) stay fast and small.
 
 Usage:
-  python generate_entity_state_doc.py --ha-path <HA_CONFIG_PATH> [--automations-dir <DIR>] [--scripts-dir <DIR>]
+  python generate_entity_state_doc.py --ha-path <HA_CONFIG_PATH> [--entities-file <FILE>] [--history] [--output <FILE>] [--automations-dir <DIR>] [--scripts-dir <DIR>]
 
 Arguments:
   --ha-path <HA_CONFIG_PATH>   Path to the Home Assistant config directory (required)
+  --entities-file <FILE>       ha_entities.json or ha_entities.ndjson to read (default: newest in --ha-path)
+  --history                    Catalog every state recorded in <ha-path>/entity_history instead of one snapshot
+  --output <FILE>              Where to write the report (default: <ha-path>/entity_states.json)
   --automations-dir <DIR>      Path to your automations YAML folder (optional)
   --scripts-dir <DIR>          Path to your scripts YAML folder (optional)
 
@@ -20,30 +25,168 @@ Requires: ha_entities.json (run get_ha_entities.py first)
 
 import json
 import os
+from array import array
 from collections import defaultdict
 import sys
 import argparse
+from ha_helpers.common import find_entities_file, iter_entities
+from ha_helpers.snapshot_store import SnapshotStore
+
+# States every entity can report regardless of domain
+COMMON_STATES = {"unavailable", "unknown"}
+
+# States Home Assistant documents for each domain. Domains not listed here
+# (sensor, input_number, input_text, ...) have free-form states and are skipped.
+KNOWN_DOMAIN_STATES = {
+    "alarm_control_panel": {"disarmed", "armed_home", "armed_away", "armed_night", "armed_vacation",
+                            "armed_custom_bypass", "pending", "arming", "disarming", "triggered"},
+    "automation": {"on", "off"},
+    "binary_sensor": {"on", "off"},
+    "calendar": {"on", "off"},
+    "climate": {"off", "heat", "cool", "heat_cool", "auto", "dry", "fan_only"},
+    "cover": {"open", "closed", "opening", "closing"},
+    "device_tracker": {"home", "not_home"},
+    "fan": {"on", "off"},
+    "humidifier": {"on", "off"},
+    "input_boolean": {"on", "off"},
+    "light": {"on", "off"},
+    "lock": {"locked", "unlocked", "locking", "unlocking", "jammed", "open", "opening"},
+    "media_player": {"off", "on", "idle", "playing", "paused", "standby", "buffering"},
+    "person": {"home", "not_home"},
+    "remote": {"on", "off"},
+    "schedule": {"on", "off"},
+    "script": {"on", "off"},
+    "siren": {"on", "off"},
+    "sun": {"above_horizon", "below_horizon"},
+    "switch": {"on", "off"},
+    "timer": {"idle", "active", "paused"},
+    "update": {"on", "off"},
+    "vacuum": {"cleaning", "docked", "returning", "idle", "paused", "error"},
+    "valve": {"open", "closed", "opening", "closing"},
+    "water_heater": {"off", "eco", "electric", "gas", "heat_pump", "high_demand", "performance"},
+}
 
 # Load entities from ha_entities.json
 
-def load_entities(ha_path, scripts_dir=None, automations_dir=None):
-    # Prefer ha_entities.json in ~/Documents/HA-Tools/config/ha_entities.json
-    default_entities = os.path.expanduser('~/Documents/HA-Tools/config/ha_entities.json')
-    entities_path = os.path.join(ha_path, 'ha_entities.json') if os.path.exists(os.path.join(ha_path, 'ha_entities.json')) else default_entities
-    if not os.path.exists(entities_path):
-        print("ha_entities.json not found. Run get_ha_entities.py first.")
-        exit(1)
-    with open(entities_path, 'r') as f:
-        return json.load(f)
+def iter_history_entities(ha_path):
+    """Yields the base snapshot and every entity version recorded in the delta history."""
+    return SnapshotStore(os.path.join(ha_path, 'entity_history')).iter_versions()
 
-# ...existing code...
-# Add argparse for ha_path
-if __name__ == "__main__":
+class Interner:
+    """Maps strings to dense integer codes and back."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class EntityColumns:
+    """Entity (domain, object_id, state) rows stored as interned code arrays."""
+
+    def __init__(self):
+        self.domains = Interner()
+        self.object_ids = Interner()
+        self.states = Interner()
+        self.domain_col = array('I')
+        self.object_col = array('I')
+        self.state_col = array('I')
+
+    def __len__(self):
+        return len(self.state_col)
+
+    @classmethod
+    def from_entities(cls, entities):
+        """Builds the columns from any iterable of entity dicts, keeping nothing else."""
+        cols = cls()
+        domain_code, object_code, state_code = cols.domains.code, cols.object_ids.code, cols.states.code
+        append_domain, append_object, append_state = cols.domain_col.append, cols.object_col.append, cols.state_col.append
+        for entity in entities:
+            domain, _, object_id = entity.get('entity_id', '').partition('.')
+            append_domain(domain_code(domain))
+            append_object(object_code(object_id))
+            append_state(state_code(str(entity.get('state'))))
+        return cols
+
+    def unknown_states(self, known=KNOWN_DOMAIN_STATES):
+        """Groups rows whose state isn't known for their domain in one pass.
+
+        Returns {domain: {state: [entity_id, ...]}} with sorted, de-duplicated ids.
+        """
+        # Translate the known table into code space once, so the scan compares integers
+        state_codes = self.states.codes
+        known_codes = {}
+        for domain, states in known.items():
+            code = self.domains.codes.get(domain)
+            if code is not None:
+                known_codes[code] = {state_codes[s] for s in states | COMMON_STATES if s in state_codes}
+        hits = defaultdict(set)
+        for d, o, st in zip(self.domain_col, self.object_col, self.state_col):
+            allowed = known_codes.get(d)
+            if allowed is not None and st not in allowed:
+                hits[(d, st)].add(o)
+        report = defaultdict(dict)
+        domains, states, object_ids = self.domains.values, self.states.values, self.object_ids.values
+        for (d, st), objects in sorted(hits.items(), key=lambda kv: (domains[kv[0][0]], states[kv[0][1]])):
+            domain = domains[d]
+            report[domain][states[st]] = sorted(f"{domain}.{object_ids[o]}" for o in objects)
+        return dict(report)
+
+def build_report(columns):
+    """Builds the JSON report: per-domain observed states plus the unknown ones."""
+    observed = defaultdict(lambda: defaultdict(int))
+    domains, states = columns.domains.values, columns.states.values
+    counts = defaultdict(int)
+    for d, st in zip(columns.domain_col, columns.state_col):
+        counts[(d, st)] += 1
+    for (d, st), n in counts.items():
+        observed[domains[d]][states[st]] += n
+    unknown = columns.unknown_states()
+    return {
+        'entities': len(columns),
+        'observed_states': {domain: dict(sorted(s.items())) for domain, s in sorted(observed.items())},
+        'unknown_states': unknown,
+    }
+
+def main():
     parser = argparse.ArgumentParser(description="Generate documentation for Home Assistant entity states.")
     parser.add_argument('--ha-path', type=str, default=os.path.expanduser('~/Documents/HA-Tools/config'),
                         help='Path to Home Assistant config directory (default: ~/Documents/HA-Tools/config)')
+    parser.add_argument('--entities-file', type=str,
+                        help='ha_entities.json or ha_entities.ndjson to read (default: newest in --ha-path)')
+    parser.add_argument('--history', action='store_true',
+                        help='Catalog every state recorded in <ha-path>/entity_history instead of one snapshot')
+    parser.add_argument('--output', type=str, help='Where to write the report (default: <ha-path>/entity_states.json)')
     parser.add_argument('--automations-dir', type=str, help='Path to your automations YAML folder (optional)')
     parser.add_argument('--scripts-dir', type=str, help='Path to your scripts YAML folder (optional)')
     args = parser.parse_args()
-    entities = load_entities(args.ha_path, scripts_dir=args.scripts_dir, automations_dir=args.automations_dir)
-    # ...rest of script unchanged...
+
+    if args.history:
+        entities = iter_history_entities(args.ha_path)
+    else:
+        entities_path = args.entities_file or find_entities_file(args.ha_path)
+        if not entities_path or not os.path.exists(entities_path):
+            print("ha_entities.json not found. Run get_ha_entities.py first.")
+            exit(1)
+        entities = iter_entities(entities_path)
+    try:
+        report = build_report(EntityColumns.from_entities(entities))
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON: {e}")
+        exit(1)
+
+    output = args.output or os.path.join(args.ha_path, 'entity_states.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    flagged = {eid for states in report['unknown_states'].values() for ids in states.values() for eid in ids}
+    print(f"Wrote entity state documentation to {output}")
+    print(f"Found custom/unknown states for {len(flagged)} entities.")
+
+if __name__ == "__main__":
+    main()
+
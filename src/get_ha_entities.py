@@ -6,23 +6,53 @@ Fetches all Home Assistant entities and their states via the REST API and writes
 - Connects to your Home Assistant instance using the REST API.
 - Retrieves all entity states and attributes.
 - Saves the result to ha_entities.json for use by other tools.
+- With --stream, parses the response incrementally and writes a compact
+  ha_entities.ndjson (one entity per line), so memory stays flat on large installs.
+- With --history, keeps a base snapshot plus per-run deltas so the state at any
+  earlier run can be rebuilt with --at.
+- With --mirror, keeps running: loads the states once over the WebSocket, then
+  applies state_changed events to an in-memory table and rewrites the snapshot
+  every --flush-interval seconds (and on SIGUSR1), so other tools always read
+  current data without HA ever sending the full state list again.
 
 Usage:
-  python get_ha_entities.py --ha-path <HA_CONFIG_PATH> [--automations-dir <DIR>] [--scripts-dir <DIR>]
+  python get_ha_entities.py --ha-path <HA_CONFIG_PATH> [--stream] [--quiet] [--domain a,b] [--match GLOB] [--history] [--at TIMESTAMP] [--mirror [--flush-interval S]] [--automations-dir <DIR>] [--scripts-dir <DIR>]
 
 
 Arguments:
   --ha-path <HA_CONFIG_PATH>   Path to the Home Assistant config directory (required)
+  --stream                     Stream the response into ha_entities.ndjson
+  --quiet                      Don't print entities to the console
+  --domain a,b                 Only print entities in these domains
+  --match GLOB                 Only print entities whose entity_id matches this glob
+  --history                    Also record the snapshot as a delta in <ha-path>/entity_history
+  --compact-days N             Fold history deltas older than N days into the base snapshot
+  --at TIMESTAMP               Rebuild the entities as of TIMESTAMP from the history (no HA request)
+  --output <FILE>              With --at, write the rebuilt entities to this NDJSON file
+  --mirror                     Keep the snapshot current from state_changed events until interrupted
+  --flush-interval S           With --mirror, seconds between snapshot writes when something changed (default: 30; 0 = only on SIGUSR1/exit)
   --automations-dir <DIR>      Path to your automations YAML folder (optional)
   --scripts-dir <DIR>          Path to your scripts YAML folder (optional)
 
-Requires: requests
+Requires: requests (websockets for --mirror)
 """
 
-import requests
 import json
 import os
 import argparse
+import codecs
+import fnmatch
+import tempfile
+import datetime
+from ha_helpers.client import get_http_session
+from ha_helpers.ratelimit import get_limiter
+from ha_helpers.snapshot_store import SnapshotStore, parse_ts
+
+# Folder (inside --ha-path) holding the base snapshot and per-run deltas
+HISTORY_DIR = 'entity_history'
+
+# Bytes read from the response at a time in --stream mode
+STREAM_CHUNK_SIZE = 64 * 1024
 
 def load_ha_config(ha_path, automations_dir=None, scripts_dir=None):
     # Prefer config.json in ~/Documents/HA-Tools/config/config.json
@@ -34,13 +64,173 @@ def load_ha_config(ha_path, automations_dir=None, scripts_dir=None):
     with open(config_path, 'r') as f:
         return json.load(f)
 
+def iter_json_array(chunks):
+    """Yields the elements of a top-level JSON array from an iterable of byte chunks.
+
+    Only the element being decoded and the current chunk are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf, pos = '', 0
+    started = False
+    for chunk in chunks:
+        buf = buf[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            # Skip whitespace and the separators between elements
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise json.JSONDecodeError("Expected a JSON array", buf, pos)
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element continues in the next chunk
+                break
+            if end == len(buf) and not isinstance(value, (dict, list)):
+                # A number at the end of the buffer may still have digits to come
+                break
+            yield value
+            pos = end
+    raise json.JSONDecodeError("Unexpected end of JSON array", buf, pos)
+
+def entity_filter(domains=None, pattern=None):
+    """Returns a predicate selecting entity_ids by domain and/or glob pattern."""
+    def selected(entity_id):
+        if domains and entity_id.split('.', 1)[0] not in domains:
+            return False
+        if pattern and not fnmatch.fnmatchcase(entity_id, pattern):
+            return False
+        return True
+    return selected
+
+def print_entity(entity):
+    print(f"Entity ID: {entity.get('entity_id')}")
+    print(f"State: {entity.get('state')}")
+    print("-" * 20)
+
+def stream_entities(session, url, out_path, show=None):
+    """Streams /api/states into an NDJSON snapshot, printing entities accepted by `show`.
+
+    The snapshot is written to a temp file and renamed into place when complete.
+    Returns the number of entities written.
+    """
+    count = 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), prefix='.ha_entities-')
+    try:
+        # Wrapped before the request, so the descriptor is closed even if the request fails
+        with os.fdopen(fd, 'w', encoding='utf-8') as out, session.get(url, stream=True) as response:
+            response.raise_for_status()
+            for entity in iter_json_array(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+                out.write(json.dumps(entity, separators=(',', ':'), ensure_ascii=False))
+                out.write('\n')
+                count += 1
+                if show and show(entity.get('entity_id', '')):
+                    print_entity(entity)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return count
+
+def iter_ndjson(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def record_history(ha_path, entities, compact_days=None):
+    """Records a snapshot in the history store and optionally compacts old deltas."""
+    store = SnapshotStore(os.path.join(ha_path, HISTORY_DIR))
+    summary = store.record(entities)
+    if summary['base']:
+        print(f"History: stored base snapshot of {summary['added']} entities")
+    else:
+        print(f"History: {summary['added']} added, {summary['changed']} changed, {summary['removed']} removed")
+    if compact_days is not None:
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=compact_days)
+        folded = store.compact(cutoff)
+        if folded:
+            print(f"History: compacted {folded} delta(s) into the base snapshot")
+
+def show_history_at(ha_path, ts, show=None, output=None):
+    """Rebuilds the entities as of `ts` from the history store without contacting HA."""
+    state = SnapshotStore(os.path.join(ha_path, HISTORY_DIR)).state_at(ts)
+    if output:
+        with open(output, 'w', encoding='utf-8') as out:
+            for entity in state.values():
+                out.write(json.dumps(entity, separators=(',', ':'), ensure_ascii=False) + '\n')
+    if show:
+        for entity in state.values():
+            if show(entity.get('entity_id', '')):
+                print_entity(entity)
+    print(f"Rebuilt {len(state)} entities as of {ts}" + (f" into {output}" if output else ""))
+
+def run_mirror(ha_url, token, out_path, flush_interval, show=None, rate_limit=None):
+    """Runs the live state mirror until Ctrl-C, printing changes accepted by `show`.
+
+    `rate_limit` is the "rate_limit" config object for the shared limiter.
+    """
+    import asyncio
+    from ha_helpers.client import HAAuthError
+    from ha_helpers.state_mirror import run_mirror as mirror_states
+
+    def on_event(event):
+        data = event.get('data') or {}
+        entity_id = data.get('entity_id', '')
+        if show(entity_id):
+            old, new = data.get('old_state') or {}, data.get('new_state') or {}
+            print(f"{entity_id}: {old.get('state', '-')} → {new.get('state', 'removed')}")
+
+    try:
+        asyncio.run(mirror_states(ha_url, token, out_path, flush_interval=flush_interval,
+                                  on_event=on_event if show else None,
+                                  limiter=get_limiter(ha_url, rate_limit)))
+    except HAAuthError as e:
+        print(f"Authentication failed: {e}")
+        exit(1)
+    except KeyboardInterrupt:
+        pass
+
 def main():
     parser = argparse.ArgumentParser(description="Fetch Home Assistant entities and states via REST API.")
     parser.add_argument('--ha-path', type=str, default=os.path.expanduser('~/Documents/HA-Tools/config'),
                         help='Path to Home Assistant config directory (default: ~/Documents/HA-Tools/config)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Parse the response incrementally and write a compact ha_entities.ndjson')
+    parser.add_argument('--quiet', action='store_true', help="Don't print entities to the console")
+    parser.add_argument('--domain', type=str, help='Comma-separated list of domains to print (e.g. light,switch)')
+    parser.add_argument('--match', type=str, help='Only print entities whose entity_id matches this glob (e.g. "*kitchen*")')
+    parser.add_argument('--history', action='store_true',
+                        help=f'Also record the snapshot as a delta in <ha-path>/{HISTORY_DIR}')
+    parser.add_argument('--compact-days', type=float,
+                        help='Fold history deltas older than this many days into the base snapshot')
+    parser.add_argument('--at', type=str,
+                        help='Rebuild the entities as of this ISO timestamp from the history instead of querying HA')
+    parser.add_argument('--output', type=str, help='With --at, write the rebuilt entities to this NDJSON file')
+    parser.add_argument('--mirror', action='store_true',
+                        help='Keep the snapshot current from state_changed events until interrupted')
+    parser.add_argument('--flush-interval', type=float, default=30,
+                        help='With --mirror, seconds between snapshot writes when something changed '
+                             '(default: 30; 0 = only on SIGUSR1 and exit)')
     parser.add_argument('--automations-dir', type=str, help='Path to your automations YAML folder (optional)')
     parser.add_argument('--scripts-dir', type=str, help='Path to your scripts YAML folder (optional)')
     args = parser.parse_args()
+    if args.mirror and (args.at or args.history):
+        parser.error("--mirror can't be combined with --at or --history")
+    if args.at:
+        try:
+            args.at = parse_ts(args.at)
+        except ValueError:
+            parser.error(f"--at: '{args.at}' is not an ISO timestamp (e.g. 2024-05-01T18:30:00+02:00)")
     config = load_ha_config(args.ha_path, automations_dir=args.automations_dir, scripts_dir=args.scripts_dir)
     HA_URL = config['HA_URL']
     HA_TOKEN = config['HA_TOKEN']
@@ -48,29 +238,52 @@ def main():
     scripts_dir = args.scripts_dir or config.get('SCRIPTS_DIR') or os.path.expanduser('~/Documents/HA-Tools/scripts')
     # Save ha_entities.json in config folder by default
     entities_path = os.path.join(args.ha_path, 'ha_entities.json')
-    headers = {
-        "Authorization": f"Bearer {HA_TOKEN}",
-        "Content-Type": "application/json",
-    }
+    show = None if args.quiet else entity_filter(
+        set(args.domain.split(',')) if args.domain else None, args.match)
+    if args.at:
+        show_history_at(args.ha_path, args.at, show=show, output=args.output)
+        return
+    if args.mirror:
+        out_path = os.path.join(args.ha_path, 'ha_entities.ndjson' if args.stream else 'ha_entities.json')
+        # Every change would be too much output; only filtered changes are printed
+        changes = show if not args.quiet and (args.domain or args.match) else None
+        run_mirror(HA_URL, HA_TOKEN, out_path, args.flush_interval, show=changes, rate_limit=config.get('rate_limit'))
+        return
+    # Only a live fetch needs requests; --at and --mirror never load it
+    import requests
+    session = get_http_session(HA_TOKEN, pool_size=1, limiter=get_limiter(HA_URL, config.get('rate_limit')))
     try:
-        response = requests.get(f"{HA_URL}/api/states", headers=headers)
+        if args.stream:
+            ndjson_path = os.path.join(args.ha_path, 'ha_entities.ndjson')
+            if show:
+                print(f"Home Assistant Entities and States (also saved to {ndjson_path}):")
+                print("------------------------------------")
+            count = stream_entities(session, f"{HA_URL}/api/states", ndjson_path, show=show)
+            print(f"Saved {count} entities to {ndjson_path}")
+            if args.history:
+                record_history(args.ha_path, iter_ndjson(ndjson_path), compact_days=args.compact_days)
+            return
+        response = session.get(f"{HA_URL}/api/states")
         response.raise_for_status()
         entities = response.json()
         with open(entities_path, 'w') as temp_file:
             json.dump(entities, temp_file, indent=2)
-        print(f"Home Assistant Entities and States (also saved to {entities_path}):")
-        print("------------------------------------")
-        for entity in entities:
-            entity_id = entity.get("entity_id")
-            state = entity.get("state")
-            attributes = entity.get("attributes", {})
-            print(f"Entity ID: {entity_id}")
-            print(f"State: {state}")
-            print("-" * 20)
+        if show:
+            print(f"Home Assistant Entities and States (also saved to {entities_path}):")
+            print("------------------------------------")
+            for entity in entities:
+                if show(entity.get("entity_id", "")):
+                    print_entity(entity)
+        else:
+            print(f"Saved {len(entities)} entities to {entities_path}")
+        if args.history:
+            record_history(args.ha_path, entities, compact_days=args.compact_days)
     except requests.exceptions.RequestException as e:
         print(f"Error communicating with Home Assistant API: {e}")
     except json.JSONDecodeError:
         print("Error decoding JSON response from Home Assistant API.")
+    finally:
+        session.close()
 
 if __name__ == "__main__":
     main()
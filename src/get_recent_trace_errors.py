@@ -7,12 +7,40 @@ Fetches recent Home Assistant automation/script trace errors using the WebSocket
 - Retrieves recent traces for automations and scripts.
 - Reports errors found in the last N minutes.
 
+- Requests are pipelined over one shared HAWebSocket (ha_helpers.client): many trace/list and trace/get
+  calls are in flight at once and replies are routed back by message id.
+- With --domain-wide, issues one trace/list per domain and only fetches full
+  traces for recent runs whose summary indicates an error.
+- Scans every instance in config.json's "instances" list concurrently from one
+  event loop, each over its own connection and concurrency limit; errors are
+  tagged with the instance name.
+- With --cache, finished traces are kept in SQLite under the logs folder so
+  repeat runs only fetch run_ids they have not seen; --since-last-run also
+  skips runs at or before each item's high-water mark.
+- With --analytics, every stored trace (not just failed ones) is streamed
+  through ha_helpers.trace_analytics and a report of the slowest automations
+  and steps, failing step paths and failing action types is printed.
+
 Usage:
-  python get_recent_trace_errors.py --ha-path <HA_CONFIG_PATH> [--minutes N] [--automations-dir <DIR>] [--scripts-dir <DIR>]
+  python get_recent_trace_errors.py --ha-path <HA_CONFIG_PATH> [--minutes N] [--concurrency N] [--domain-wide] [--cache] [--since-last-run] [--analytics [--top N]] [--instance a,b] [--automations-dir <DIR>] [--scripts-dir <DIR>]
 
 Arguments:
   --ha-path <HA_CONFIG_PATH>   Path to the Home Assistant config directory (required)
-  --minutes N                  How many minutes back to check for errors (default: 10)
+  --minutes N                  How many minutes back to check for errors (default: 10; all stored traces with --analytics)
+  --concurrency N              Maximum WebSocket requests in flight at once (default: 32); the adaptive
+                               limiter (config.json "rate_limit") runs fewer while HA is slow
+  --domain-wide                List traces once per domain instead of once per entity
+  --cache                      Reuse traces stored by earlier runs (SQLite in the logs folder)
+  --cache-path <FILE>          Location of the trace cache
+  --since-last-run             Only report runs newer than the previous cached run (implies --cache)
+  --cache-max-age-days N       Evict cached traces older than N days (default: 7)
+  --cache-max-entries N        Maximum number of cached traces (default: 50000)
+  --cache-max-mb N             Maximum total size of cached traces in MB (default: 256)
+  --stats                      Print per-request latency statistics and the adaptive limit at the end
+  --analytics                  Report slowest automations/steps and error hot-spots across the fetched traces
+  --top N                      Rows per --analytics table (default: 10)
+  --percentile P               Percentile shown next to p50 by --analytics (default: 95)
+  --instance a,b               Only scan these instances from config.json's "instances" list (default: all)
   --automations-dir <DIR>      Path to your automations YAML folder (optional)
   --scripts-dir <DIR>          Path to your scripts YAML folder (optional)
 
@@ -22,10 +50,26 @@ Requires: websockets, python-dateutil
 import json
 import datetime
 import asyncio
-import websockets
 import os
 import argparse
 from dateutil import parser, tz
+from ha_helpers.client import HAAuthError, websocket_url
+from ha_helpers.ws_client import HAWebSocket
+from ha_helpers.daemon_client import open_websocket
+from ha_helpers.ratelimit import get_limiter
+from ha_helpers.common import get_instances
+from ha_helpers.trace_analytics import TraceAggregator
+from ha_helpers.trace_cache import (
+    TraceCache, default_cache_path, DEFAULT_CACHE_NAME,
+    DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_MB,
+)
+
+# Maximum number of WebSocket requests in flight at once
+DEFAULT_CONCURRENCY = 32
+DEFAULT_MINUTES = 10
+
+# Rows per --analytics table
+DEFAULT_TOP = 10
 
 def load_ha_config(ha_path, automations_dir=None, scripts_dir=None):
     # Prefer config.json in ~/Documents/HA-Tools/config/config.json
@@ -37,103 +81,385 @@ def load_ha_config(ha_path, automations_dir=None, scripts_dir=None):
     with open(config_path, 'r') as f:
         return json.load(f)
 
-async def get_trace(ws, domain: str, item_id: str, run_id: str) -> dict:
-    await ws.send(json.dumps({
+async def get_trace(ws: HAWebSocket, domain: str, item_id: str, run_id: str) -> dict:
+    """Fetches one run's extended trace: its summary fields ("error", "script_execution",
+    "timestamp", ...) plus the per-step "trace" and the item's "config"."""
+    response = await ws.call({
         "type": "trace/get",
         "domain": domain,
         "item_id": item_id,
         "run_id": run_id
-    }))
-    response = json.loads(await ws.recv())
+    })
     if not response.get("success"):
         print(f"Failed to fetch trace for {domain}.{item_id} (run {run_id[:7]})")
         return None
-    return response.get("result", {}).get("trace", {})
+    return response.get("result", {})
 
-async def get_traces_for_item(ws, domain: str, item_id: str) -> list:
-    await ws.send(json.dumps({
+async def get_traces_for_item(ws: HAWebSocket, domain: str, item_id: str) -> list:
+    response = await ws.call({
         "type": "trace/list",
         "domain": domain,
         "item_id": item_id
-    }))
-    response = json.loads(await ws.recv())
+    })
     if not response.get("success"):
         print(f"Failed to list traces for {domain}.{item_id}")
         return []
     return response.get("result", [])
 
-async def get_recent_traces(ws, domain: str, entity_id: str, minutes: int = 10) -> list:
+async def get_domain_traces(ws: HAWebSocket, domain: str) -> list:
+    """Lists the stored trace summaries for every item in a domain with one request."""
+    response = await ws.call({
+        "type": "trace/list",
+        "domain": domain
+    })
+    if not response.get("success"):
+        print(f"Failed to list traces for domain {domain}")
+        return []
+    return response.get("result", [])
+
+def trace_start(trace_info: dict):
+    """Returns the start time of a trace summary, or None if it has none."""
+    timestamp = trace_info.get("timestamp")
+    # Newer HA versions report {"start": ..., "finish": ...}
+    if isinstance(timestamp, dict):
+        timestamp = timestamp.get("start")
+    if not timestamp:
+        return None
+    return parser.isoparse(timestamp)
+
+def is_recent(trace_info: dict, now, minutes: int) -> bool:
+    """True if the run started within `minutes`; every run counts when minutes is None."""
+    start = trace_start(trace_info)
+    return start is not None and (minutes is None or (now - start).total_seconds() <= minutes * 60)
+
+def summary_may_have_error(trace_info: dict) -> bool:
+    """Uses the fields of a trace summary to decide whether the full trace is worth fetching."""
+    if trace_info.get("error"):
+        return True
+    execution = trace_info.get("script_execution")
+    if execution is None:
+        # Summary doesn't say how the run ended; only the full trace can tell
+        return True
+    return execution in ("error", "aborted")
+
+async def collect_errors(ws: HAWebSocket, domain: str, candidates: list,
+                         cache: TraceCache = None, since_last_run: bool = False,
+                         analytics: TraceAggregator = None) -> list:
+    """Fetches the full trace for each (item_id, trace summary) pair and returns the errors.
+
+    With a cache, traces already stored are read from disk instead of HA, finished
+    runs are stored, and each item's high-water mark is advanced. With
+    since_last_run, runs at or before an item's high-water mark are skipped.
+    Each trace is added to `analytics` as it arrives and then dropped; only
+    the error records are kept.
+    """
+    if cache and since_last_run:
+        marks = cache.watermarks(domain)
+        candidates = [(item_id, info) for item_id, info in candidates
+                      if marks.get(item_id) is None or trace_start(info).timestamp() > marks[item_id]]
+
+    failed = set()
+
+    async def fetch(item_id, info):
+        trace = cache.get(domain, item_id, info["run_id"]) if cache else None
+        if trace is None:
+            trace = await get_trace(ws, domain, item_id, info["run_id"])
+            if trace is None:
+                failed.add((item_id, info["run_id"]))
+                return None
+            if cache and info.get("state") != "running":
+                cache.put(domain, item_id, info["run_id"], trace_start(info).timestamp(), trace)
+        if not trace:
+            return None
+        if analytics is not None and trace.get("state") != "running":
+            analytics.add(f"{domain}.{item_id}", trace)
+        if not trace.get("error"):
+            return None
+        return {
+            'trace_id': info["run_id"],
+            'timestamp': info.get("timestamp"),
+            'error': trace.get("error"),
+            'domain': domain,
+            'entity_id': item_id
+        }
+
+    # Fetch all candidate traces concurrently
+    fetched = await asyncio.gather(*(fetch(item_id, info) for item_id, info in candidates))
+    if failed and cache:
+        print(f"⚠️ Could not fetch {len(failed)} {domain} trace(s); they will be retried on the next run")
+    if cache:
+        advance_watermarks(cache, domain, candidates, failed)
+    return [err for err in fetched if err]
+
+def advance_watermarks(cache: TraceCache, domain: str, candidates: list, failed: set = frozenset()):
+    """Moves each item's high-water mark to its newest finished, fetched run.
+
+    The mark never passes a run that is still in progress or whose trace could
+    not be fetched (`failed` holds (item_id, run_id) pairs), so that run is
+    picked up again on the next scan.
+    """
+    finished, blocked = {}, {}
+    for item_id, info in candidates:
+        start = trace_start(info).timestamp()
+        pending = info.get("state") == "running" or (item_id, info["run_id"]) in failed
+        bucket = blocked if pending else finished
+        bucket.setdefault(item_id, []).append(start)
+    for item_id, starts in finished.items():
+        limit = min(blocked.get(item_id, [float("inf")]))
+        done = [start for start in starts if start < limit]
+        if done:
+            cache.advance_watermark(domain, item_id, max(done))
+
+async def get_recent_traces(ws: HAWebSocket, domain: str, entity_id: str, minutes: int = DEFAULT_MINUTES,
+                            cache: TraceCache = None, since_last_run: bool = False,
+                            analytics: TraceAggregator = None) -> list:
     traces = await get_traces_for_item(ws, domain, entity_id)
     now = datetime.datetime.now(tz=tz.UTC)
-    recent = []
-    for trace_info in traces:
-        run_id = trace_info.get("run_id")
-        if not run_id:
-            continue
-        start = parser.isoparse(trace_info.get("timestamp", ""))
-        if (now - start).total_seconds() > minutes * 60:
-            continue
-        trace = await get_trace(ws, domain, entity_id, run_id)
-        if not trace:
-            continue
-        if trace.get("error"):
-            recent.append({
-                'trace_id': run_id,
-                'timestamp': trace_info.get("timestamp"),
-                'error': trace.get("error"),
-                'domain': domain,
-                'entity_id': entity_id
-            })
-    return recent
-
-async def get_entities(ws, domain: str) -> list:
-    await ws.send(json.dumps({
+    candidates = [(entity_id, info) for info in traces if info.get("run_id") and is_recent(info, now, minutes)]
+    return await collect_errors(ws, domain, candidates, cache=cache, since_last_run=since_last_run,
+                                analytics=analytics)
+
+async def get_recent_domain_errors(ws: HAWebSocket, domain: str, entity_ids: list, minutes: int = DEFAULT_MINUTES,
+                                   cache: TraceCache = None, since_last_run: bool = False,
+                                   analytics: TraceAggregator = None) -> list:
+    """Finds recent errors for a whole domain from a single trace/list call.
+
+    Summaries are filtered locally by item, timestamp and error hints; only the
+    remaining runs are fetched with trace/get. With analytics every recent
+    run is fetched, since successful runs count towards the timings too.
+    """
+    known = set(entity_ids)
+    now = datetime.datetime.now(tz=tz.UTC)
+    candidates = [
+        (info["item_id"], info) for info in await get_domain_traces(ws, domain)
+        if info.get("run_id") and info.get("item_id") in known
+        and is_recent(info, now, minutes) and (analytics is not None or summary_may_have_error(info))
+    ]
+    return await collect_errors(ws, domain, candidates, cache=cache, since_last_run=since_last_run,
+                                analytics=analytics)
+
+async def get_entity_registry(ws: HAWebSocket) -> list:
+    """Fetches every entity_id in the entity registry with one request."""
+    response = await ws.call({
         "type": "config/entity_registry/list"
-    }))
-    response = json.loads(await ws.recv())
+    })
     if not response.get("success"):
         print(f"Failed to fetch entities")
         return []
-    return [e["entity_id"].split(".", 1)[1] 
-            for e in response.get("result", [])
-            if e["entity_id"].startswith(f"{domain}.")]
+    return [e["entity_id"] for e in response.get("result", [])]
 
-async def main_async(ha_path, minutes=10, automations_dir=None, scripts_dir=None):
-    ha_config = load_ha_config(ha_path, automations_dir=automations_dir, scripts_dir=scripts_dir)
-    url = ha_config['HA_URL'].replace('https://', 'wss://').replace('http://', 'ws://')
-    if not url.endswith('/api/websocket'):
-        url = url.rstrip('/') + '/api/websocket'
-    token = ha_config['HA_TOKEN']
-    async with websockets.connect(url) as ws:
-        auth_required = json.loads(await ws.recv())
-        await ws.send(json.dumps({"type": "auth", "access_token": token}))
-        auth_ok = json.loads(await ws.recv())
-        if auth_ok.get("type") != "auth_ok":
-            print("WebSocket authentication failed")
-            return
-        print(f"\nChecking for traces with errors in the last {minutes} minutes...")
-        all_errors = []
+async def get_entities(ws: HAWebSocket, domain: str, registry: list = None) -> list:
+    if registry is None:
+        registry = await get_entity_registry(ws)
+    return [entity_id.split(".", 1)[1]
+            for entity_id in registry
+            if entity_id.startswith(f"{domain}.")]
+
+def instance_cache_path(cache_path, instance, multiple):
+    """Gives each instance its own cache file when several are scanned, e.g. trace_cache-cabin.sqlite3."""
+    if not cache_path or not multiple:
+        return cache_path
+    root, ext = os.path.splitext(cache_path)
+    return f"{root}-{instance}{ext}"
+
+async def scan_instance(instance: dict, minutes=DEFAULT_MINUTES, concurrency=DEFAULT_CONCURRENCY, domain_wide=False,
+                        cache_path=None, since_last_run=False, cache_max_age_days=DEFAULT_MAX_AGE_DAYS,
+                        cache_max_entries=DEFAULT_MAX_ENTRIES, cache_max_mb=DEFAULT_MAX_MB,
+                        analytics: TraceAggregator = None):
+    """Scans one Home Assistant instance over its own connection and concurrency limit.
+
+    Returns (errors tagged with the instance name, latency stats). Connection
+    problems are reported and give no errors rather than stopping other instances.
+    """
+    name = instance['name']
+    # Goes through ha-daemon's warm connection when the daemon is running
+    concurrency = instance.get('concurrency') or concurrency
+    ws = open_websocket(websocket_url(instance['HA_URL']), instance['HA_TOKEN'], concurrency=concurrency,
+                        limiter=get_limiter(instance['HA_URL'], instance.get('rate_limit'), concurrency))
+    try:
+        await ws.connect()
+    except HAAuthError:
+        print(f"[{name}] WebSocket authentication failed")
+        return [], ws.stats
+    except OSError as e:
+        print(f"[{name}] Could not connect to Home Assistant: {e}")
+        return [], ws.stats
+    cache = None
+    if cache_path:
+        cache = TraceCache(cache_path, max_age_days=cache_max_age_days,
+                           max_entries=cache_max_entries, max_mb=cache_max_mb)
+    all_errors = []
+    try:
+        registry = await get_entity_registry(ws)
         for domain in ['script', 'automation']:
-            entities = await get_entities(ws, domain)
-            for eid in entities:
-                errors = await get_recent_traces(ws, domain, eid, minutes=minutes)
+            entities = await get_entities(ws, domain, registry=registry)
+            if domain_wide:
+                all_errors.extend(await get_recent_domain_errors(
+                    ws, domain, entities, minutes=minutes, cache=cache, since_last_run=since_last_run,
+                    analytics=analytics))
+                continue
+            results = await asyncio.gather(*(
+                get_recent_traces(ws, domain, eid, minutes=minutes, cache=cache,
+                                  since_last_run=since_last_run, analytics=analytics)
+                for eid in entities
+            ))
+            for errors in results:
                 all_errors.extend(errors)
-        if not all_errors:
-            print("No recent traces with errors found.")
-        else:
-            print(f"Found {len(all_errors)} traces with errors:")
-            for err in all_errors:
-                print(f"[{err['timestamp']}] {err['domain']}.{err['entity_id']} trace_id={err['trace_id'][:7]}\n  Error: {err['error']}\n")
+    except ConnectionError as e:
+        print(f"[{name}] Lost connection to Home Assistant: {e}")
+    finally:
+        await ws.close()
+        if cache:
+            cache.evict()
+            print(f"[{name}] Trace cache: {cache.hits} hit(s), {cache.misses} miss(es) ({cache.path})")
+            cache.close()
+    for err in all_errors:
+        err['instance'] = name
+    return all_errors, ws.stats
+
+def format_ms(value):
+    return '-' if value is None else f"{value:.0f}"
+
+def print_analytics(analytics: TraceAggregator, top=DEFAULT_TOP, pct=95):
+    """Prints the slowest items and steps, the failing step paths and the failing action types."""
+    print(f"\nAnalysed {analytics.traces} trace(s).")
+    if not analytics.traces:
+        return
+    label = f"p{pct:g} ms"
+    items = analytics.item_rows(pct)[:top]
+    width = max([len('item'), *(len(r['item']) for r in items)])
+    print(f"\nSlowest automations/scripts (by total run time):")
+    print(f"  {'item':<{width}} {'runs':>6} {'failed':>6} {'p50 ms':>9} {label:>9} {'max ms':>9} {'total s':>9}")
+    for r in items:
+        print(f"  {r['item']:<{width}} {r['runs']:>6} {r['failed']:>6} {format_ms(r['p50']):>9} "
+              f"{format_ms(r['pct']):>9} {format_ms(r['max']):>9} {r['total'] / 1000:>9.1f}")
+
+    steps = analytics.step_rows(pct)[:top]
+    if steps:
+        width = max([len('step'), *(len(f"{r['item']} {r['path']}") for r in steps)])
+        print(f"\nSlowest steps (by total time):")
+        print(f"  {'step':<{width}} {'type':<16} {'runs':>6} {'p50 ms':>9} {label:>9} {'max ms':>9} {'total s':>9}")
+        for r in steps:
+            print(f"  {r['item'] + ' ' + r['path']:<{width}} {r['type']:<16} {r['runs']:>6} "
+                  f"{format_ms(r['p50']):>9} {format_ms(r['pct']):>9} {format_ms(r['max']):>9} "
+                  f"{r['total'] / 1000:>9.1f}")
+    else:
+        print("\nNo step timings.")
+
+    failing = analytics.failing_steps()
+    if not failing:
+        print("\nNo failing steps.")
+        return
+    print(f"\nMost frequent failing steps:")
+    for r in failing[:top]:
+        print(f"  {r['failed']:>5}/{r['runs']:<5} {r['item']} {r['path']} ({r['type']})\n"
+              f"              Last error: {r['last_error']}")
+    print(f"\nFailing action types:")
+    for kind, failed, runs in analytics.failing_types()[:top]:
+        print(f"  {kind:<16} {failed:>6} of {runs:<6} ({failed / runs:.0%})")
+
+async def main_async(ha_path, minutes=DEFAULT_MINUTES, automations_dir=None, scripts_dir=None,
+                     concurrency=DEFAULT_CONCURRENCY, domain_wide=False, cache_path=None, since_last_run=False,
+                     cache_max_age_days=DEFAULT_MAX_AGE_DAYS, cache_max_entries=DEFAULT_MAX_ENTRIES,
+                     cache_max_mb=DEFAULT_MAX_MB, show_stats=False, instance_names=None,
+                     analytics=False, top=DEFAULT_TOP, percentile=95):
+    ha_config = load_ha_config(ha_path, automations_dir=automations_dir, scripts_dir=scripts_dir)
+    try:
+        instances = get_instances(ha_config, names=instance_names)
+    except ValueError as e:
+        print(e)
+        return
+    multiple = len(instances) > 1
+    window = "in all stored traces" if minutes is None else f"in the last {minutes} minutes"
+    print(f"\nChecking for traces with errors {window}"
+          + (f" on {len(instances)} instances..." if multiple else "..."))
+    # One aggregator per instance, so their automations aren't mixed up
+    aggregators = [TraceAggregator() if analytics else None for _ in instances]
+    # All instances are scanned concurrently from this one event loop
+    results = await asyncio.gather(*(
+        scan_instance(instance, minutes=minutes, concurrency=concurrency, domain_wide=domain_wide,
+                      cache_path=instance_cache_path(cache_path, instance['name'], multiple),
+                      since_last_run=since_last_run, cache_max_age_days=cache_max_age_days,
+                      cache_max_entries=cache_max_entries, cache_max_mb=cache_max_mb,
+                      analytics=aggregator)
+        for instance, aggregator in zip(instances, aggregators)
+    ))
+    all_errors = [err for errors, _ in results for err in errors]
+    if show_stats:
+        for instance, (_, stats) in zip(instances, results):
+            if multiple:
+                print(f"\n[{instance['name']}]")
+            print(stats.summary())
+            limiter = get_limiter(instance['HA_URL'], instance.get('rate_limit'))
+            # Unused when the scan went through ha-daemon
+            if limiter and limiter.smoothed is not None:
+                print(limiter.summary())
+    if not all_errors:
+        print("No recent traces with errors found.")
+    else:
+        print(f"Found {len(all_errors)} traces with errors:")
+        for err in all_errors:
+            tag = f"{err['instance']}: " if multiple else ""
+            print(f"[{err['timestamp']}] {tag}{err['domain']}.{err['entity_id']} trace_id={err['trace_id'][:7]}\n  Error: {err['error']}\n")
+    if analytics:
+        for instance, aggregator in zip(instances, aggregators):
+            if multiple:
+                print(f"\n=== {instance['name']} ===")
+            print_analytics(aggregator, top=top, pct=percentile)
 
 def main():
     parser = argparse.ArgumentParser(description="Fetch recent Home Assistant automation/script trace errors via WebSocket API.")
     parser.add_argument('--ha-path', type=str, default=os.path.expanduser('~/Documents/HA-Tools/config'),
                         help='Path to Home Assistant config directory (default: ~/Documents/HA-Tools/config)')
-    parser.add_argument('--minutes', type=int, default=10, help='How many minutes back to check for errors (default: 10)')
+    parser.add_argument('--minutes', type=int,
+                        help=f'How many minutes back to check for errors (default: {DEFAULT_MINUTES}; '
+                             'all stored traces with --analytics)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Maximum WebSocket requests in flight at once (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--domain-wide', action='store_true',
+                        help='List traces once per domain and only fetch runs whose summary shows an error')
+    parser.add_argument('--cache', action='store_true',
+                        help='Keep fetched traces in a local SQLite store and reuse them on later runs')
+    parser.add_argument('--cache-path', type=str,
+                        help=f'Location of the trace cache (default: <logs dir>/{DEFAULT_CACHE_NAME})')
+    parser.add_argument('--since-last-run', action='store_true',
+                        help='Only report runs newer than those seen by the previous cached run (implies --cache)')
+    parser.add_argument('--cache-max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help=f'Evict cached traces older than this (default: {DEFAULT_MAX_AGE_DAYS})')
+    parser.add_argument('--cache-max-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f'Maximum number of cached traces (default: {DEFAULT_MAX_ENTRIES})')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'Maximum total size of cached traces in MB (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--stats', action='store_true', help='Print per-request latency statistics at the end')
+    parser.add_argument('--analytics', action='store_true',
+                        help='Report the slowest automations and steps and the most frequent failing steps')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help=f'Rows per --analytics table (default: {DEFAULT_TOP})')
+    parser.add_argument('--percentile', type=float, default=95,
+                        help='Percentile shown next to p50 by --analytics (default: 95)')
+    parser.add_argument('--instance', type=str,
+                        help='Comma-separated instance names from config.json to scan (default: all)')
     parser.add_argument('--automations-dir', type=str, help='Path to your automations YAML folder (optional)')
     parser.add_argument('--scripts-dir', type=str, help='Path to your scripts YAML folder (optional)')
     args = parser.parse_args()
-    asyncio.run(main_async(args.ha_path, minutes=args.minutes, automations_dir=args.automations_dir, scripts_dir=args.scripts_dir))
+    if not 0 < args.percentile <= 100:
+        parser.error("--percentile must be between 0 and 100")
+    minutes = args.minutes
+    if minutes is None and not args.analytics:
+        minutes = DEFAULT_MINUTES
+    cache_path = None
+    if args.cache or args.since_last_run or args.cache_path:
+        cache_path = args.cache_path or default_cache_path(
+            load_ha_config(args.ha_path).get('LOGS_DIR'))
+    asyncio.run(main_async(args.ha_path, minutes=minutes, automations_dir=args.automations_dir,
+                           scripts_dir=args.scripts_dir, concurrency=args.concurrency,
+                           domain_wide=args.domain_wide, cache_path=cache_path,
+                           since_last_run=args.since_last_run,
+                           cache_max_age_days=args.cache_max_age_days,
+                           cache_max_entries=args.cache_max_entries, cache_max_mb=args.cache_max_mb,
+                           show_stats=args.stats,
+                           instance_names=args.instance.split(',') if args.instance else None,
+                           analytics=args.analytics, top=args.top, percentile=args.percentile))
 
 if __name__ == "__main__":
     main()
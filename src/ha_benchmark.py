@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+ha_benchmark.py
+
+End-to-end benchmarks for the ha-tools CLIs against mock_ha_server.py.
+
+- Starts a mock Home Assistant for each size and runs every scenario
+  (pull, push, trace_scan, entities, watchdog) in a fresh Python process, the
+  same way the CLI would run.
+- Reports wall time, the number of requests the mock served and the peak
+  RSS of the scenario process (including worker processes it started).
+- The startup scenario times `import ha_tools` plus loading each command's
+  module in a fresh interpreter (median of several runs), i.e. the time
+  before a command can make its first request; commands over the 100 ms
+  budget are flagged.
+- Results can be written as JSON and compared with a previous run to spot
+  regressions.
+
+Usage:
+  python ha_benchmark.py [--sizes 100,1000,10000] [--scenarios pull,push,...] [--latency MS]
+                         [--output results.json] [--compare baseline.json] [--threshold PCT]
+
+Arguments:
+  --sizes LIST          Comma-separated item counts to benchmark (default: 100,1000,10000)
+  --scenarios LIST      Comma-separated scenarios to run (default: all)
+  --latency MS          Delay the mock adds to every reply in milliseconds (default: 0)
+  --output FILE         Write the results as JSON
+  --compare FILE        Compare wall time against a previous --output file
+  --threshold PCT       Slowdown that counts as a regression in --compare (default: 20)
+  --startup-runs N      Fresh interpreters per command for the startup scenario (default: 5)
+
+Scenario sizes: N automations with stored traces, N entities, N/10 scripts,
+and a storm of N automation runs for the watchdog. push sends the files
+written by pull, so run pull first (the default order does). startup doesn't
+depend on the size and is reported once, with size 0.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from mock_ha_server import MockHA
+
+SCENARIOS = ('pull', 'push', 'trace_scan', 'entities', 'watchdog', 'startup')
+DEFAULT_SIZES = (100, 1000, 10000)
+DEFAULT_THRESHOLD = 20
+SCENARIO_TIMEOUT = 600
+
+# Commands timed by the startup scenario, and the import budget they should stay under
+STARTUP_COMMANDS = ('push', 'pull', 'entities', 'traces', 'watchdog', 'watchdog-log', 'decompose', 'state-doc')
+DEFAULT_STARTUP_RUNS = 5
+STARTUP_BUDGET = 0.1
+
+# Run in a fresh interpreter: time from importing the dispatcher to having the command's main()
+STARTUP_PROBE = (
+    "import sys, time; start = time.perf_counter(); import ha_tools; "
+    "ha_tools.load(sys.argv[1]).main; print(time.perf_counter() - start)"
+)
+
+def peak_rss_kb():
+    """Peak resident set size of this process and its reaped children, in KB (None if unknown)."""
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def write_config(workdir, server):
+    """Creates a config folder pointing at the mock, plus empty automations/scripts folders."""
+    config_dir = os.path.join(workdir, 'config')
+    for sub in ('config', 'automations', 'scripts', 'logs'):
+        os.makedirs(os.path.join(workdir, sub), exist_ok=True)
+    with open(os.path.join(config_dir, 'config.json'), 'w') as f:
+        json.dump({
+            'HA_URL': server.url,
+            'HA_TOKEN': server.token,
+            'AUTOMATIONS_DIR': os.path.join(workdir, 'automations'),
+            'SCRIPTS_DIR': os.path.join(workdir, 'scripts'),
+        }, f, indent=2)
+    return config_dir
+
+# ----- scenarios, run inside the child process ------------------------------
+
+def _run_cli(main, argv):
+    sys.argv = argv
+    main()
+
+def scenario_pull(config_dir, size):
+    import pull_automations
+    return lambda: _run_cli(pull_automations.main, ['pull-automations'])
+
+def scenario_push(config_dir, size):
+    import push_automation
+    return lambda: _run_cli(push_automation.main, ['push-automation', '--force', '--auto-overwrite'])
+
+def scenario_trace_scan(config_dir, size):
+    import get_recent_trace_errors
+    return lambda: _run_cli(get_recent_trace_errors.main,
+                            ['get-recent-trace-errors', '--ha-path', config_dir, '--minutes', '60'])
+
+def scenario_entities(config_dir, size):
+    import get_ha_entities
+    return lambda: _run_cli(get_ha_entities.main, ['get-ha-entities', '--ha-path', config_dir, '--quiet'])
+
+def scenario_watchdog(config_dir, size):
+    import asyncio
+    from automation_watchdog import Watchdog
+    from ha_helpers.client import websocket_url
+    with open(os.path.join(config_dir, 'config.json')) as f:
+        config = json.load(f)
+
+    async def watch():
+        # Runs until every run of the storm has been fetched or dropped
+        watchdog = Watchdog(websocket_url(config['HA_URL']), config['HA_TOKEN'], timeout=3)
+        task = asyncio.create_task(watchdog.run())
+        try:
+            while not task.done() and (watchdog.stats['events'] < size or watchdog.pending):
+                await asyncio.sleep(0.05)
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        return watchdog.stats
+
+    return lambda: asyncio.run(watch())
+
+def run_scenario(name, config_dir, size):
+    """Runs one scenario in this process and prints its measurements as a JSON line."""
+    os.environ['HA_TOOLS_CONFIG_BASE'] = config_dir
+    run = globals()[f"scenario_{name}"](config_dir, size)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        detail = run()
+        wall = time.perf_counter() - start
+    print(json.dumps({'wall': wall, 'peak_rss_kb': peak_rss_kb(),
+                      'detail': detail if isinstance(detail, dict) else None}))
+
+# ----- driver ---------------------------------------------------------------
+
+def measure(name, size, server, config_dir):
+    """Runs a scenario in a fresh interpreter and returns its result dict."""
+    server.reset_counts()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-scenario', name,
+         '--config-dir', config_dir, '--size', str(size)],
+        capture_output=True, text=True, timeout=SCENARIO_TIMEOUT,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    result = {'scenario': name, 'size': size, 'requests': server.total_requests,
+              'counts': dict(server.counts)}
+    lines = proc.stdout.strip().splitlines()
+    try:
+        result.update(json.loads(lines[-1]))
+    except (IndexError, ValueError):
+        result.update({'wall': None, 'peak_rss_kb': None,
+                       'error': (proc.stderr.strip().splitlines() or ['no output'])[-1]})
+    return result
+
+def measure_startup(command, runs=DEFAULT_STARTUP_RUNS):
+    """Median import time of a command in `runs` fresh interpreters, as a result dict."""
+    times = []
+    for _ in range(max(1, runs)):
+        proc = subprocess.run([sys.executable, '-c', STARTUP_PROBE, command], capture_output=True, text=True,
+                              timeout=60, cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            times.append(float(proc.stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            return {'scenario': f"startup:{command}", 'size': 0, 'requests': 0, 'wall': None, 'peak_rss_kb': None,
+                    'error': (proc.stderr.strip().splitlines() or ['no output'])[-1]}
+    wall = statistics.median(times)
+    result = {'scenario': f"startup:{command}", 'size': 0, 'requests': 0, 'wall': wall, 'peak_rss_kb': None}
+    if wall > STARTUP_BUDGET:
+        result['error'] = f"over the {STARTUP_BUDGET * 1000:.0f} ms budget"
+    return result
+
+def run_benchmarks(sizes, scenarios, latency=0.0, startup_runs=DEFAULT_STARTUP_RUNS):
+    results = []
+    if 'startup' in scenarios:
+        for command in STARTUP_COMMANDS:
+            result = measure_startup(command, startup_runs)
+            print_result(result)
+            results.append(result)
+        scenarios = [name for name in scenarios if name != 'startup']
+        if not scenarios:
+            return results
+    for size in sizes:
+        server = MockHA(entities=size, automations=size, scripts=max(1, size // 10),
+                        latency=latency, storm=size).start_in_thread()
+        try:
+            with tempfile.TemporaryDirectory(prefix='ha-bench-') as workdir:
+                config_dir = write_config(workdir, server)
+                for name in scenarios:
+                    result = measure(name, size, server, config_dir)
+                    print_result(result)
+                    results.append(result)
+        finally:
+            server.stop()
+    return results
+
+def print_result(result):
+    wall = f"{result['wall']:.2f}" if result.get('wall') is not None else 'failed'
+    rss = f"{result['peak_rss_kb'] / 1024:.1f}" if result.get('peak_rss_kb') else 'n/a'
+    line = f"{result['scenario']:<21} {result['size']:>7} {wall:>9} {result['requests']:>9} {rss:>10}"
+    if result.get('error'):
+        line += f"  {result['error']}"
+    print(line, flush=True)
+
+def compare(results, baseline_path, threshold):
+    """Prints scenarios whose wall time grew by more than `threshold` percent; returns their count."""
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['scenario'], r['size']): r for r in json.load(f)}
+    regressions = 0
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result['scenario'], result['size']))
+        if not old or not old.get('wall') or result.get('wall') is None:
+            continue
+        change = (result['wall'] - old['wall']) / old['wall'] * 100
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  <-- regression'
+        print(f"  {result['scenario']:<21} {result['size']:>7} {old['wall']:>8.2f}s -> "
+              f"{result['wall']:>8.2f}s ({change:+.0f}%){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ha-tools CLIs against a mock Home Assistant.")
+    parser.add_argument('--sizes', type=str, default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma-separated item counts (default: 100,1000,10000)')
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: {','.join(SCENARIOS)})")
+    parser.add_argument('--latency', type=float, default=0, help='Delay added to every mock reply in ms (default: 0)')
+    parser.add_argument('--output', type=str, help='Write the results as JSON')
+    parser.add_argument('--compare', type=str, help='Compare wall time against a previous --output file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Slowdown in percent that counts as a regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--startup-runs', type=int, default=DEFAULT_STARTUP_RUNS,
+                        help=f'Fresh interpreters per command for the startup scenario (default: {DEFAULT_STARTUP_RUNS})')
+    # Internal: run a single scenario in this process
+    parser.add_argument('--run-scenario', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--config-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_scenario(args.run_scenario, args.config_dir, args.size)
+        return
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    print(f"{'scenario':<21} {'size':>7} {'wall s':>9} {'requests':>9} {'peak MB':>10}")
+    results = run_benchmarks(sizes, scenarios, latency=args.latency / 1000, startup_runs=args.startup_runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {args.output}")
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+ha_daemon.py
+
+Optional background daemon that keeps Home Assistant connections warm for the CLIs.
+
+- Listens on a Unix socket next to config.json (ha-daemon.sock, owner-only).
+- push-automation, pull-automations and get-recent-trace-errors send their
+  HTTP requests and WebSocket commands through it when it is running, so a
+  call skips the TLS connect and the WebSocket auth handshake; without the
+  daemon they connect directly as before.
+- Keeps one authenticated WebSocket and one pooled HTTP session per Home
+  Assistant URL/token it is asked about.
+- Caches the entity registry (until entity_registry_updated or --registry-ttl),
+  trace lists (until the next automation/script run or --trace-list-ttl) and
+  finished traces, which never change.
+- Paces each Home Assistant instance with one adaptive limiter (config.json
+  "rate_limit") shared by every CLI talking through it.
+
+Usage:
+  python ha_daemon.py [--detach] [--idle-timeout MINUTES] [--trace-list-ttl S] [--registry-ttl S]
+  python ha_daemon.py --status | --stop
+
+Arguments:
+  --detach                 Start in the background (output goes to ha-daemon.log in the logs folder)
+  --idle-timeout MINUTES   Exit after this long without requests (default: 0 = never)
+  --trace-list-ttl S       Longest time a trace list is served from cache (default: 10)
+  --registry-ttl S         Longest time the entity registry is served from cache (default: 300)
+  --status                 Show whether the daemon runs, its connections and cache hits
+  --stop                   Stop a running daemon
+  --socket PATH            Socket to use (default: ha-daemon.sock next to config.json)
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from ha_helpers.client import DEFAULT_TIMEOUT, DEFAULT_RETRIES, HAAuthError, get_http_session
+from ha_helpers.common import get_config, get_default_folders, get_instances
+from ha_helpers.daemon_client import MAX_LINE, daemon_available, get_socket_path, request
+from ha_helpers.ratelimit import get_limiter, instance_key
+
+DEFAULT_TRACE_LIST_TTL = 10.0
+DEFAULT_REGISTRY_TTL = 300.0
+
+# Finished traces kept in memory
+MAX_CACHED_TRACES = 5000
+
+# HTTP requests run in threads, since requests is blocking
+HTTP_THREADS = 16
+
+# Upper bound on WebSocket commands in flight per instance
+WS_CONCURRENCY = 64
+
+# Events after which cached data may be stale
+RUN_EVENTS = ('automation_triggered', 'script_started')
+REGISTRY_EVENT = 'entity_registry_updated'
+
+def log(msg):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+class Backend:
+    """One warm, authenticated WebSocket to a Home Assistant instance, with its caches."""
+
+    def __init__(self, url, token, counts, trace_list_ttl=DEFAULT_TRACE_LIST_TTL, registry_ttl=DEFAULT_REGISTRY_TTL,
+                 limiter=None):
+        self.url = url
+        self.token = token
+        self.counts = counts
+        self.limiter = limiter
+        self.trace_list_ttl = trace_list_ttl
+        self.registry_ttl = registry_ttl
+        self.ws = None
+        self.lock = asyncio.Lock()
+        self.connects = 0
+        self.lists = {}
+        self.traces = collections.OrderedDict()
+
+    async def ensure(self):
+        """Connects and authenticates unless already connected; raises HAAuthError on a bad token."""
+        from ha_helpers.ws_client import HAWebSocket
+        async with self.lock:
+            if self.ws and self.ws.connected:
+                return
+            if self.ws:
+                await self.ws.close()
+            self.ws = HAWebSocket(self.url, self.token, concurrency=WS_CONCURRENCY, limiter=self.limiter)
+            await self.ws.connect()
+            self.connects += 1
+            # Anything cached may have changed while we weren't listening
+            self.lists.clear()
+            for event_type in RUN_EVENTS:
+                await self._subscribe(event_type, self._run_started)
+            await self._subscribe(REGISTRY_EVENT, self._registry_updated)
+            log(f"Connected to {self.url}")
+
+    async def _subscribe(self, event_type, callback):
+        try:
+            await self.ws.subscribe(event_type, callback)
+        except RuntimeError as e:
+            # Non-admin tokens can't subscribe to every event; the TTLs still apply
+            log(f"⚠️ {e}")
+
+    def _run_started(self, event):
+        self.lists = {key: value for key, value in self.lists.items() if key[0] != 'trace/list'}
+
+    def _registry_updated(self, event):
+        self.lists.pop(('config/entity_registry/list',), None)
+
+    def _cached(self, payload):
+        kind = payload.get('type')
+        if kind == 'trace/get':
+            key = (payload.get('domain'), payload.get('item_id'), payload.get('run_id'))
+            reply = self.traces.get(key)
+            if reply is not None:
+                self.traces.move_to_end(key)
+            return reply
+        entry = self.lists.get(self._list_key(payload))
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    @staticmethod
+    def _list_key(payload):
+        kind = payload.get('type')
+        if kind == 'trace/list':
+            return (kind, payload.get('domain'), payload.get('item_id'))
+        if kind == 'config/entity_registry/list':
+            return (kind,)
+        return None
+
+    def _store(self, payload, reply):
+        if not reply.get('success'):
+            return
+        kind = payload.get('type')
+        result = reply.get('result')
+        if kind == 'trace/get':
+            # A running trace still changes; finished ones never do
+            if isinstance(result, dict) and result.get('state') != 'running':
+                self.traces[(payload.get('domain'), payload.get('item_id'), payload.get('run_id'))] = reply
+                while len(self.traces) > MAX_CACHED_TRACES:
+                    self.traces.popitem(last=False)
+        elif kind == 'trace/list':
+            # Running traces finish without a new run event, so those lists aren't kept
+            if not any(isinstance(t, dict) and t.get('state') == 'running' for t in result or ()):
+                self.lists[self._list_key(payload)] = (time.monotonic() + self.trace_list_ttl, reply)
+        elif kind == 'config/entity_registry/list':
+            self.lists[self._list_key(payload)] = (time.monotonic() + self.registry_ttl, reply)
+
+    async def call(self, payload, timeout, retries):
+        cached = self._cached(payload)
+        if cached is not None:
+            self.counts['cache hits'] += 1
+            return cached
+        await self.ensure()
+        try:
+            reply = await self.ws.call(payload, timeout=timeout, retries=retries)
+        except ConnectionError:
+            # The connection dropped since the last command; reconnect once
+            await self.ensure()
+            reply = await self.ws.call(payload, timeout=timeout, retries=retries)
+        self._store(payload, reply)
+        return reply
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+
+class Daemon:
+    def __init__(self, path, idle_timeout=0, trace_list_ttl=DEFAULT_TRACE_LIST_TTL, registry_ttl=DEFAULT_REGISTRY_TTL):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.trace_list_ttl = trace_list_ttl
+        self.registry_ttl = registry_ttl
+        self.backends = {}
+        self.sessions = {}
+        self.counts = collections.Counter()
+        self.started = time.time()
+        self.last_request = time.monotonic()
+        self.stopping = None
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_THREADS)
+        self.rate_limits = load_rate_limits()
+
+    def limiter(self, url, max_concurrency):
+        key = instance_key(url)
+        return get_limiter(key, self.rate_limits.get(key, self.rate_limits.get(None)), max_concurrency)
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        if os.path.exists(self.path):
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(self.path)
+        # Create the socket owner-only from the start; a chmod after bind would leave a
+        # window in which anyone could connect and use the HA tokens
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._client, self.path, limit=MAX_LINE)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.path, 0o600)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        log(f"ha-daemon listening on {self.path} (pid {os.getpid()})")
+        idle = asyncio.create_task(self._idle_watch()) if self.idle_timeout else None
+        try:
+            await self.stopping.wait()
+        finally:
+            if idle:
+                idle.cancel()
+            server.close()
+            await server.wait_closed()
+            for backend in self.backends.values():
+                await backend.close()
+            for session in self.sessions.values():
+                session.close()
+            self.pool.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            log("ha-daemon stopped")
+
+    async def _idle_watch(self):
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            if time.monotonic() - self.last_request > self.idle_timeout:
+                log(f"No requests for {self.idle_timeout / 60:g} minute(s); exiting")
+                self.stopping.set()
+                return
+
+    async def _client(self, reader, writer):
+        tasks = set()
+        lock = asyncio.Lock()
+
+        async def handle(msg):
+            try:
+                reply = await self.handle(msg)
+            except Exception as e:
+                reply = {'error': f"ha-daemon: {type(e).__name__}: {e}", 'kind': 'error'}
+            async with lock:
+                writer.write((json.dumps({'id': msg.get('id'), **reply}) + '\n').encode('utf-8'))
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(handle(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def handle(self, msg):
+        op = msg.get('op')
+        self.last_request = time.monotonic()
+        self.counts[op] += 1
+        if op == 'http':
+            return await self._http(msg)
+        if op in ('ws', 'ws_connect'):
+            key = (msg['url'], msg['token'])
+            backend = self.backends.get(key)
+            if backend is None:
+                backend = self.backends[key] = Backend(msg['url'], msg['token'], self.counts,
+                                                       self.trace_list_ttl, self.registry_ttl,
+                                                       limiter=self.limiter(msg['url'], WS_CONCURRENCY))
+            try:
+                if op == 'ws_connect':
+                    await backend.ensure()
+                    return {'ok': True}
+                reply = await backend.call(msg['payload'], msg.get('timeout') or DEFAULT_TIMEOUT,
+                                           msg.get('retries', DEFAULT_RETRIES))
+                return {'reply': reply}
+            except HAAuthError as e:
+                # A rejected token must not stay around for the next caller
+                self.backends.pop(key, None)
+                return {'error': str(e), 'kind': 'auth'}
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                return {'error': str(e) or type(e).__name__, 'kind': 'connection'}
+        if op == 'status':
+            return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'requests': dict(self.counts),
+                    'websockets': [{'url': b.url, 'connected': bool(b.ws and b.ws.connected), 'connects': b.connects,
+                                    'cached_lists': len(b.lists), 'cached_traces': len(b.traces)}
+                                   for b in self.backends.values()],
+                    'http_sessions': len(self.sessions),
+                    'limits': {instance_key(b.url): b.limiter.summary() for b in self.backends.values() if b.limiter}}
+        if op == 'stop':
+            self.stopping.set()
+            return {'ok': True}
+        if op == 'ping':
+            return {'ok': True}
+        return {'error': f"unknown op {op!r}", 'kind': 'error'}
+
+    async def _http(self, msg):
+        import requests
+        session = self.sessions.get(msg['token'])
+        if session is None:
+            session = self.sessions[msg['token']] = get_http_session(
+                msg['token'], pool_size=HTTP_THREADS, limiter=self.limiter(msg['url'], HTTP_THREADS))
+        loop = asyncio.get_running_loop()
+        try:
+            resp = await loop.run_in_executor(self.pool, lambda: session.request(
+                msg['method'], msg['url'], data=msg.get('body'), timeout=msg.get('timeout') or DEFAULT_TIMEOUT))
+        except requests.exceptions.RequestException as e:
+            return {'error': str(e), 'kind': 'connection'}
+        return {'status': resp.status_code, 'body': resp.text}
+
+def load_rate_limits():
+    """instance_key -> "rate_limit" settings from config.json; None holds the top-level ones."""
+    try:
+        config = get_config()
+        limits = {instance_key(i['HA_URL']): i['rate_limit'] for i in get_instances(config)}
+    except (OSError, ValueError) as e:
+        log(f"⚠️ Using default rate limits: {e}")
+        return {}
+    limits[None] = config.get('rate_limit')
+    return limits
+
+def print_status(path):
+    if not daemon_available(path):
+        print("ha-daemon is not running.")
+        sys.exit(1)
+    status = request({'op': 'status'}, path)
+    print(f"ha-daemon running (pid {status['pid']}, up {status['uptime'] / 60:.0f} min) on {path}")
+    requests_by_op = status.get('requests', {})
+    if requests_by_op:
+        print("Requests: " + ", ".join(f"{op} {count}" for op, count in sorted(requests_by_op.items())))
+    for ws in status['websockets']:
+        state = 'connected' if ws['connected'] else 'disconnected'
+        print(f"  {ws['url']}: {state}, {ws['connects']} connect(s), {ws['cached_lists']} cached list(s), "
+              f"{ws['cached_traces']} cached trace(s)")
+    print(f"  HTTP sessions: {status['http_sessions']}")
+    for url, summary in status.get('limits', {}).items():
+        print(f"  {url}: {summary}")
+
+def detach(argv, path):
+    """Starts the daemon as a background process and waits for its socket."""
+    logs = get_default_folders()[4]
+    os.makedirs(logs, exist_ok=True)
+    log_path = os.path.join(logs, 'ha-daemon.log')
+    with open(log_path, 'a') as out:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv], stdin=subprocess.DEVNULL,
+                                stdout=out, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if daemon_available(path):
+            print(f"ha-daemon started (pid {proc.pid}); log: {log_path}")
+            return
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    print(f"ha-daemon did not start; see {log_path}")
+    sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep Home Assistant connections warm for the ha-tools CLIs.")
+    parser.add_argument('--detach', action='store_true', help='Start in the background')
+    parser.add_argument('--idle-timeout', type=float, default=0,
+                        help='Exit after this many minutes without requests (default: 0 = never)')
+    parser.add_argument('--trace-list-ttl', type=float, default=DEFAULT_TRACE_LIST_TTL,
+                        help=f'Longest time a trace list is served from cache in seconds (default: {DEFAULT_TRACE_LIST_TTL:g})')
+    parser.add_argument('--registry-ttl', type=float, default=DEFAULT_REGISTRY_TTL,
+                        help=f'Longest time the entity registry is served from cache in seconds (default: {DEFAULT_REGISTRY_TTL:g})')
+    parser.add_argument('--status', action='store_true', help='Show whether the daemon runs and what it holds')
+    parser.add_argument('--stop', action='store_true', help='Stop a running daemon')
+    parser.add_argument('--socket', type=str, help='Socket to use (default: ha-daemon.sock next to config.json)')
+    args = parser.parse_args()
+
+    if not hasattr(asyncio, 'start_unix_server'):
+        print("ha-daemon needs Unix domain sockets, which this platform doesn't support.")
+        sys.exit(1)
+    path = args.socket or get_socket_path()
+    if args.status:
+        print_status(path)
+        return
+    if args.stop:
+        if not daemon_available(path):
+            print("ha-daemon is not running.")
+            return
+        request({'op': 'stop'}, path)
+        print("ha-daemon stopped.")
+        return
+    if daemon_available(path):
+        print(f"ha-daemon is already running on {path}.")
+        return
+    if args.detach:
+        detach([a for a in sys.argv[1:] if a != '--detach'], path)
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    daemon = Daemon(path, idle_timeout=args.idle_timeout * 60, trace_list_ttl=args.trace_list_ttl,
+                    registry_ttl=args.registry_ttl)
+    asyncio.run(daemon.serve())
+
+if __name__ == "__main__":
+    main()
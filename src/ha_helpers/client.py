@@ -0,0 +1,99 @@
+"""
+client.py
+
+Shared Home Assistant client used by the ha-tools CLIs.
+
+- get_http_session(): pooled keep-alive requests Session with auth headers,
+  default timeouts, retry with jitter and per-call latency stats.
+- HAWebSocket (ha_helpers.ws_client): one authenticated WebSocket carrying
+  many concurrent commands; replies are routed back to callers by message id,
+  and event subscriptions are dispatched to callbacks.
+- Both take an optional AdaptiveLimiter (ha_helpers.ratelimit) that paces
+  requests to an instance by latency and errors.
+- Each transport lives in its own module and requests is imported on first
+  use, so a tool only loads requests or asyncio/websockets if it needs them.
+"""
+import math
+import random
+import urllib.parse
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 8
+DEFAULT_CONCURRENCY = 32
+RETRY_BASE_DELAY = 0.25
+
+class HAAuthError(Exception):
+    """Raised when Home Assistant rejects the access token."""
+
+def websocket_url(ha_url):
+    """Turns an http(s) Home Assistant URL into its /api/websocket URL."""
+    url = ha_url.replace('https://', 'wss://').replace('http://', 'ws://')
+    if not url.endswith('/api/websocket'):
+        url = url.rstrip('/') + '/api/websocket'
+    return url
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    return random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt)
+
+class LatencyStats:
+    """Per-operation call counts, errors and latency, with log-spaced buckets for percentiles."""
+
+    # Bucket i holds latencies up to 2**(i/2) ms; the last bucket is open-ended
+    BUCKETS = 40
+
+    def __init__(self):
+        self.ops = {}
+
+    def record(self, op, seconds, error=False):
+        entry = self.ops.get(op)
+        if entry is None:
+            entry = self.ops[op] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                    'buckets': [0] * self.BUCKETS}
+        entry['count'] += 1
+        entry['errors'] += bool(error)
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        ms = max(seconds * 1000, 1e-3)
+        entry['buckets'][min(self.BUCKETS - 1, max(0, math.ceil(2 * math.log2(ms))))] += 1
+
+    def percentile(self, op, pct):
+        """Returns an upper bound (in seconds) for the given latency percentile."""
+        entry = self.ops[op]
+        rank = pct / 100 * entry['count']
+        seen = 0
+        for i, n in enumerate(entry['buckets']):
+            seen += n
+            if seen >= rank and n:
+                return min(2 ** (i / 2) / 1000, entry['max'])
+        return entry['max']
+
+    def summary(self):
+        """Returns a printable table of every operation seen."""
+        lines = [f"{'operation':<48} {'calls':>6} {'errors':>6} {'avg ms':>8} {'p95 ms':>8} {'max ms':>8}"]
+        for op, entry in sorted(self.ops.items()):
+            avg = entry['total'] / entry['count'] * 1000
+            lines.append(f"{op[:48]:<48} {entry['count']:>6} {entry['errors']:>6} {avg:>8.1f} "
+                         f"{self.percentile(op, 95) * 1000:>8.1f} {entry['max'] * 1000:>8.1f}")
+        return '\n'.join(lines)
+
+def http_op(method, url):
+    """Names an HTTP call for latency stats, collapsing per-entity path segments."""
+    parts = urllib.parse.urlsplit(url).path.rstrip('/').split('/')
+    # e.g. /api/config/automation/config/<id> -> /api/config/automation/config/{id}
+    if len(parts) > 5:
+        parts = parts[:5] + ['{id}']
+    return f"{method.upper()} {'/'.join(parts)}"
+
+def get_http_session(ha_token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                     retries=DEFAULT_RETRIES, stats=None, limiter=None):
+    """Returns an HASession with pooled keep-alive connections and auth headers."""
+    from requests.adapters import HTTPAdapter
+    from ha_helpers.http_session import HASession
+    session = HASession(timeout=timeout, retries=retries, stats=stats, limiter=limiter)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({"Authorization": f"Bearer {ha_token}", "Content-Type": "application/json"})
+    return session
@@ -1,13 +1,47 @@
 import os
 import json
-import requests
-import yaml
+import hashlib
+import stat
+import tempfile
+import concurrent.futures
+
+# Name of the file recording the content hash of each automation/script last pushed or pulled
+MANIFEST_NAME = 'push_manifest.json'
+
+# Below this many items, YAML is rendered inline rather than in worker processes
+PARALLEL_RENDER_THRESHOLD = 200
 
 # Get the path to the config file
 def get_config_path():
     config_base = os.environ.get('HA_TOOLS_CONFIG_BASE', os.path.expanduser('~/Documents/HA-Tools/config'))
     return os.path.join(config_base, 'config.json')
 
+# Name used for the instance described by the top-level HA_URL/HA_TOKEN
+DEFAULT_INSTANCE = 'default'
+
+# List the Home Assistant instances in a config.
+# Either an "instances" list ([{"name", "HA_URL", "HA_TOKEN", "concurrency"?}, ...]) or
+# the single top-level HA_URL/HA_TOKEN; lower-case keys are accepted as well.
+# Returns [{"name", "HA_URL", "HA_TOKEN", "concurrency"}] with concurrency None when unset.
+def get_instances(config, names=None):
+    entries = config.get('instances') or [{'name': config.get('name') or DEFAULT_INSTANCE, **config}]
+    instances = []
+    for idx, entry in enumerate(entries):
+        url = entry.get('HA_URL') or entry.get('ha_url')
+        token = entry.get('HA_TOKEN') or entry.get('ha_token')
+        name = str(entry.get('name') or f"instance{idx + 1}")
+        if not url or not token:
+            raise ValueError(f"Instance '{name}' in config.json needs HA_URL and HA_TOKEN")
+        instances.append({'name': name, 'HA_URL': url.rstrip('/'), 'HA_TOKEN': token,
+                          'concurrency': entry.get('concurrency'),
+                          'rate_limit': entry.get('rate_limit', config.get('rate_limit'))})
+    if names:
+        unknown = set(names) - {i['name'] for i in instances}
+        if unknown:
+            raise ValueError(f"Unknown instance(s): {', '.join(sorted(unknown))}")
+        instances = [i for i in instances if i['name'] in names]
+    return instances
+
 # Get the default folder structure for config, automations, scripts, logs, and prints
 def get_default_folders():
     base = os.path.expanduser('~/Documents/HA-Tools')
@@ -26,30 +60,156 @@ def get_config():
     with open(config_path, 'r') as f:
         return json.load(f)
 
-# Pull and save automations or scripts from Home Assistant
-def pull_and_save_ha_items(item_type, api_path, save_dir, ha_url, ha_token):
-    headers = {"Authorization": f"Bearer {ha_token}", "Content-Type": "application/json"}
+# Find the newest of ha_entities.json / ha_entities.ndjson in ha_path (or the default config folder)
+def find_entities_file(ha_path):
+    for base in (ha_path, os.path.expanduser('~/Documents/HA-Tools/config')):
+        candidates = [os.path.join(base, name) for name in ('ha_entities.json', 'ha_entities.ndjson')]
+        candidates = [path for path in candidates if os.path.exists(path)]
+        if candidates:
+            return max(candidates, key=os.path.getmtime)
+    return None
+
+# Yield entity dicts from a JSON array or NDJSON (one entity per line) snapshot
+def iter_entities(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+# Hash of an automation/script that ignores key order and YAML formatting
+def content_hash(content):
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# Manifest key for an automation/script, e.g. "automation.morning_lights"
+def manifest_key(item_type, entity_id):
+    return f"{item_type}.{entity_id}"
+
+def get_manifest_path():
+    return os.path.join(os.path.dirname(get_config_path()), MANIFEST_NAME)
+
+# Load the content-hash manifest ({key: sha256}); missing or unreadable manifests are empty
+def load_manifest(path=None):
+    path = path or get_manifest_path()
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Save the content-hash manifest, replacing the old file atomically
+def save_manifest(manifest, path=None):
+    path = path or get_manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, json.dumps(manifest, indent=2, sort_keys=True))
+
+# The process umask, read once at import: it can only be read by setting it,
+# which would race with other threads if done on every write
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Write a file via a temp file + rename so readers never see a partial file
+def atomic_write(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # mkstemp creates the file 0600; keep the target's mode, or the umask default for new files
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Write a file only if its content differs from what is on disk; returns True if written
+def write_if_changed(path, text):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    atomic_write(path, text)
+    return True
+
+# File name used for a pulled automation/script
+def item_filename(entity_id):
+    return str(entity_id).replace('.', '_').replace(' ', '_') + ".yaml"
+
+# Serialize one pulled item; module-level so it can run in a worker process
+def render_item(item):
+    import yaml
+    return yaml.dump(item, default_flow_style=False, allow_unicode=True)
+
+# Render many items, in a process pool when there are enough to be worth it
+def render_items(items, workers=None):
+    if len(items) < PARALLEL_RENDER_THRESHOLD or workers == 1:
+        return [render_item(item) for item in items]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(render_item, items, chunksize=32))
+    except (OSError, concurrent.futures.BrokenExecutor):
+        # Some platforms can't start worker processes; render inline instead
+        return [render_item(item) for item in items]
+
+# Pull and save automations or scripts from Home Assistant.
+# Only files whose content changed are rewritten. Items that were pulled before
+# but no longer exist upstream are reported, and deleted when prune is set.
+def pull_and_save_ha_items(item_type, api_path, save_dir, ha_url, ha_token, prune=False, workers=None,
+                           rate_limit=None):
+    from ha_helpers.daemon_client import open_http_session
+    from ha_helpers.ratelimit import get_limiter
     url = f"{ha_url}{api_path}"
     try:
-        resp = requests.get(url, headers=headers)
+        with open_http_session(ha_token, pool_size=1, limiter=get_limiter(ha_url, rate_limit)) as session:
+            resp = session.get(url)
         resp.raise_for_status()
         items = resp.json()
         if not os.path.exists(save_dir):
             os.makedirs(save_dir, exist_ok=True)
-        count = 0
-        for item in items:
-            # Use the entity_id or id as filename
-            entity_id = item.get('id') or item.get('entity_id') or f"{item_type}_{count}"
-            # Clean filename
-            fname = str(entity_id).replace('.', '_').replace(' ', '_') + ".yaml"
-            fpath = os.path.join(save_dir, fname)
-            # Save as YAML
+        manifest = load_manifest()
+        # Use the entity_id or id as filename
+        entity_ids = [item.get('id') or item.get('entity_id') or f"{item_type}_{idx}"
+                      for idx, item in enumerate(items)]
+        texts = render_items(items, workers=workers)
+        written = unchanged = 0
+        for item, entity_id, text in zip(items, entity_ids, texts):
+            fpath = os.path.join(save_dir, item_filename(entity_id))
             try:
-                with open(fpath, 'w') as f:
-                    yaml.dump(item, f, default_flow_style=False, allow_unicode=True)
-                count += 1
+                if write_if_changed(fpath, text):
+                    written += 1
+                else:
+                    unchanged += 1
+                manifest[manifest_key(item_type, entity_id)] = content_hash(item)
             except Exception as e:
                 print(f"Failed to save {item_type} {entity_id}: {e}")
-        print(f"Pulled and saved {count} {item_type}(s) to {save_dir}")
+
+        # Anything pulled before that HA no longer has was removed upstream
+        current = {manifest_key(item_type, entity_id) for entity_id in entity_ids}
+        prefix = manifest_key(item_type, '')
+        removed = [key for key in manifest if key.startswith(prefix) and key not in current]
+        for key in removed:
+            fpath = os.path.join(save_dir, item_filename(key[len(prefix):]))
+            if prune:
+                if os.path.exists(fpath):
+                    os.remove(fpath)
+                del manifest[key]
+                print(f"Removed {fpath} ({key} no longer exists in Home Assistant)")
+            elif os.path.exists(fpath):
+                print(f"{key} no longer exists in Home Assistant: {fpath} (use --prune to delete)")
+            else:
+                del manifest[key]
+        save_manifest(manifest)
+        print(f"Pulled {len(items)} {item_type}(s) to {save_dir}: "
+              f"{written} written, {unchanged} unchanged, {len(removed)} removed upstream")
     except Exception as e:
         print(f"Error pulling {item_type}s from Home Assistant: {e}")
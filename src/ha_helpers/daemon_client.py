@@ -0,0 +1,297 @@
+"""
+daemon_client.py
+
+Client side of the optional ha-daemon (src/ha_daemon.py).
+
+- The daemon listens on a Unix socket next to config.json and keeps
+  authenticated HTTP and WebSocket connections to Home Assistant warm.
+- open_http_session() and open_websocket() return a daemon-backed session or
+  WebSocket when the daemon is running, and the direct ones
+  (get_http_session, HAWebSocket) otherwise, so tools use them unchanged.
+- Messages are NDJSON: one JSON object per line, tagged with an id so many
+  requests can share one socket.
+- Set HA_TOOLS_NO_DAEMON=1 to always connect directly.
+- A `limiter` (ha_helpers.ratelimit) applies to direct connections only; the
+  daemon paces its own connections to Home Assistant.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from ha_helpers.client import (
+    DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, DEFAULT_RETRIES, HAAuthError, LatencyStats, http_op,
+)
+from ha_helpers.common import get_config_path
+
+SOCKET_NAME = 'ha-daemon.sock'
+
+# Stream limit for the daemon socket; trace lists and registries can be large
+MAX_LINE = 64 * 1024 * 1024
+
+def get_socket_path():
+    return os.path.join(os.path.dirname(get_config_path()), SOCKET_NAME)
+
+def daemon_available(path=None):
+    """True if a daemon is accepting connections on the socket."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    path = path or get_socket_path()
+    if not os.path.exists(path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        # A socket file left behind by a daemon that died
+        return False
+
+def request(message, path=None, timeout=DEFAULT_TIMEOUT):
+    """Sends one message to the daemon and returns its reply (for status/stop)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or get_socket_path())
+        sock.sendall((json.dumps({'id': 1, **message}) + '\n').encode('utf-8'))
+        return json.loads(sock.makefile('rb').readline() or b'{}')
+
+def _connection_error(message):
+    # requests is only imported on the error path
+    import requests
+    return requests.exceptions.ConnectionError(message)
+
+class DaemonResponse:
+    """The parts of requests.Response the tools use."""
+
+    def __init__(self, status_code, text, url):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+        self.ok = status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+class DaemonSession:
+    """Drop-in for get_http_session()'s session that sends requests through the daemon.
+
+    Each thread gets its own socket, so a thread pool can share one session.
+    """
+
+    def __init__(self, token, path=None, timeout=DEFAULT_TIMEOUT, stats=None):
+        self.token = token
+        self.path = path or get_socket_path()
+        self.timeout = timeout
+        self.stats = stats if stats is not None else LatencyStats()
+        self._local = threading.local()
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+            with self._lock:
+                self._sockets.append(sock)
+        return conn
+
+    def request(self, method, url, data=None, json_body=None, timeout=None, **kwargs):
+        body = json.dumps(json_body) if json_body is not None else data
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        message = {'id': 0, 'op': 'http', 'token': self.token, 'method': method.upper(), 'url': url,
+                   'body': body, 'timeout': timeout or self.timeout}
+        op = http_op(method, url)
+        start = time.perf_counter()
+        try:
+            sock, reader = self._conn()
+            sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+            line = reader.readline()
+        except OSError as e:
+            self._local.conn = None
+            self.stats.record(op, time.perf_counter() - start, error=True)
+            raise _connection_error(f"ha-daemon: {e}")
+        if not line:
+            self._local.conn = None
+            self.stats.record(op, time.perf_counter() - start, error=True)
+            raise _connection_error("ha-daemon closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            self.stats.record(op, time.perf_counter() - start, error=True)
+            raise _connection_error(reply['error'])
+        self.stats.record(op, time.perf_counter() - start, error=reply['status'] >= 500)
+        return DaemonResponse(reply['status'], reply['body'], url)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json_body=json, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for sock in self._sockets:
+                sock.close()
+            self._sockets.clear()
+        self._local = threading.local()
+
+class DaemonWebSocket:
+    """Drop-in for HAWebSocket (call/connect/close) that sends commands through the daemon.
+
+    connect() makes the daemon connect and authenticate if it hasn't yet;
+    it raises HAAuthError on a bad token, like HAWebSocket.
+    """
+
+    def __init__(self, url, token, path=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, stats=None):
+        self.url = url
+        self.token = token
+        self.path = path or get_socket_path()
+        self.timeout = timeout
+        self.retries = retries
+        self.stats = stats if stats is not None else LatencyStats()
+        self._concurrency = max(1, concurrency)
+        self._next_id = 1
+        self._futures = {}
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        import asyncio
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE)
+        self._slots = asyncio.Semaphore(self._concurrency)
+        self._read_task = asyncio.create_task(self._read_loop())
+        reply = await self._send({'op': 'ws_connect'}, self.timeout)
+        if reply.get('kind') == 'auth':
+            await self.close()
+            raise HAAuthError(reply['error'])
+        if 'error' in reply:
+            await self.close()
+            raise ConnectionError(reply['error'])
+
+    async def close(self):
+        import asyncio
+        if self._read_task:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._writer:
+            self._writer.close()
+
+    @property
+    def connected(self):
+        return self._read_task is not None and not self._read_task.done()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                fut = self._futures.pop(msg.get('id'), None)
+                if fut and not fut.done():
+                    fut.set_result(msg)
+        finally:
+            error = ConnectionError("ha-daemon connection closed")
+            for fut in self._futures.values():
+                if not fut.done():
+                    fut.set_exception(error)
+            self._futures.clear()
+
+    async def _send(self, message, timeout):
+        import asyncio
+        if not self.connected:
+            raise ConnectionError("ha-daemon connection closed")
+        msg_id = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._futures[msg_id] = fut
+        try:
+            self._writer.write((json.dumps({'id': msg_id, 'url': self.url, 'token': self.token, **message})
+                                + '\n').encode('utf-8'))
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, timeout=timeout)
+        finally:
+            self._futures.pop(msg_id, None)
+
+    async def call(self, payload, timeout=None, retries=None):
+        """Sends one command through the daemon and returns HA's reply message (see HAWebSocket.call)."""
+        import asyncio
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        op = payload.get('type', '?')
+        async with self._slots:
+            start = time.perf_counter()
+            try:
+                # The daemon applies the timeout and retries against HA; allow it time for all attempts
+                reply = await self._send({'op': 'ws', 'payload': payload, 'timeout': timeout, 'retries': retries},
+                                         timeout * (retries + 1) + 5)
+            except asyncio.TimeoutError:
+                reply = {'error': f"{op} timed out", 'kind': 'timeout'}
+        if reply.get('kind') == 'connection':
+            self.stats.record(op, time.perf_counter() - start, error=True)
+            raise ConnectionError(reply['error'])
+        if 'error' in reply:
+            self.stats.record(op, time.perf_counter() - start, error=True)
+            return {"success": False, "error": {"code": reply.get('kind', 'error'), "message": reply['error']}}
+        result = reply['reply']
+        self.stats.record(op, time.perf_counter() - start, error=not result.get('success'))
+        return result
+
+def use_daemon():
+    """True if the tools should go through the daemon."""
+    return not os.environ.get('HA_TOOLS_NO_DAEMON') and daemon_available()
+
+def open_http_session(token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                      stats=None, limiter=None):
+    """A session through the daemon if it is running, else get_http_session()."""
+    if use_daemon():
+        return DaemonSession(token, timeout=timeout, stats=stats)
+    from ha_helpers.client import get_http_session
+    return get_http_session(token, pool_size=pool_size, timeout=timeout, retries=retries, stats=stats,
+                            limiter=limiter)
+
+def open_websocket(url, token, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                   stats=None, limiter=None):
+    """An (unconnected) WebSocket through the daemon if it is running, else an HAWebSocket."""
+    if use_daemon():
+        return DaemonWebSocket(url, token, concurrency=concurrency, timeout=timeout, retries=retries, stats=stats)
+    from ha_helpers.ws_client import HAWebSocket
+    return HAWebSocket(url, token, concurrency=concurrency, timeout=timeout, retries=retries, stats=stats,
+                       limiter=limiter)
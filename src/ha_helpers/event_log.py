@@ -0,0 +1,257 @@
+"""
+event_log.py
+
+Append-only, size-rotated NDJSON log of watchdog run outcomes, plus the
+streaming readers used to query it.
+
+- EventLog.write() only puts the record on a queue; a background thread
+  batches records to disk, so the caller never waits on I/O.
+- Segments are named watchdog-<seq>.ndjson. When a segment is closed, an index
+  (<segment>.idx.json) records its time range, per-entity counts and the byte
+  offset of every OFFSET_EVERY-th record, so queries can skip whole segments
+  and seek to a start time.
+- Only the newest `keep` segments are kept.
+- iter_records() streams matching records; DurationSketch computes percentiles
+  in bounded memory (relative error about 1%).
+"""
+import os
+import json
+import math
+import glob
+import queue
+import bisect
+import threading
+from ha_helpers.common import atomic_write
+
+SEGMENT_PREFIX = 'watchdog-'
+SEGMENT_SUFFIX = '.ndjson'
+INDEX_SUFFIX = '.idx.json'
+DEFAULT_SEGMENT_MB = 16
+DEFAULT_KEEP_SEGMENTS = 20
+MAX_PENDING = 100000
+BATCH_SIZE = 1000
+# A byte offset is indexed for every this many records
+OFFSET_EVERY = 1000
+
+def segment_paths(directory):
+    """Returns the log segments in a directory, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")))
+
+def load_index(segment):
+    """Returns a segment's index, or None for the active or an unclosed segment."""
+    try:
+        with open(segment + INDEX_SUFFIX, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+class EventLog:
+    """Background NDJSON writer with size-based rotation and per-segment indexes."""
+
+    def __init__(self, directory, max_mb=DEFAULT_SEGMENT_MB, keep=DEFAULT_KEEP_SEGMENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.keep = max(1, keep)
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        existing = segment_paths(directory)
+        self._seq = int(os.path.basename(existing[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) if existing else 0
+        # Close out segments left without an index by a crash
+        for segment in existing:
+            if load_index(segment) is None:
+                self._write_index(segment, *_scan_segment(segment))
+        self._file = None
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        """Queues a record (a JSON-serialisable dict with a numeric 'ts') without blocking."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Writes out everything queued, indexes the active segment and stops the writer."""
+        # A writer that died (e.g. disk full) never drains the queue; don't block on a full one
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+
+    # ----- writer thread --------------------------------------------------
+
+    def _open_segment(self):
+        self._seq += 1
+        self._path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._seq:06d}{SEGMENT_SUFFIX}")
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+        self._first_ts = self._last_ts = None
+        self._entities = {}
+        self._offsets = []
+        self._count = 0
+
+    def _close_segment(self):
+        self._file.close()
+        if not self._count:
+            # Nothing was logged; don't leave an empty segment behind
+            os.remove(self._path)
+            return
+        self._write_index(self._path, self._first_ts, self._last_ts, self._count, self._entities, self._offsets)
+        segments = segment_paths(self.directory)
+        for old in segments[:-self.keep]:
+            for path in (old, old + INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @staticmethod
+    def _write_index(segment, first_ts, last_ts, count, entities, offsets):
+        atomic_write(segment + INDEX_SUFFIX, json.dumps({
+            'first_ts': first_ts, 'last_ts': last_ts, 'count': count,
+            'entities': entities, 'offsets': offsets}))
+
+    def _append(self, batch):
+        chunks = []
+        for record in batch:
+            line = (json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+            ts = record.get('ts')
+            if self._count % OFFSET_EVERY == 0:
+                self._offsets.append([ts, self._size])
+            if self._first_ts is None:
+                self._first_ts = ts
+            self._last_ts = ts
+            entity = record.get('entity_id')
+            self._entities[entity] = self._entities.get(entity, 0) + 1
+            self._count += 1
+            self._size += len(line)
+            chunks.append(line)
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+        self.written += len(batch)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Block for the first record, then take whatever else is already queued
+            batch = []
+            item = self._queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._append(batch)
+                if self._size >= self.max_bytes:
+                    self._close_segment()
+                    self._open_segment()
+        self._close_segment()
+
+def _scan_segment(segment):
+    """Rebuilds an index for a segment that was never closed cleanly."""
+    first_ts = last_ts = None
+    entities, offsets, count, offset = {}, [], 0, 0
+    with open(segment, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line from a crash
+                offset += len(line)
+                continue
+            ts = record.get('ts')
+            if count % OFFSET_EVERY == 0:
+                offsets.append([ts, offset])
+            first_ts = ts if first_ts is None else first_ts
+            last_ts = ts
+            entity = record.get('entity_id')
+            entities[entity] = entities.get(entity, 0) + 1
+            count += 1
+            offset += len(line)
+    return first_ts, last_ts, count, entities, offsets
+
+def iter_records(directory, since=None, until=None, entity=None):
+    """Streams records with since <= ts <= until (POSIX seconds) for one entity or all.
+
+    Segments whose index rules them out are skipped without being opened, and
+    reading starts at the indexed offset closest before `since`.
+    """
+    for segment in segment_paths(directory):
+        index = load_index(segment)
+        start = 0
+        if index:
+            if not index['count']:
+                continue
+            if since is not None and index['last_ts'] < since:
+                continue
+            if until is not None and index['first_ts'] > until:
+                continue
+            if entity is not None and entity not in index['entities']:
+                continue
+            if since is not None and index['offsets']:
+                pos = bisect.bisect_left([ts for ts, _ in index['offsets']], since) - 1
+                start = index['offsets'][pos][1] if pos >= 0 else 0
+        with open(segment, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                ts = record.get('ts', 0)
+                if since is not None and ts < since:
+                    continue
+                if until is not None and ts > until:
+                    # Records are appended in time order
+                    break
+                if entity is not None and record.get('entity_id') != entity:
+                    continue
+                yield record
+
+class DurationSketch:
+    """Streaming percentile estimate using log-spaced buckets (relative error ~1%)."""
+
+    GAMMA = 1.02
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.zeros = 0
+        self.max = 0.0
+        self.total = 0.0
+        self._log_gamma = math.log(self.GAMMA)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def percentile(self, pct):
+        """Returns the estimated value at `pct` (0-100), or None when empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        if rank <= self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                # Midpoint of the bucket, capped at the largest value seen
+                return min(2 * self.GAMMA ** key / (1 + self.GAMMA), self.max)
+        return self.max
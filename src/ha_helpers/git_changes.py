@@ -0,0 +1,95 @@
+"""
+git_changes.py
+
+Change detection for push_automation --auto-detect-changes using git plumbing.
+
+- One `git diff --name-status -z -M` between two commits lists added, modified,
+  renamed and deleted files; git compares tree objects, so the cost depends on
+  what changed, not on how long the history is.
+- The commit last pushed from each repository is recorded in last_pushed.json
+  next to config.json, so a push covers every commit since the previous one.
+- Old file contents (for deleted or renamed files) are read with `git cat-file`.
+"""
+import collections
+import json
+import os
+import subprocess
+from ha_helpers.common import atomic_write, get_config_path
+
+STATE_NAME = 'last_pushed.json'
+
+# Hash of git's empty tree, used as the base for a repository's first commit
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+YAML_PATTERNS = ('*.yaml', '*.yml')
+
+# status is the change letter (A, M, D, R, C or T); old_path is set for renames and copies
+Change = collections.namedtuple('Change', 'status path old_path')
+
+class GitError(Exception):
+    """Raised when git is missing or a git command fails."""
+
+def run_git(root, *args):
+    """Runs a git command in `root` and returns its raw stdout."""
+    try:
+        proc = subprocess.run(['git', *args], cwd=root, capture_output=True)
+    except FileNotFoundError:
+        raise GitError("git is not installed or not on PATH")
+    if proc.returncode != 0:
+        raise GitError(proc.stderr.decode('utf-8', 'replace').strip() or f"git {args[0]} failed")
+    return proc.stdout
+
+def repo_root(path='.'):
+    """Returns the top-level folder of the repository containing `path`."""
+    return os.fsdecode(run_git(path, 'rev-parse', '--show-toplevel').strip())
+
+def resolve_commit(root, ref):
+    """Returns the commit hash `ref` points to, or None if there is no such commit."""
+    try:
+        return run_git(root, 'rev-parse', '--verify', '--quiet', f"{ref}^{{commit}}").decode().strip() or None
+    except GitError:
+        return None
+
+def diff_name_status(root, base, head='HEAD', patterns=YAML_PATTERNS):
+    """Lists the files matching `patterns` that differ between two commits, renames detected."""
+    out = run_git(root, 'diff', '--name-status', '-z', '-M', '--no-ext-diff', base, head, '--', *patterns)
+    fields = [os.fsdecode(f) for f in out.split(b'\0')]
+    changes = []
+    i = 0
+    while i < len(fields) and fields[i]:
+        status = fields[i][0]
+        if status in 'RC':
+            # R087\0old\0new
+            changes.append(Change(status, fields[i + 2], fields[i + 1]))
+            i += 3
+        else:
+            changes.append(Change(status, fields[i + 1], None))
+            i += 2
+    return changes
+
+def show_file(root, commit, path):
+    """Returns a file's content at `commit` as text."""
+    return run_git(root, 'cat-file', 'blob', f"{commit}:{path}").decode('utf-8')
+
+def get_state_path():
+    return os.path.join(os.path.dirname(get_config_path()), STATE_NAME)
+
+def load_last_pushed(root, path=None):
+    """Returns the commit last pushed from the repository at `root`, or None."""
+    try:
+        with open(path or get_state_path(), 'r') as f:
+            return json.load(f).get(os.path.realpath(root))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_last_pushed(root, commit, path=None):
+    """Records `commit` as the last one pushed from the repository at `root`."""
+    path = path or get_state_path()
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    state[os.path.realpath(root)] = commit
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, json.dumps(state, indent=2, sort_keys=True))
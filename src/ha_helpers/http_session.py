@@ -0,0 +1,65 @@
+"""
+http_session.py
+
+requests Session used by ha_helpers.client.get_http_session(); kept in its own
+module so requests is only imported by tools that make HTTP calls.
+"""
+import time
+import requests
+from ha_helpers.client import DEFAULT_TIMEOUT, DEFAULT_RETRIES, LatencyStats, http_op, retry_delay
+
+class HASession(requests.Session):
+    """requests Session with default timeouts, retries with jitter and latency stats.
+
+    Idempotent requests (GET/HEAD) are retried on connection errors, timeouts and
+    5xx responses; other methods are retried only on connect timeouts, when
+    nothing can have been sent. An optional `limiter` (ha_helpers.ratelimit)
+    bounds and adapts how many requests are in flight across threads.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, stats=None, limiter=None):
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.stats = stats if stats is not None else LatencyStats()
+        self.limiter = limiter
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in ('GET', 'HEAD')
+        op = http_op(method, url)
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire_sync()
+            start = time.perf_counter()
+            try:
+                resp = super().request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.stats.record(op, time.perf_counter() - start, error=True)
+                if self.limiter:
+                    self.limiter.release(time.perf_counter() - start, error=True)
+                # A connect timeout means nothing was sent, so any method is safe to retry
+                unsent = isinstance(e, requests.exceptions.ConnectTimeout)
+                if attempt >= self.retries or not (idempotent or unsent):
+                    raise
+            except Exception:
+                # Any other failed request counts against the limit
+                if self.limiter:
+                    self.limiter.release(time.perf_counter() - start, error=True)
+                raise
+            except BaseException:
+                # Interrupted (e.g. Ctrl-C): free the slot without judging HA by it
+                if self.limiter:
+                    self.limiter.release()
+                raise
+            else:
+                self.stats.record(op, time.perf_counter() - start, error=resp.status_code >= 500)
+                if self.limiter:
+                    self.limiter.release(time.perf_counter() - start,
+                                         error=resp.status_code >= 500 or resp.status_code == 429)
+                if resp.status_code < 500 or not idempotent or attempt >= self.retries:
+                    return resp
+                resp.close()
+            time.sleep(retry_delay(attempt))
+            attempt += 1
@@ -0,0 +1,179 @@
+"""
+metrics.py
+
+Small in-process metrics registry with a Prometheus text-format endpoint.
+
+- Counter, Gauge and Histogram, each optionally keyed by label values.
+- Histograms use fixed bucket bounds: recording is one bisect and two adds.
+- Counters and gauges can read their value from a callback at scrape time,
+  so existing stats don't have to be counted twice; watch() adds one callback
+  per set of label values.
+- Registering a name twice returns the existing metric, so several watchers
+  can share one registry and tell themselves apart by label.
+- MetricsServer serves GET /metrics from the running asyncio loop.
+"""
+import asyncio
+import bisect
+import math
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers quick service calls up to long-running automations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.callbacks = {}
+        if callback is not None:
+            self.watch(callback)
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(label_values)
+
+    def watch(self, callback, *label_values):
+        """Reads the value for these label values from `callback` at scrape time."""
+        self.callbacks[self._key(label_values)] = callback
+
+    def render(self):
+        for key, callback in self.callbacks.items():
+            self.values[key] = callback()
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        self.values[self._key(label_values)] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        entry = self.values.get(key)
+        if entry is None:
+            # Per-bucket counts (the last one is +Inf), then sum and count
+            entry = self.values[key] = [[0] * (len(self.bounds) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.bounds, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.bounds + (math.inf,), counts):
+                cumulative += n
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+class Registry:
+    """Holds metrics in registration order and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        for existing in self.metrics:
+            if existing.name == metric.name:
+                if existing.kind != metric.kind or existing.label_names != metric.label_names:
+                    raise ValueError(f"{metric.name} is already registered with a different type or labels")
+                if metric.callbacks:
+                    existing.callbacks.update(metric.callbacks)
+                return existing
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), callback=None):
+        return self._add(Counter(name, help_text, labels, callback=callback))
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self._add(Gauge(name, help_text, labels, callback=callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets=buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    """Serves a Registry at http://<host>:<port>/metrics on the current event loop."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9465):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _client(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+            method, path = request.split(b' ', 2)[:2]
+            if method in (b'GET', b'HEAD') and path.split(b'?')[0] in (b'/metrics', b'/'):
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+            if method != b'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,231 @@
+"""
+ratelimit.py
+
+Adaptive concurrency limit and token-bucket rate limit for requests to Home Assistant.
+
+- AdaptiveLimiter caps how many requests are in flight at once and sizes that
+  cap with AIMD: it starts small, grows while replies stay fast, x0.7 when replies get slow
+  (smoothed latency above `tolerance` times the fastest recent reply) or fail
+  (timeouts, connection errors, 5xx/429). Scans run as fast as the instance
+  answers comfortably and back off when it is busy running automations.
+- An optional token bucket caps the request rate (requests_per_second, burst).
+- HAWebSocket (asyncio) and HASession (threads) take a `limiter`; get_limiter()
+  returns one shared limiter per Home Assistant URL, so every transport to an
+  instance in a process draws from the same budget.
+
+Configured with a "rate_limit" object in config.json (or per entry of
+"instances"); "rate_limit": false turns it off:
+
+    "rate_limit": {"requests_per_second": 20, "burst": 10, "min_concurrency": 1,
+                   "max_concurrency": 16, "initial_concurrency": 4, "latency_tolerance": 2.0}
+"""
+import collections
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_TOLERANCE = 2.0
+DECREASE_FACTOR = 0.7
+# Weight of the newest sample in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+# The unloaded baseline is the fastest reply seen over the last one to two windows (seconds)
+BASELINE_WINDOW = 30.0
+# Latencies below this are never treated as overload (local jitter)
+MIN_OVERLOAD_LATENCY = 0.005
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() returns how long to wait before sending."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance queues the request behind earlier reservations
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += delay
+            return delay
+
+class AdaptiveLimiter:
+    """AIMD-sized concurrency limit plus optional token bucket, usable from threads and asyncio.
+
+    Usage (asyncio):            Usage (threads):
+        await limiter.acquire()     limiter.acquire_sync()
+        ...request...               ...request...
+        limiter.release(seconds, error)
+    """
+
+    def __init__(self, min_limit=DEFAULT_MIN_CONCURRENCY, max_limit=DEFAULT_MAX_CONCURRENCY,
+                 initial=DEFAULT_INITIAL_CONCURRENCY, tolerance=DEFAULT_TOLERANCE, rate=None, burst=None):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.tolerance = tolerance
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.inflight = 0
+        self.baseline = None
+        self.smoothed = None
+        self._window_min = self._previous_min = None
+        self._window_start = time.monotonic()
+        self.decreases = 0
+        self.peak = self.limit
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._waiters = collections.deque()
+
+    @property
+    def capacity(self):
+        return max(1, int(self.limit))
+
+    async def acquire(self):
+        """Waits for a slot (and a token) from asyncio code."""
+        # asyncio is imported here so thread-only tools (push, pull) don't load it
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.inflight < self.capacity and not self._waiters:
+                self.inflight += 1
+                fut = None
+            else:
+                fut = loop.create_future()
+                self._waiters.append((loop, fut))
+        try:
+            if fut is not None:
+                await fut
+            if self.bucket:
+                delay = self.bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # Cancelled after being handed a slot: give it back
+            if fut is None or (fut.done() and not fut.cancelled()):
+                self.release()
+            raise
+
+    def acquire_sync(self):
+        """Waits for a slot (and a token) from a thread."""
+        with self._cond:
+            while self.inflight >= self.capacity or self._waiters:
+                self._cond.wait()
+            self.inflight += 1
+        if self.bucket:
+            delay = self.bucket.reserve()
+            if delay:
+                time.sleep(delay)
+
+    def release(self, latency=None, error=False):
+        """Frees a slot and feeds the request's latency (seconds) and outcome into the limit.
+
+        Without a latency or an error (a cancelled or interrupted request) the
+        limit is left alone.
+        """
+        with self._lock:
+            if latency is not None or error:
+                self._adjust(latency, error)
+            self.inflight -= 1
+            self._wake()
+
+    def _release_unused(self, fut):
+        # Runs on the waiter's loop: hand the slot on if the waiter was cancelled meanwhile
+        if fut.cancelled():
+            with self._lock:
+                self.inflight -= 1
+                self._wake()
+        elif not fut.done():
+            fut.set_result(None)
+
+    def _wake(self):
+        while self._waiters and self.inflight < self.capacity:
+            loop, fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.inflight += 1
+            loop.call_soon_threadsafe(self._release_unused, fut)
+        self._cond.notify_all()
+
+    def _adjust(self, latency, error):
+        slow = False
+        if latency is not None and not error:
+            self.smoothed = latency if self.smoothed is None else \
+                (1 - LATENCY_SMOOTHING) * self.smoothed + LATENCY_SMOOTHING * latency
+            self._update_baseline(latency)
+            slow = self.smoothed > MIN_OVERLOAD_LATENCY and self.smoothed > self.baseline * self.tolerance
+        overloaded = error or slow
+        if overloaded:
+            now = time.monotonic()
+            # One decrease per round trip; replies already in flight reflect the old limit
+            if now - self._last_decrease >= max(self.smoothed or 0.0, 0.05):
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.decreases += 1
+        else:
+            # Slow start (doubling per round trip) until the first backoff, then about +1 per round trip
+            self.limit = min(self.max_limit, self.limit + (1 if not self.decreases else 1 / self.limit))
+            self.peak = max(self.peak, self.limit)
+
+    def _update_baseline(self, latency):
+        # A windowed minimum rather than an all-time one, so a slower network path is
+        # eventually accepted; backing off keeps producing fast replies while HA is merely busy
+        now = time.monotonic()
+        if now - self._window_start > BASELINE_WINDOW:
+            self._previous_min, self._window_min = self._window_min, latency
+            self._window_start = now
+        elif self._window_min is None or latency < self._window_min:
+            self._window_min = latency
+        self.baseline = min(m for m in (self._window_min, self._previous_min) if m is not None)
+
+    def summary(self):
+        throttled = f", {self.bucket.waited:.1f}s total held back by the rate limit" if self.bucket else ""
+        latency = f", smoothed latency {self.smoothed * 1000:.0f} ms (baseline {self.baseline * 1000:.0f} ms)" \
+            if self.smoothed is not None else ""
+        return (f"Adaptive concurrency: limit {self.capacity} (peak {int(self.peak)}, range "
+                f"{self.min_limit}-{self.max_limit}), {self.decreases} backoff(s){latency}{throttled}")
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter_from_settings(settings, max_concurrency=None):
+    """Builds an AdaptiveLimiter from a "rate_limit" config object; None if it is turned off."""
+    if settings is False:
+        return None
+    settings = settings or {}
+    max_limit = settings.get('max_concurrency') or max_concurrency or DEFAULT_MAX_CONCURRENCY
+    return AdaptiveLimiter(
+        min_limit=settings.get('min_concurrency', DEFAULT_MIN_CONCURRENCY),
+        max_limit=max_limit,
+        initial=settings.get('initial_concurrency', min(DEFAULT_INITIAL_CONCURRENCY, max_limit)),
+        tolerance=settings.get('latency_tolerance', DEFAULT_TOLERANCE),
+        rate=settings.get('requests_per_second'),
+        burst=settings.get('burst'),
+    )
+
+def instance_key(url):
+    """scheme://host:port of a Home Assistant URL; its WebSocket, API and base URLs give the same key."""
+    parts = urlsplit(url)
+    scheme = {'ws': 'http', 'wss': 'https'}.get(parts.scheme, parts.scheme)
+    return f"{scheme}://{parts.netloc}"
+
+def get_limiter(ha_url, settings=None, max_concurrency=None):
+    """Returns the process-wide limiter for a Home Assistant URL, creating it on first use.
+
+    `settings` is the "rate_limit" config object; every URL of one instance
+    (WebSocket, REST endpoints) shares a limiter.
+    """
+    key = instance_key(ha_url)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = limiter_from_settings(settings, max_concurrency)
+        return _limiters[key]
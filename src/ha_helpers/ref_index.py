@@ -0,0 +1,309 @@
+"""
+ref_index.py
+
+Persistent inverted index of what the local automation/script files reference.
+
+- Maps entity_ids, services, device_ids and area_ids to the automation or
+  script that uses them and the path inside the item (e.g. action/2/target/entity_id).
+- Entity ids inside templates (states('sensor.x'), is_state(...), states.light.y)
+  are indexed too.
+- Kept in SQLite next to config.json. update() only re-parses files whose
+  mtime or size changed and whose content hash differs; removed files are dropped.
+- Also records which file defines each automation/script, so push can spot
+  duplicate ids without reading every file.
+- The entity_ids of an ha_entities snapshot are loaded into the index (again
+  only when the snapshot changed), so dangling references are a single query.
+"""
+import concurrent.futures
+import hashlib
+import os
+import re
+import sqlite3
+from ha_helpers.common import get_config_path
+
+INDEX_NAME = 'ref_index.sqlite3'
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+# Below this many changed files, they are parsed inline rather than in worker processes
+PARALLEL_PARSE_THRESHOLD = 200
+
+KINDS = ('entity', 'service', 'device', 'area')
+
+# Bumped when parse_file records something new; older indexes are re-parsed once
+SCHEMA_VERSION = '2'
+
+# Config keys whose values are references, by kind
+REF_KEYS = {'entity_id': 'entity', 'device_id': 'device', 'area_id': 'area',
+            'service': 'service', 'action': 'service'}
+
+ENTITY_ID = re.compile(r'^[a-z0-9_]+\.[a-z0-9_]+$')
+TEMPLATE_REFS = re.compile(
+    r"""(?:states|is_state|state_attr|is_state_attr|has_value|expand|closest|distance|device_id|area_name|area_id)"""
+    r"""\(\s*['"]([a-z0-9_]+\.[a-z0-9_]+)['"]"""
+    r"""|\bstates\.([a-z0-9_]+\.[a-z0-9_]+)""")
+# Values of entity_id that aren't entities
+NOT_ENTITIES = {'all', 'none'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path  TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size  INTEGER NOT NULL,
+    hash  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    kind     TEXT NOT NULL,
+    value    TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    path     TEXT NOT NULL,
+    location TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_value ON refs (value, kind);
+CREATE INDEX IF NOT EXISTS refs_item ON refs (item);
+CREATE INDEX IF NOT EXISTS refs_path ON refs (path);
+CREATE TABLE IF NOT EXISTS items (
+    item TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_item ON items (item);
+CREATE INDEX IF NOT EXISTS items_path ON items (path);
+CREATE TABLE IF NOT EXISTS known_entities (entity_id TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def default_index_path():
+    """Returns the index location next to config.json."""
+    return os.path.join(os.path.dirname(get_config_path()), INDEX_NAME)
+
+def item_name(content, fallback):
+    """Names an automation/script, e.g. automation.morning_lights; None if it is neither."""
+    if not isinstance(content, dict):
+        return None
+    if 'trigger' in content or 'triggers' in content:
+        domain = 'automation'
+    elif 'sequence' in content:
+        domain = 'script'
+    else:
+        return None
+    # Same derivation as push_automation, so names match the ids items are pushed under
+    item_id = content['id'] if 'id' in content else str(content.get('alias') or fallback).lower().replace(' ', '_')
+    return f"{domain}.{item_id}"
+
+def iter_items(document, fallback):
+    """Yields (name, config) for the automations/scripts in a parsed YAML file.
+
+    Handles one item per file (pull_automations), a one-item list
+    (decompose_automations), a list of automations and a scripts.yaml mapping.
+    """
+    if isinstance(document, list):
+        for item in document:
+            name = item_name(item, fallback)
+            if name:
+                yield name, item
+        return
+    name = item_name(document, fallback)
+    if name:
+        yield name, document
+    elif isinstance(document, dict):
+        for key, value in document.items():
+            if isinstance(value, dict) and 'sequence' in value:
+                yield f"script.{key}", value
+
+def _split(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value]
+    return [v.strip() for v in str(value).split(',')]
+
+def extract_refs(node, location=''):
+    """Yields (kind, value, location) for every reference in an item's config."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            where = f"{location}/{key}" if location else str(key)
+            kind = REF_KEYS.get(key)
+            if kind and isinstance(value, (str, list)) and not (isinstance(value, str) and '{' in value):
+                for ref in _split(value):
+                    if not ref or (kind == 'entity' and ref in NOT_ENTITIES):
+                        continue
+                    # `action` is also the name of an automation's action list
+                    if kind in ('entity', 'service') and not ENTITY_ID.match(ref):
+                        continue
+                    yield kind, ref, where
+                if isinstance(value, str):
+                    continue
+            yield from extract_refs(value, where)
+    elif isinstance(node, list):
+        for i, value in enumerate(node):
+            yield from extract_refs(value, f"{location}/{i}" if location else str(i))
+    elif isinstance(node, str) and '{' in node:
+        for match in TEMPLATE_REFS.finditer(node):
+            yield 'entity', match.group(1) or match.group(2), location
+
+def parse_file(path):
+    """Reads one file; returns (path, hash, [(kind, value, item, location)], [item]).
+
+    If the file can't be read, hash is None and refs is the error message.
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        document = yaml.load(data, Loader=loader)
+    except (OSError, yaml.YAMLError) as e:
+        return path, None, str(e), []
+    fallback = os.path.splitext(os.path.basename(path))[0]
+    refs, items = [], []
+    for name, config in iter_items(document, fallback):
+        items.append(name)
+        seen = set()
+        for kind, value, location in extract_refs(config):
+            if (kind, value, location) not in seen:
+                seen.add((kind, value, location))
+                refs.append((kind, value, name, location))
+    return path, digest, refs, items
+
+def iter_yaml_files(directories):
+    """Yields (path, stat) for every YAML file below the given folders."""
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.endswith(YAML_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    try:
+                        yield os.path.abspath(path), os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+class RefIndex:
+    """SQLite-backed entity/service/device reference index over YAML folders."""
+
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key='schema'").fetchone()
+        if not row or row[0] != SCHEMA_VERSION:
+            # Forget the file stamps so the next update() re-parses everything
+            self.db.execute("DELETE FROM files")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (SCHEMA_VERSION,))
+            self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def update(self, directories, workers=None):
+        """Brings the index up to date with the YAML files below `directories`.
+
+        Returns {'files', 'parsed', 'changed', 'removed', 'errors': [(path, message)]}.
+        """
+        known = {path: (mtime, size, digest) for path, mtime, size, digest in
+                 self.db.execute("SELECT path, mtime, size, hash FROM files")}
+        seen = set()
+        stale = []
+        for path, st in iter_yaml_files(directories):
+            seen.add(path)
+            old = known.get(path)
+            if old is None or old[0] != st.st_mtime or old[1] != st.st_size:
+                stale.append((path, st))
+        removed = [path for path in known if path not in seen]
+
+        stats = {'files': len(seen), 'parsed': len(stale), 'changed': 0, 'removed': len(removed), 'errors': []}
+        by_path = dict(stale)
+        for path, digest, refs, items in self._parse([path for path, _ in stale], workers):
+            st = by_path[path]
+            if digest is None:
+                stats['errors'].append((path, refs))
+                continue
+            if known.get(path, (None, None, None))[2] != digest:
+                stats['changed'] += 1
+                self.db.execute("DELETE FROM refs WHERE path=?", (path,))
+                self.db.executemany(
+                    "INSERT INTO refs (kind, value, item, path, location) VALUES (?, ?, ?, ?, ?)",
+                    [(kind, value, item, path, location) for kind, value, item, location in refs])
+                self.db.execute("DELETE FROM items WHERE path=?", (path,))
+                self.db.executemany("INSERT INTO items (item, path) VALUES (?, ?)", [(item, path) for item in items])
+            # Touched but unchanged files only get their mtime refreshed
+            self.db.execute("INSERT OR REPLACE INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                            (path, st.st_mtime, st.st_size, digest))
+        for path in removed:
+            self.db.execute("DELETE FROM refs WHERE path=?", (path,))
+            self.db.execute("DELETE FROM items WHERE path=?", (path,))
+            self.db.execute("DELETE FROM files WHERE path=?", (path,))
+        self.db.commit()
+        return stats
+
+    @staticmethod
+    def _parse(paths, workers):
+        if len(paths) < PARALLEL_PARSE_THRESHOLD or workers == 1:
+            return [parse_file(path) for path in paths]
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(parse_file, paths, chunksize=32))
+        except (OSError, concurrent.futures.BrokenExecutor):
+            # Some platforms can't start worker processes; parse inline instead
+            return [parse_file(path) for path in paths]
+
+    def load_entities(self, snapshot_path, entity_ids):
+        """Replaces the known entity_ids when `snapshot_path` changed since the last load.
+
+        `entity_ids` is a callable returning an iterable of ids, so an unchanged
+        snapshot is never read. Returns True if the ids were reloaded.
+        """
+        stamp = f"{os.path.abspath(snapshot_path)}:{os.path.getmtime(snapshot_path)}"
+        row = self.db.execute("SELECT value FROM meta WHERE key='entities'").fetchone()
+        if row and row[0] == stamp:
+            return False
+        self.db.execute("DELETE FROM known_entities")
+        self.db.executemany("INSERT OR IGNORE INTO known_entities (entity_id) VALUES (?)",
+                            ((entity_id,) for entity_id in entity_ids()))
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('entities', ?)", (stamp,))
+        self.db.commit()
+        return True
+
+    def find(self, value, kind=None):
+        """Returns [(kind, value, item, path, location)] for a value; * and ? match like a glob."""
+        op = 'GLOB' if any(c in value for c in '*?[') else '='
+        query = f"SELECT kind, value, item, path, location FROM refs WHERE value {op} ?"
+        args = [value]
+        if kind:
+            query += " AND kind=?"
+            args.append(kind)
+        return self.db.execute(query + " ORDER BY value, item, location", args).fetchall()
+
+    def item_refs(self, item):
+        """Returns [(kind, value, item, path, location)] for everything one item references."""
+        return self.db.execute(
+            "SELECT kind, value, item, path, location FROM refs WHERE item=? ORDER BY kind, value, location",
+            (item,)).fetchall()
+
+    def item_paths(self, item):
+        """Returns the indexed files defining an automation/script, e.g. automation.morning_lights."""
+        return [path for path, in self.db.execute("SELECT path FROM items WHERE item=? ORDER BY path", (item,))]
+
+    def dangling(self):
+        """Returns entity references missing from the loaded entities snapshot."""
+        return self.db.execute(
+            "SELECT kind, value, item, path, location FROM refs "
+            "WHERE kind='entity' AND value NOT IN (SELECT entity_id FROM known_entities) "
+            "ORDER BY value, item, location").fetchall()
+
+    def has_entities(self):
+        return self.db.execute("SELECT 1 FROM known_entities LIMIT 1").fetchone() is not None
+
+    def counts(self):
+        """Returns {'files': n, kind: distinct values, ...}."""
+        result = {'files': self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]}
+        for kind, count in self.db.execute("SELECT kind, COUNT(DISTINCT value) FROM refs GROUP BY kind"):
+            result[kind] = count
+        return result
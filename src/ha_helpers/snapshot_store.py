@@ -0,0 +1,183 @@
+"""
+snapshot_store.py
+
+Keeps the history of ha_entities snapshots as one base snapshot plus per-run deltas.
+
+- The base is an NDJSON file with one entity per line.
+- Each run writes a small delta: entities added or changed (by `last_updated`)
+  and entity_ids removed since the previous run.
+- The state at any point in time is rebuilt by replaying deltas over the base.
+- Old deltas can be compacted into the base.
+"""
+import os
+import json
+import datetime
+from ha_helpers.common import atomic_write
+
+INDEX_NAME = 'index.json'
+BASE_NAME = 'base.ndjson'
+DELTA_DIR = 'deltas'
+
+def parse_ts(value):
+    """Parses an ISO timestamp into an aware UTC datetime (naive values are taken as UTC)."""
+    if isinstance(value, datetime.datetime):
+        ts = value
+    else:
+        ts = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.astimezone(datetime.timezone.utc)
+
+def entity_changed(old, new):
+    """True when an entity's state or attributes changed between two snapshots."""
+    if old.get('last_updated') and new.get('last_updated'):
+        return old['last_updated'] != new['last_updated']
+    return old.get('state') != new.get('state') or old.get('attributes') != new.get('attributes')
+
+class SnapshotStore:
+    """Base snapshot plus compact per-run deltas, stored in one directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.base_path = os.path.join(directory, BASE_NAME)
+        os.makedirs(os.path.join(directory, DELTA_DIR), exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'base_ts': None, 'deltas': []}
+
+    def _save_index(self):
+        atomic_write(self.index_path, json.dumps(self.index, indent=2))
+
+    def _read_base(self):
+        state = {}
+        if os.path.exists(self.base_path):
+            with open(self.base_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entity = json.loads(line)
+                        state[entity['entity_id']] = entity
+        return state
+
+    def _write_base(self, state):
+        atomic_write(self.base_path, ''.join(
+            json.dumps(entity, separators=(',', ':'), ensure_ascii=False) + '\n'
+            for entity in state.values()))
+
+    def _read_delta(self, entry):
+        with open(os.path.join(self.directory, DELTA_DIR, entry['file']), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _apply(state, delta):
+        for entity in delta['upserts']:
+            state[entity['entity_id']] = entity
+        for entity_id in delta['removed']:
+            state.pop(entity_id, None)
+
+    def timestamps(self):
+        """Returns the ISO timestamps of the base and every recorded delta, oldest first."""
+        base = [self.index['base_ts']] if self.index['base_ts'] else []
+        return base + [entry['ts'] for entry in self.index['deltas']]
+
+    def state_at(self, ts=None):
+        """Rebuilds {entity_id: entity} as of `ts` (latest when None).
+
+        Returns an empty dict if `ts` is before the base snapshot.
+        """
+        limit = parse_ts(ts) if ts is not None else None
+        if limit is not None and (not self.index['base_ts'] or parse_ts(self.index['base_ts']) > limit):
+            return {}
+        state = self._read_base()
+        for entry in self.index['deltas']:
+            if limit is not None and parse_ts(entry['ts']) > limit:
+                break
+            self._apply(state, self._read_delta(entry))
+        return state
+
+    def record(self, entities, ts=None):
+        """Records a full snapshot, storing only what changed since the latest one.
+
+        `entities` may be any iterable of entity dicts. Returns a summary dict
+        with the added, changed and removed counts.
+        """
+        ts = parse_ts(ts or datetime.datetime.now(datetime.timezone.utc)).isoformat()
+        if not self.index['base_ts']:
+            state = {entity['entity_id']: entity for entity in entities}
+            self._write_base(state)
+            self.index['base_ts'] = ts
+            self._save_index()
+            return {'ts': ts, 'added': len(state), 'changed': 0, 'removed': 0, 'base': True}
+
+        previous = self.state_at()
+        upserts = []
+        added = changed = 0
+        for entity in entities:
+            old = previous.pop(entity['entity_id'], None)
+            if old is None:
+                added += 1
+                upserts.append(entity)
+            elif entity_changed(old, entity):
+                changed += 1
+                upserts.append(entity)
+        # Whatever wasn't seen in this snapshot was removed
+        removed = sorted(previous)
+        summary = {'ts': ts, 'added': added, 'changed': changed, 'removed': len(removed), 'base': False}
+        if not upserts and not removed:
+            return summary
+        fname = f"{len(self.index['deltas']):06d}-{ts.replace(':', '').replace('+', 'p')}.json"
+        atomic_write(os.path.join(self.directory, DELTA_DIR, fname), json.dumps(
+            {'ts': ts, 'upserts': upserts, 'removed': removed}, separators=(',', ':'), ensure_ascii=False))
+        self.index['deltas'].append({'ts': ts, 'file': fname, 'added': added,
+                                     'changed': changed, 'removed': len(removed)})
+        self._save_index()
+        return summary
+
+    def iter_versions(self):
+        """Yields every entity version stored: the base snapshot, then each delta's upserts."""
+        yield from self._read_base().values()
+        for entry in self.index['deltas']:
+            yield from self._read_delta(entry)['upserts']
+
+    def history(self, entity_id):
+        """Yields (ts, entity or None) for every recorded change of one entity."""
+        base = self._read_base()
+        if entity_id in base:
+            yield self.index['base_ts'], base[entity_id]
+        del base
+        for entry in self.index['deltas']:
+            delta = self._read_delta(entry)
+            for entity in delta['upserts']:
+                if entity['entity_id'] == entity_id:
+                    yield entry['ts'], entity
+            if entity_id in delta['removed']:
+                yield entry['ts'], None
+
+    def compact(self, before):
+        """Folds every delta recorded at or before `before` into the base snapshot.
+
+        Returns the number of deltas folded.
+        """
+        limit = parse_ts(before)
+        folded = []
+        for entry in self.index['deltas']:
+            if parse_ts(entry['ts']) > limit:
+                break
+            folded.append(entry)
+        if not folded:
+            return 0
+        state = self._read_base()
+        for entry in folded:
+            self._apply(state, self._read_delta(entry))
+        self._write_base(state)
+        self.index['base_ts'] = folded[-1]['ts']
+        self.index['deltas'] = self.index['deltas'][len(folded):]
+        self._save_index()
+        for entry in folded:
+            os.remove(os.path.join(self.directory, DELTA_DIR, entry['file']))
+        return len(folded)
@@ -0,0 +1,172 @@
+"""
+state_mirror.py
+
+Live in-memory copy of Home Assistant's states, kept current by state_changed events.
+
+- StateMirror holds one compact row per entity (state, attributes, last_changed,
+  last_updated); states and attribute names are interned, context is dropped.
+- run_mirror() subscribes to state_changed first and then loads the initial
+  states with one WebSocket get_states. Events arriving meanwhile are buffered
+  and applied on top of the snapshot, so no change made in between is lost;
+  after that only events travel. A reconnect re-syncs the same way.
+- The table is written to ha_entities.json (or .ndjson) atomically, every
+  `flush_interval` seconds when something changed, on SIGUSR1 and on exit.
+"""
+import asyncio
+import json
+import random
+import signal
+import sys
+import time
+import websockets
+from ha_helpers.client import websocket_url
+from ha_helpers.common import atomic_write
+from ha_helpers.ws_client import HAWebSocket
+
+DEFAULT_FLUSH_INTERVAL = 30.0
+MAX_BACKOFF = 60.0
+
+class StateMirror:
+    """entity_id -> (state, attributes, last_changed, last_updated)."""
+
+    def __init__(self):
+        self.rows = {}
+        self.dirty = False
+        self.changes = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def set(self, state, only_if_newer=False):
+        """Stores one HA state object; with only_if_newer, an older copy doesn't replace a newer one."""
+        entity_id = state.get('entity_id')
+        if not entity_id:
+            return
+        updated = state.get('last_updated')
+        current = self.rows.get(entity_id)
+        # HA timestamps are UTC ISO strings, so they compare correctly as text
+        if only_if_newer and current and current[3] and updated and current[3] > updated:
+            return
+        attributes = {sys.intern(key): value for key, value in (state.get('attributes') or {}).items()}
+        self.rows[sys.intern(entity_id)] = (sys.intern(str(state.get('state'))), attributes,
+                                            state.get('last_changed'), updated)
+        self.dirty = True
+
+    def load(self, states):
+        """Merges a full state list, e.g. from get_states; drops entities it no longer contains."""
+        present = set()
+        for state in states:
+            present.add(state.get('entity_id'))
+            self.set(state, only_if_newer=True)
+        for entity_id in [e for e in self.rows if e not in present]:
+            del self.rows[entity_id]
+            self.dirty = True
+
+    def apply(self, event, only_if_newer=False):
+        """Applies one state_changed event; with only_if_newer, it doesn't replace a newer state."""
+        data = event.get('data') or {}
+        new_state = data.get('new_state')
+        self.changes += 1
+        if new_state is None:
+            if self.rows.pop(data.get('entity_id'), None) is not None:
+                self.dirty = True
+        else:
+            self.set(new_state, only_if_newer=only_if_newer)
+
+    def entities(self):
+        """Yields the mirrored entities as state dicts, like /api/states returns them."""
+        for entity_id, (state, attributes, last_changed, last_updated) in self.rows.items():
+            yield {'entity_id': entity_id, 'state': state, 'attributes': attributes,
+                   'last_changed': last_changed, 'last_updated': last_updated}
+
+    def write(self, path):
+        """Writes the table atomically: NDJSON for *.ndjson paths, otherwise a JSON array."""
+        if path.endswith('.ndjson'):
+            text = ''.join(json.dumps(e, separators=(',', ':'), ensure_ascii=False) + '\n' for e in self.entities())
+        else:
+            text = json.dumps(list(self.entities()), separators=(',', ':'), ensure_ascii=False)
+        atomic_write(path, text)
+        self.dirty = False
+
+async def _sync(conn, mirror, on_event=None):
+    """Subscribes to state_changed, then loads the current states."""
+    # Events that arrive while get_states is in flight are held back until the
+    # snapshot is loaded; otherwise load() would drop entities they created
+    pending = []
+
+    def changed(event):
+        if pending is not None:
+            pending.append(event)
+        else:
+            mirror.apply(event)
+        if on_event:
+            on_event(event)
+    await conn.subscribe('state_changed', changed)
+    reply = await conn.call({'type': 'get_states'})
+    if not reply.get('success'):
+        raise ConnectionError(f"get_states failed: {reply.get('error')}")
+    mirror.load(reply.get('result') or [])
+    # Buffered events may predate the snapshot; only newer states replace it
+    for event in pending:
+        mirror.apply(event, only_if_newer=True)
+    pending = None
+
+async def run_mirror(ha_url, token, out_path, flush_interval=DEFAULT_FLUSH_INTERVAL, on_event=None, log=print,
+                     limiter=None):
+    """Mirrors HA's states into `out_path` until cancelled; raises HAAuthError on a bad token.
+
+    `limiter` (see ha_helpers.ratelimit) paces the WebSocket commands of each (re)sync.
+    """
+    mirror = StateMirror()
+    flush_now = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, flush_now.set)
+
+    def flush(reason):
+        start = time.perf_counter()
+        mirror.write(out_path)
+        log(f"Wrote {len(mirror)} entities to {out_path} ({reason}, {mirror.changes} change(s) so far, "
+            f"{(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    async def flusher():
+        while True:
+            try:
+                await asyncio.wait_for(flush_now.wait(), timeout=flush_interval or None)
+                reason = 'on demand'
+            except asyncio.TimeoutError:
+                reason = 'periodic'
+            flush_now.clear()
+            if mirror.dirty or reason == 'on demand':
+                flush(reason)
+
+    backoff = 1.0
+    synced = False
+    flush_task = None
+    try:
+        while True:
+            try:
+                async with HAWebSocket(websocket_url(ha_url), token, limiter=limiter) as conn:
+                    await _sync(conn, mirror, on_event)
+                    backoff = 1.0
+                    log(f"{'Re-synced' if synced else 'Mirroring'} {len(mirror)} entities; "
+                        f"following state_changed (Ctrl-C to quit)")
+                    if not synced:
+                        flush('initial snapshot')
+                        synced = True
+                        flush_task = asyncio.create_task(flusher())
+                    await conn.wait_closed()
+                reason = "connection closed"
+            except (websockets.ConnectionClosed, ConnectionError, OSError, asyncio.TimeoutError) as e:
+                reason = str(e) or type(e).__name__
+            delay = backoff * random.uniform(0.5, 1.0)
+            log(f"⚠️ Lost connection to Home Assistant ({reason}); reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+    finally:
+        if flush_task:
+            flush_task.cancel()
+        if hasattr(signal, 'SIGUSR1'):
+            loop.remove_signal_handler(signal.SIGUSR1)
+        if synced and mirror.dirty:
+            flush('exit')
@@ -0,0 +1,150 @@
+"""
+trace_analytics.py
+
+Incremental statistics over full Home Assistant traces (trace/get results).
+
+- TraceAggregator.add() folds one trace into running totals and keeps nothing
+  else, so memory depends on the number of automations and steps, not on the
+  number of traces.
+- Per item: run count, failures and run-time percentiles.
+- Per step path (e.g. action/2/repeat/sequence/0): executions, failures and
+  step-time percentiles. A step's time is the gap to the next step's
+  timestamp; the last step runs until the trace's finish time.
+- Failing steps are also counted by action type (call_service, delay,
+  wait_template, ...), looked up from the item's config in the trace.
+"""
+import datetime
+from ha_helpers.event_log import DurationSketch
+
+# Keys that identify an action's type, checked in this order
+ACTION_TYPES = (
+    ('action', 'call_service'), ('service', 'call_service'), ('service_template', 'call_service'),
+    ('delay', 'delay'), ('wait_template', 'wait_template'), ('wait_for_trigger', 'wait_for_trigger'),
+    ('event', 'event'), ('scene', 'scene'), ('device_id', 'device'), ('choose', 'choose'),
+    ('if', 'if'), ('repeat', 'repeat'), ('parallel', 'parallel'), ('sequence', 'sequence'),
+    ('variables', 'variables'), ('stop', 'stop'), ('condition', 'condition'),
+)
+
+# Top-level sections of automation and script configs, by their trace path name
+SECTIONS = {'trigger': 'trigger', 'condition': 'condition', 'action': 'action', 'sequence': 'action'}
+
+def parse_ts(value):
+    """Parses an ISO timestamp from a trace; returns None if it is missing or malformed."""
+    try:
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _config_node(config, path):
+    """Follows a step path like action/1/choose/0/sequence/2 through an item's config."""
+    node = config
+    for segment in path.split('/'):
+        if isinstance(node, dict):
+            # Newer configs use plural section names (triggers, conditions, actions)
+            node = node.get(segment, node.get(segment + 's'))
+        elif isinstance(node, list) and segment.isdigit() and int(segment) < len(node):
+            node = node[int(segment)]
+        elif not isinstance(node, list) and segment == '0':
+            # A single action written without a list
+            continue
+        else:
+            return None
+        if node is None:
+            return None
+    return node
+
+def action_type(config, path):
+    """Names the kind of step at `path`: an action type, 'trigger', 'condition' or the section name."""
+    section = SECTIONS.get(path.split('/', 1)[0], path.split('/', 1)[0])
+    if section != 'action':
+        return section
+    node = _config_node(config or {}, path)
+    if isinstance(node, dict):
+        for key, name in ACTION_TYPES:
+            if key in node:
+                return name
+    return 'action'
+
+class _Stats:
+    __slots__ = ('runs', 'failed', 'durations', 'last_error')
+
+    def __init__(self):
+        self.runs = 0
+        self.failed = 0
+        self.durations = DurationSketch()
+        self.last_error = None
+
+    def add(self, duration_ms, error):
+        self.runs += 1
+        if duration_ms is not None:
+            self.durations.add(duration_ms)
+        if error:
+            self.failed += 1
+            self.last_error = str(error)
+
+    def row(self, pct):
+        d = self.durations
+        return {'runs': self.runs, 'failed': self.failed, 'p50': d.percentile(50), 'pct': d.percentile(pct),
+                'max': d.max if d.count else None, 'total': d.total, 'last_error': self.last_error}
+
+class TraceAggregator:
+    """Folds full traces into per-item, per-step and per-action-type statistics."""
+
+    def __init__(self):
+        self.items = {}
+        self.steps = {}
+        self.types = {}
+        self.step_types = {}
+        self.traces = 0
+
+    def add(self, item, trace):
+        """Adds one trace/get result for `item` (e.g. automation.kitchen_lights)."""
+        self.traces += 1
+        timestamp = trace.get('timestamp') or {}
+        start, finish = parse_ts(timestamp.get('start')), parse_ts(timestamp.get('finish'))
+        run_ms = (finish - start).total_seconds() * 1000 if start and finish else None
+        run_error = trace.get('error') or (trace.get('script_execution') in ('error', 'exception'))
+        self.items.setdefault(item, _Stats()).add(run_ms, run_error)
+
+        entries = []
+        for path, runs in (trace.get('trace') or {}).items():
+            for entry in runs or ():
+                entries.append((parse_ts(entry.get('timestamp')), path, entry.get('error')))
+        # Loops run a path several times; order every execution by time
+        entries.sort(key=lambda e: (e[0] is None, e[0] or start or datetime.datetime.min))
+        config = trace.get('config')
+        for i, (ts, path, error) in enumerate(entries):
+            end = entries[i + 1][0] if i + 1 < len(entries) else finish
+            step_ms = max(0.0, (end - ts).total_seconds() * 1000) if ts and end else None
+            key = (item, path)
+            stats = self.steps.get(key)
+            if stats is None:
+                stats = self.steps[key] = _Stats()
+                self.step_types[key] = action_type(config, path)
+            stats.add(step_ms, error)
+            kind = self.types.setdefault(self.step_types[key], [0, 0])
+            kind[0] += 1
+            kind[1] += bool(error)
+
+    def item_rows(self, pct=95):
+        """Per-item rows, the ones taking the most total time first."""
+        rows = [{'item': item, **stats.row(pct)} for item, stats in self.items.items()]
+        return sorted(rows, key=lambda r: -r['total'])
+
+    def step_rows(self, pct=95):
+        """Per-step rows, the ones taking the most total time first."""
+        rows = [{'item': item, 'path': path, 'type': self.step_types[(item, path)], **stats.row(pct)}
+                for (item, path), stats in self.steps.items()]
+        return sorted(rows, key=lambda r: -r['total'])
+
+    def failing_steps(self):
+        """Step paths that failed at least once, most failures first."""
+        rows = [{'item': item, 'path': path, 'type': self.step_types[(item, path)], 'failed': stats.failed,
+                 'runs': stats.runs, 'last_error': stats.last_error}
+                for (item, path), stats in self.steps.items() if stats.failed]
+        return sorted(rows, key=lambda r: (-r['failed'], r['item'], r['path']))
+
+    def failing_types(self):
+        """[(action type, failures, executions)] for types that failed, most failures first."""
+        rows = [(kind, failed, runs) for kind, (runs, failed) in self.types.items() if failed]
+        return sorted(rows, key=lambda r: (-r[1], r[0]))
@@ -0,0 +1,135 @@
+"""
+trace_cache.py
+
+On-disk store for Home Assistant traces, kept in SQLite under the HA-Tools logs folder.
+
+- Traces are keyed by (domain, item_id, run_id) and stored zlib-compressed.
+- A per-item high-water mark records the newest run start already scanned.
+- Old or excess entries are evicted by age, entry count and total size.
+"""
+import os
+import json
+import sqlite3
+import time
+import zlib
+from ha_helpers.common import get_default_folders
+
+DEFAULT_CACHE_NAME = 'trace_cache.sqlite3'
+DEFAULT_MAX_AGE_DAYS = 7
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_MB = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traces (
+    domain    TEXT NOT NULL,
+    item_id   TEXT NOT NULL,
+    run_id    TEXT NOT NULL,
+    started   REAL NOT NULL,
+    cached_at REAL NOT NULL,
+    trace     BLOB NOT NULL,
+    PRIMARY KEY (domain, item_id, run_id)
+);
+CREATE INDEX IF NOT EXISTS traces_started ON traces (started);
+CREATE TABLE IF NOT EXISTS watermarks (
+    domain     TEXT NOT NULL,
+    item_id    TEXT NOT NULL,
+    last_start REAL NOT NULL,
+    PRIMARY KEY (domain, item_id)
+);
+"""
+
+def default_cache_path(logs_dir=None):
+    """Returns the trace cache location inside the logs folder."""
+    logs_dir = os.path.expanduser(logs_dir) if logs_dir else get_default_folders()[4]
+    return os.path.join(logs_dir, DEFAULT_CACHE_NAME)
+
+class TraceCache:
+    """SQLite-backed trace store with per-item high-water marks."""
+
+    def __init__(self, path, max_age_days=DEFAULT_MAX_AGE_DAYS, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_mb=DEFAULT_MAX_MB):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get(self, domain, item_id, run_id):
+        """Returns the cached trace for a run, or None if it was never stored."""
+        row = self.db.execute(
+            "SELECT trace FROM traces WHERE domain=? AND item_id=? AND run_id=?",
+            (domain, item_id, run_id)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, domain, item_id, run_id, started, trace):
+        """Stores a finished trace. `started` is a POSIX timestamp."""
+        blob = zlib.compress(json.dumps(trace, separators=(',', ':')).encode('utf-8'))
+        self.db.execute(
+            "INSERT OR REPLACE INTO traces (domain, item_id, run_id, started, cached_at, trace) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (domain, item_id, run_id, started, time.time(), blob))
+
+    def watermark(self, domain, item_id):
+        """Returns the newest run start already scanned for an item, or None."""
+        row = self.db.execute(
+            "SELECT last_start FROM watermarks WHERE domain=? AND item_id=?",
+            (domain, item_id)).fetchone()
+        return row[0] if row else None
+
+    def watermarks(self, domain):
+        """Returns {item_id: last_start} for every item in a domain."""
+        return dict(self.db.execute(
+            "SELECT item_id, last_start FROM watermarks WHERE domain=?", (domain,)))
+
+    def advance_watermark(self, domain, item_id, started):
+        """Moves an item's high-water mark forward; never moves it back."""
+        self.db.execute(
+            "INSERT INTO watermarks (domain, item_id, last_start) VALUES (?, ?, ?) "
+            "ON CONFLICT(domain, item_id) DO UPDATE SET last_start=MAX(last_start, excluded.last_start)",
+            (domain, item_id, started))
+
+    def evict(self):
+        """Drops entries that are too old, then the oldest entries beyond the count and size limits."""
+        removed = 0
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.db.execute("DELETE FROM traces WHERE started < ?", (cutoff,)).rowcount
+        if self.max_entries:
+            removed += self.db.execute(
+                "DELETE FROM traces WHERE rowid IN ("
+                "SELECT rowid FROM traces ORDER BY started DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)).rowcount
+        if self.max_bytes:
+            total = self.db.execute("SELECT COALESCE(SUM(LENGTH(trace)), 0) FROM traces").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                doomed = []
+                for rowid, size in self.db.execute(
+                        "SELECT rowid, LENGTH(trace) FROM traces ORDER BY started ASC"):
+                    doomed.append((rowid,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self.db.executemany("DELETE FROM traces WHERE rowid=?", doomed)
+                removed += len(doomed)
+        self.db.commit()
+        return removed
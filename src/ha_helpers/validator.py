@@ -0,0 +1,293 @@
+"""
+validator.py
+
+Offline checks run by push_automation before anything is sent to Home Assistant.
+
+- Per file (in a process pool when there are many): YAML parses, the item is an
+  automation or script, and its trigger/condition/action structure is one HA
+  accepts, checked recursively through choose/if/repeat/parallel blocks.
+- Items without an `id` get their id from the alias; ids that aren't valid
+  object ids, or that differ from the file name, are flagged because HA would
+  create a second entity instead of updating the existing one.
+- Across files: two files pushing to the same id, including a pushed file that
+  reuses the id of another local file that isn't part of this push (looked
+  up in the reference index, so other files are only re-read when they change).
+- Entity references (including templates) are resolved against the cached
+  ha_entities.json snapshot.
+
+Problems are errors (the file is not pushed) or warnings (reported only;
+strict mode turns them into errors).
+"""
+import concurrent.futures
+import os
+import re
+from ha_helpers.ref_index import ENTITY_ID, extract_refs
+
+# Below this many files, they are validated inline rather than in worker processes
+PARALLEL_VALIDATE_THRESHOLD = 200
+
+MODES = {'single', 'restart', 'queued', 'parallel'}
+
+AUTOMATION_KEYS = {
+    'id', 'alias', 'description', 'mode', 'max', 'max_exceeded', 'trigger', 'triggers', 'condition',
+    'conditions', 'action', 'actions', 'variables', 'trigger_variables', 'initial_state', 'trace',
+}
+SCRIPT_KEYS = {'id', 'alias', 'description', 'icon', 'mode', 'max', 'max_exceeded', 'sequence', 'fields',
+               'variables', 'trace'}
+
+# Keys that make a dict an action
+ACTION_KEYS = (
+    'action', 'service', 'service_template', 'delay', 'wait_template', 'wait_for_trigger', 'event', 'scene',
+    'device_id', 'choose', 'if', 'repeat', 'parallel', 'sequence', 'variables', 'stop', 'condition',
+    'set_conversation_response',
+)
+# Shorthand condition keys (`- or: [...]`)
+CONDITION_SHORTHANDS = ('and', 'or', 'not')
+
+def derive_entity_id(content):
+    """The id an item is pushed under: its `id`, else its alias lowercased with spaces as underscores."""
+    return content.get('id', str(content.get('alias', '')).lower().replace(' ', '_'))
+
+def item_type(content):
+    """'automation', 'script' or None."""
+    if 'trigger' in content or 'triggers' in content:
+        return 'automation'
+    if 'sequence' in content:
+        return 'script'
+    return None
+
+def slugify(text):
+    """Approximates Home Assistant's slugify for ASCII text."""
+    return re.sub(r'[^a-z0-9]+', '_', str(text).lower()).strip('_')
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def _join(location, key):
+    return f"{location}/{key}" if location else str(key)
+
+def _is_template(value):
+    return isinstance(value, str) and '{{' in value
+
+def check_triggers(value, location, errors):
+    for i, trigger in enumerate(_as_list(value)):
+        where = _join(location, i)
+        if not isinstance(trigger, dict):
+            errors.append(f"{where}: a trigger must be a mapping")
+        elif 'platform' not in trigger and 'trigger' not in trigger:
+            errors.append(f"{where}: trigger has no 'trigger' (or 'platform') type")
+
+def check_conditions(value, location, errors):
+    for i, condition in enumerate(_as_list(value)):
+        where = _join(location, i)
+        if _is_template(condition):
+            continue
+        if not isinstance(condition, dict):
+            errors.append(f"{where}: a condition must be a mapping or a template")
+            continue
+        shorthand = next((key for key in CONDITION_SHORTHANDS if key in condition), None)
+        if shorthand:
+            check_conditions(condition[shorthand], _join(where, shorthand), errors)
+        elif 'condition' not in condition:
+            errors.append(f"{where}: condition has no 'condition' type")
+        elif condition['condition'] in CONDITION_SHORTHANDS:
+            if 'conditions' not in condition:
+                errors.append(f"{where}: '{condition['condition']}' condition has no 'conditions'")
+            else:
+                check_conditions(condition['conditions'], _join(where, 'conditions'), errors)
+
+def check_actions(value, location, errors):
+    for i, action in enumerate(_as_list(value)):
+        where = _join(location, i)
+        if not isinstance(action, dict):
+            errors.append(f"{where}: an action must be a mapping")
+            continue
+        if not any(key in action for key in ACTION_KEYS):
+            errors.append(f"{where}: unknown action type (keys: {', '.join(map(str, action)) or 'none'})")
+            continue
+        if 'choose' in action:
+            for j, option in enumerate(_as_list(action['choose'])):
+                option_at = _join(_join(where, 'choose'), j)
+                if not isinstance(option, dict) or 'sequence' not in option:
+                    errors.append(f"{option_at}: a choose option needs 'conditions' and 'sequence'")
+                    continue
+                check_conditions(option.get('conditions', []), _join(option_at, 'conditions'), errors)
+                check_actions(option['sequence'], _join(option_at, 'sequence'), errors)
+            if 'default' in action:
+                check_actions(action['default'], _join(where, 'default'), errors)
+        if 'if' in action:
+            check_conditions(action['if'], _join(where, 'if'), errors)
+            if 'then' not in action:
+                errors.append(f"{where}: 'if' action has no 'then'")
+            else:
+                check_actions(action['then'], _join(where, 'then'), errors)
+            if 'else' in action:
+                check_actions(action['else'], _join(where, 'else'), errors)
+        if 'repeat' in action:
+            repeat = action['repeat']
+            repeat_at = _join(where, 'repeat')
+            if not isinstance(repeat, dict) or 'sequence' not in repeat:
+                errors.append(f"{repeat_at}: 'repeat' needs a 'sequence'")
+            else:
+                if not any(key in repeat for key in ('count', 'while', 'until', 'for_each')):
+                    errors.append(f"{repeat_at}: 'repeat' needs 'count', 'while', 'until' or 'for_each'")
+                for key in ('while', 'until'):
+                    if key in repeat:
+                        check_conditions(repeat[key], _join(repeat_at, key), errors)
+                check_actions(repeat['sequence'], _join(repeat_at, 'sequence'), errors)
+        if 'parallel' in action:
+            check_actions(action['parallel'], _join(where, 'parallel'), errors)
+        if 'sequence' in action and not any(key in action for key in ('choose', 'repeat')):
+            check_actions(action['sequence'], _join(where, 'sequence'), errors)
+        if 'wait_for_trigger' in action:
+            check_triggers(action['wait_for_trigger'], _join(where, 'wait_for_trigger'), errors)
+        if 'condition' in action:
+            _check_condition_action(action, where, errors)
+
+def _check_condition_action(action, where, errors):
+    # A condition used as an action: `- condition: state ...`
+    if action['condition'] in CONDITION_SHORTHANDS and 'conditions' not in action:
+        errors.append(f"{where}: '{action['condition']}' condition has no 'conditions'")
+    elif 'conditions' in action:
+        check_conditions(action['conditions'], _join(where, 'conditions'), errors)
+
+def check_item(content, entity_type):
+    """Schema errors and warnings for one automation/script."""
+    errors, warnings = [], []
+    allowed = AUTOMATION_KEYS if entity_type == 'automation' else SCRIPT_KEYS
+    for key in content:
+        if key not in allowed:
+            warnings.append(f"unknown {entity_type} option '{key}'")
+    if content.get('mode', 'single') not in MODES:
+        errors.append(f"mode: '{content['mode']}' is not one of {', '.join(sorted(MODES))}")
+
+    if entity_type == 'automation':
+        triggers_key = 'triggers' if 'triggers' in content else 'trigger'
+        if not content.get(triggers_key):
+            errors.append(f"{triggers_key}: an automation needs at least one trigger")
+        else:
+            check_triggers(content[triggers_key], triggers_key, errors)
+        conditions_key = 'conditions' if 'conditions' in content else 'condition'
+        if content.get(conditions_key):
+            check_conditions(content[conditions_key], conditions_key, errors)
+        actions_key = 'actions' if 'actions' in content else 'action'
+        if actions_key not in content:
+            errors.append("action: an automation needs an 'action' (or 'actions') list")
+        elif content[actions_key]:
+            check_actions(content[actions_key], actions_key, errors)
+    else:
+        if content['sequence']:
+            check_actions(content['sequence'], 'sequence', errors)
+    return errors, warnings
+
+def check_identity(content, path, entity_type):
+    """Flags ids derived from the alias that HA would resolve differently.
+
+    A script's id is its object id, so a derived id that isn't one is an error;
+    an automation's id is free-form, so there it is only a warning.
+    """
+    errors, warnings = [], []
+    if 'id' in content:
+        return errors, warnings
+    alias = content.get('alias')
+    if not alias:
+        errors.append("no 'id' or 'alias' to derive the entity id from")
+        return errors, warnings
+    derived = derive_entity_id(content)
+    slug = slugify(alias)
+    if derived != slug:
+        if entity_type == 'script':
+            errors.append(f"no 'id': the id derived from alias '{alias}' is '{derived}', which is not a valid "
+                          f"object id (Home Assistant would use '{slug}'); add `id: {slug}`")
+        else:
+            warnings.append(f"no 'id': pushed with id '{derived}' (from alias '{alias}'), but Home Assistant "
+                            f"names the entity after '{slug}'; add `id: {slug}` to keep them in step")
+        return errors, warnings
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem != derived and slugify(stem) == stem:
+        warnings.append(f"no 'id': pushed as '{derived}' (from the alias) but the file is named '{stem}'; "
+                        f"add an `id` so renaming the alias doesn't create a second entity")
+    return errors, warnings
+
+def validate_file(path):
+    """Checks one file on its own. Returns a report dict; runs in worker processes."""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    report = {'path': path, 'entity_type': None, 'entity_id': None, 'key': None, 'aliases': [],
+              'errors': [], 'warnings': [], 'refs': []}
+    try:
+        with open(path, 'r') as f:
+            content = yaml.load(f, Loader=loader)
+    except (OSError, yaml.YAMLError) as e:
+        report['errors'].append(f"could not read YAML: {e}")
+        return report
+    if not isinstance(content, dict) or ('id' not in content and 'alias' not in content):
+        report['errors'].append("each automation/script must be a dictionary with an 'id' or 'alias'")
+        return report
+    entity_type = item_type(content)
+    if entity_type is None:
+        # Not an automation or script; push skips it
+        return report
+    entity_id = derive_entity_id(content)
+    report.update(entity_type=entity_type, entity_id=entity_id, key=f"{entity_type}.{entity_id}")
+    # Other items may reference this one by id or by its alias-based entity_id
+    report['aliases'] = [f"{entity_type}.{entity_id}", f"{entity_type}.{slugify(content.get('alias', ''))}"]
+
+    for check in (check_item(content, entity_type), check_identity(content, path, entity_type)):
+        report['errors'] += check[0]
+        report['warnings'] += check[1]
+    # Script ids become entity_ids; automation ids are free-form
+    if entity_type == 'script' and 'id' in content and not ENTITY_ID.match(f"script.{entity_id}"):
+        report['errors'].append(f"id: '{entity_id}' is not a valid script object id")
+    report['refs'] = sorted({(value, location) for kind, value, location in extract_refs(content)
+                             if kind == 'entity'})
+    return report
+
+def _map_files(func, paths, workers):
+    if len(paths) < PARALLEL_VALIDATE_THRESHOLD or workers == 1:
+        return [func(path) for path in paths]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(func, paths, chunksize=32))
+    except (OSError, concurrent.futures.BrokenExecutor):
+        # Some platforms can't start worker processes; run inline instead
+        return [func(path) for path in paths]
+
+def validate_files(paths, known_entities=None, strict=False, workers=None, defined_in=None):
+    """Validates files offline and returns one report per file, in order.
+
+    `known_entities` is a set of entity_ids (from the ha_entities snapshot);
+    without it, entity references aren't checked. `defined_in` maps a
+    "<type>.<id>" key to the local files defining it (RefIndex.item_paths);
+    a pushed file reusing the id of another local file is a duplicate too.
+    With `strict`, warnings count as errors.
+    """
+    paths = list(paths)
+    reports = _map_files(validate_file, paths, workers)
+
+    by_key = {}
+    for report in reports:
+        if report['key']:
+            by_key.setdefault(report['key'], []).append(report['path'])
+    if defined_in is not None:
+        pushed = {os.path.realpath(path) for path in paths}
+        for key, defining in by_key.items():
+            defining += [path for path in defined_in(key) if os.path.realpath(path) not in pushed]
+    for report in reports:
+        others = [p for p in by_key.get(report['key'], ()) if p != report['path']]
+        if others:
+            report['errors'].append(f"duplicate id: {report['key']} is also defined in {', '.join(others)}")
+
+    if known_entities is not None:
+        # Items in this push count as existing
+        known = set(known_entities).union(*(r['aliases'] for r in reports))
+        for report in reports:
+            for value, location in report['refs']:
+                if value not in known:
+                    report['warnings'].append(f"{location}: unknown entity {value}")
+
+    if strict:
+        for report in reports:
+            report['errors'] += report['warnings']
+            report['warnings'] = []
+    return reports
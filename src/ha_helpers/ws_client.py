@@ -0,0 +1,173 @@
+"""
+ws_client.py
+
+HAWebSocket, the shared Home Assistant WebSocket client (see ha_helpers.client).
+"""
+import asyncio
+import json
+import time
+import websockets
+from ha_helpers.client import (
+    DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_RETRIES, HAAuthError, LatencyStats, retry_delay,
+)
+
+class HAWebSocket:
+    """One authenticated Home Assistant WebSocket shared by many concurrent commands.
+
+    Each command gets its own message id; a single reader task routes replies
+    back to the waiting caller and passes subscription events to callbacks.
+    At most `concurrency` commands are in flight at once; an optional
+    `limiter` (ha_helpers.ratelimit) narrows that adaptively.
+
+    Usage:
+        async with HAWebSocket(url, token) as ws:
+            reply = await ws.call({"type": "trace/list", "domain": "automation"})
+    """
+
+    def __init__(self, url, token, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, stats=None, limiter=None):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.stats = stats if stats is not None else LatencyStats()
+        self.limiter = limiter
+        self.ws = None
+        self._concurrency = max(1, concurrency)
+        self._next_id = 1
+        self._futures = {}
+        self._subscriptions = {}
+        self._reader = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        """Opens the connection and authenticates. Raises HAAuthError on a bad token."""
+        self.ws = await websockets.connect(self.url, max_size=None)
+        try:
+            await self.ws.recv()                                # auth_required
+            await self.ws.send(json.dumps({"type": "auth", "access_token": self.token}))
+            auth_ok = json.loads(await self.ws.recv())
+            if auth_ok.get("type") != "auth_ok":
+                raise HAAuthError(auth_ok.get("message", "WebSocket authentication failed"))
+        except BaseException:
+            await self.ws.close()
+            raise
+        self._slots = asyncio.Semaphore(self._concurrency)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self.ws:
+            await self.ws.close()
+
+    async def wait_closed(self):
+        """Waits until the connection drops; re-raises the error that closed it, if any."""
+        await asyncio.shield(self._reader)
+
+    @property
+    def connected(self):
+        return self._reader is not None and not self._reader.done()
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.ws:
+                try:
+                    msg = json.loads(raw)
+                except ValueError as e:
+                    # A truncated or garbled frame: the stream can't be trusted any more
+                    raise ConnectionError(f"Malformed WebSocket message: {e}") from e
+                if not isinstance(msg, dict):
+                    raise ConnectionError(f"Unexpected WebSocket message: {str(raw)[:80]}")
+                if msg.get("type") == "event":
+                    callback = self._subscriptions.get(msg.get("id"))
+                    if callback:
+                        callback(msg["event"])
+                    continue
+                fut = self._futures.pop(msg.get("id"), None)
+                if fut and not fut.done():
+                    fut.set_result(msg)
+        except websockets.ConnectionClosedOK:
+            pass
+        finally:
+            # Fail every waiting caller instead of leaving them hanging
+            error = ConnectionError("WebSocket connection closed")
+            for fut in self._futures.values():
+                if not fut.done():
+                    fut.set_exception(error)
+            self._futures.clear()
+
+    async def _send(self, payload, timeout, callback=None):
+        if not self.connected:
+            raise ConnectionError("WebSocket connection closed")
+        msg_id = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._futures[msg_id] = fut
+        if callback:
+            # Registered before sending so no event can arrive ahead of it
+            self._subscriptions[msg_id] = callback
+        try:
+            await self.ws.send(json.dumps({"id": msg_id, **payload}))
+            return msg_id, await asyncio.wait_for(fut, timeout=timeout)
+        finally:
+            self._futures.pop(msg_id, None)
+
+    async def call(self, payload, timeout=None, retries=None):
+        """Sends one command and returns HA's reply message.
+
+        Timed-out commands are retried with jittered backoff; after the last
+        attempt a synthetic {"success": False, "error": {"code": "timeout"}}
+        reply is returned. ConnectionError is raised if the connection drops.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        op = payload.get("type", "?")
+        for attempt in range(retries + 1):
+            async with self._slots:
+                if self.limiter:
+                    await self.limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    _, reply = await self._send(payload, timeout)
+                except asyncio.TimeoutError:
+                    self.stats.record(op, time.perf_counter() - start, error=True)
+                    if self.limiter:
+                        self.limiter.release(time.perf_counter() - start, error=True)
+                except Exception:
+                    if self.limiter:
+                        self.limiter.release(time.perf_counter() - start, error=True)
+                    raise
+                except BaseException:
+                    # Cancelled: free the slot without judging HA by it
+                    if self.limiter:
+                        self.limiter.release()
+                    raise
+                else:
+                    self.stats.record(op, time.perf_counter() - start, error=not reply.get("success"))
+                    # An error reply is HA answering normally; only timeouts and dropped connections mean overload
+                    if self.limiter:
+                        self.limiter.release(time.perf_counter() - start)
+                    return reply
+            if attempt < retries:
+                await asyncio.sleep(retry_delay(attempt))
+        return {"success": False, "error": {"code": "timeout", "message": f"{op} timed out"}}
+
+    async def subscribe(self, event_type, callback, timeout=None):
+        """Subscribes to an event type; `callback(event)` runs in the reader for each event."""
+        msg_id, reply = await self._send({"type": "subscribe_events", "event_type": event_type},
+                                         self.timeout if timeout is None else timeout, callback=callback)
+        if not reply.get("success", True):
+            self._subscriptions.pop(msg_id, None)
+            raise RuntimeError(f"Could not subscribe to {event_type}: {reply.get('error')}")
+        return msg_id
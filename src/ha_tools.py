@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+ha_tools.py
+
+Single entry point for all ha-tools CLIs: `ha-tools <command> [options]`.
+
+- Only the module of the chosen command is imported, so a call pays for the
+  dependencies of that one tool and nothing else.
+- Every command accepts the same options as its standalone script
+  (`ha-tools push --force` is `push-automation --force`); the standalone
+  console scripts still work.
+- `ha-tools --help` lists the commands without importing any of them.
+
+Usage:
+  ha-tools <command> [options]
+  ha-tools <command> --help
+"""
+import importlib
+import sys
+
+# command: (module, description)
+COMMANDS = {
+    'push': ('push_automation', 'Push automations/scripts to Home Assistant'),
+    'pull': ('pull_automations', 'Pull automations/scripts from Home Assistant'),
+    'entities': ('get_ha_entities', 'Export all entity states'),
+    'state-doc': ('generate_entity_state_doc', 'List non-standard entity states from an entity export'),
+    'traces': ('get_recent_trace_errors', 'Report recent trace errors and trace analytics'),
+    'refs': ('entity_refs', 'Find which automations/scripts reference an entity, service or device'),
+    'watchdog': ('automation_watchdog', 'Watch automation runs in real time'),
+    'watchdog-log': ('watchdog_log', "Query the watchdog's run-outcome log"),
+    'decompose': ('decompose_automations', 'Split automations.yaml/scripts.yaml into one file per item'),
+    'daemon': ('ha_daemon', 'Keep Home Assistant connections warm for the other tools'),
+    'setup': ('setup_ha_tools', 'Interactive first-time setup'),
+    'mock-server': ('mock_ha_server', 'Run a mock Home Assistant for testing'),
+    'benchmark': ('ha_benchmark', 'Benchmark the CLIs against the mock server'),
+}
+
+# The standalone console script names work as commands too
+ALIASES = {
+    'push-automation': 'push',
+    'pull-automations': 'pull',
+    'get-ha-entities': 'entities',
+    'generate-entity-state-doc': 'state-doc',
+    'get-recent-trace-errors': 'traces',
+    'entity-refs': 'refs',
+    'automation-watchdog': 'watchdog',
+    'decompose-automations': 'decompose',
+    'ha-daemon': 'daemon',
+    'setup-ha-tools': 'setup',
+    'mock-ha-server': 'mock-server',
+    'ha-benchmark': 'benchmark',
+}
+
+def usage():
+    width = max(len(name) for name in COMMANDS)
+    lines = ["usage: ha-tools <command> [options]", "", "commands:"]
+    lines += [f"  {name:<{width}}  {description}" for name, (_, description) in COMMANDS.items()]
+    lines += ["", "Run 'ha-tools <command> --help' for the options of a command."]
+    return '\n'.join(lines)
+
+def resolve(command):
+    """Returns the canonical command name, or None if it is unknown."""
+    command = ALIASES.get(command, command)
+    return command if command in COMMANDS else None
+
+def load(command):
+    """Imports and returns the module implementing a command."""
+    return importlib.import_module(COMMANDS[command][0])
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return
+    command = resolve(argv[0])
+    if command is None:
+        print(f"ha-tools: unknown command '{argv[0]}'\n\n{usage()}", file=sys.stderr)
+        sys.exit(2)
+    module = load(command)
+    # The tool parses sys.argv itself; make its --help read "ha-tools <command>"
+    sys.argv = [f"ha-tools {command}", *argv[1:]]
+    module.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+mock_ha_server.py
+
+Scriptable stand-in for Home Assistant, used by ha_benchmark.py and for trying
+the tools without a live instance.
+
+- Serves the REST endpoints the tools use (/api/states and
+  /api/config/{automation|script}/config[/<id>]) and the WebSocket API
+  (/api/websocket: auth, subscribe_events, get_states, trace/list, trace/get,
+  config/entity_registry/list) on a single port, like HA itself.
+- Entity, automation, script and trace counts are configurable; replies can be
+  delayed by a fixed latency to mimic a remote or busy instance.
+- Event storms: once a client subscribes to automation_triggered, the server
+  fires N automation runs (optionally rate-limited), each followed by a
+  state_changed completion signal and a fetchable trace.
+- State churn: state_changed subscribers receive N entity state changes per
+  second, which are reflected in /api/states and get_states.
+- Counts every request by endpoint / command type.
+
+Usage:
+  python mock_ha_server.py [--port N] [--entities N] [--automations N] [--scripts N]
+                           [--traces-per-item N] [--latency MS] [--storm N] [--storm-rate N]
+                           [--state-churn N] [--token TOKEN]
+
+Arguments:
+  --port N              Port to listen on (default: 8123)
+  --entities N          Number of plain entities in /api/states (default: 100)
+  --automations N       Number of automations (default: 100)
+  --scripts N           Number of scripts (default: 10)
+  --traces-per-item N   Stored traces per automation/script (default: 3)
+  --latency MS          Delay added to every reply in milliseconds (default: 0)
+  --storm N             Automation runs fired at each automation_triggered subscriber (default: 0)
+  --storm-rate N        Runs per second during a storm; 0 fires as fast as possible (default: 0)
+  --state-churn N       state_changed events per second sent to state_changed subscribers (default: 0)
+  --token TOKEN         Access token clients must present (default: mock-token)
+
+Point config.json at it with "HA_URL": "http://127.0.0.1:<port>" and the token.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import datetime
+import hashlib
+import json
+import struct
+import threading
+import urllib.parse
+
+DEFAULT_PORT = 8123
+DEFAULT_TOKEN = 'mock-token'
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+ENTITY_DOMAINS = ('light', 'switch', 'sensor', 'binary_sensor')
+
+def iso(ts):
+    return ts.isoformat()
+
+class MockHA:
+    """In-process mock of the Home Assistant REST and WebSocket APIs.
+
+    Usage:
+        server = MockHA(entities=1000, automations=1000).start_in_thread()
+        ...  # point tools at server.url with server.token
+        server.stop()
+    """
+
+    def __init__(self, entities=100, automations=100, scripts=10, traces_per_item=3, latency=0.0,
+                 error_every=10, storm=0, storm_rate=0.0, run_time=0.05, state_churn=0.0, token=DEFAULT_TOKEN):
+        self.latency = latency
+        self.error_every = max(1, error_every)
+        self.storm = storm
+        self.storm_rate = storm_rate
+        self.state_churn = state_churn
+        self.run_time = run_time
+        self.token = token
+        self.traces_per_item = traces_per_item
+        self.counts = collections.Counter()
+        self.now = datetime.datetime.now(datetime.timezone.utc)
+        self.configs = {
+            'automation': {f"bench_{i:05d}": self._automation_config(i) for i in range(automations)},
+            'script': {f"bench_script_{i:05d}": self._script_config(i) for i in range(scripts)},
+        }
+        self.positions = {domain: {item_id: i for i, item_id in enumerate(items)}
+                          for domain, items in self.configs.items()}
+        self.states = [self._state(f"{ENTITY_DOMAINS[i % len(ENTITY_DOMAINS)]}.bench_{i:05d}", i)
+                       for i in range(entities)]
+        self.states += [self._state(f"{domain}.{item_id}", 0, {'id': item_id, 'current': 0})
+                        for domain, items in self.configs.items() for item_id in items]
+        # Storm runs fetched by the watchdog: (domain, item_id) -> {run_id: trace summary}
+        self.runs = collections.defaultdict(dict)
+        self._states_body = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._storm_seq = 0
+        self._churn_seq = 0
+        self.port = None
+
+    # ----- generated data -------------------------------------------------
+
+    @staticmethod
+    def _automation_config(i):
+        return {
+            'id': f"bench_{i:05d}",
+            'alias': f"Bench {i:05d}",
+            'description': '',
+            'trigger': [{'platform': 'state', 'entity_id': f"binary_sensor.bench_{i:05d}", 'to': 'on'}],
+            'condition': [],
+            'action': [{'service': 'light.turn_on', 'target': {'entity_id': f"light.bench_{i:05d}"}}],
+            'mode': 'single',
+        }
+
+    @staticmethod
+    def _script_config(i):
+        return {
+            'alias': f"Bench script {i:05d}",
+            'sequence': [{'service': 'light.turn_off', 'target': {'entity_id': f"light.bench_{i:05d}"}}],
+            'mode': 'single',
+        }
+
+    def _state(self, entity_id, i, attributes=None):
+        ts = iso(self.now - datetime.timedelta(minutes=i % 60))
+        return {
+            'entity_id': entity_id,
+            'state': 'on' if i % 2 else 'off',
+            'attributes': attributes or {'friendly_name': entity_id.split('.', 1)[1].replace('_', ' ')},
+            'last_changed': ts,
+            'last_updated': ts,
+            'context': {'id': f"ctx{i:08d}", 'parent_id': None, 'user_id': None},
+        }
+
+    def _summary(self, domain, item_id, run_id, start, error=None, running=False):
+        finish = None if running else start + datetime.timedelta(milliseconds=50)
+        summary = {
+            'last_step': f"{'action' if domain == 'automation' else 'sequence'}/0",
+            'run_id': run_id,
+            'state': 'running' if running else 'stopped',
+            'script_execution': None if running else ('error' if error else 'finished'),
+            'timestamp': {'start': iso(start), 'finish': iso(finish) if finish else None},
+            'domain': domain,
+            'item_id': item_id,
+        }
+        if error:
+            summary['error'] = error
+        if domain == 'automation':
+            summary['trigger'] = 'state of binary_sensor'
+        return summary
+
+    def _extended(self, summary):
+        # trace/get returns the summary plus the per-step trace and the config
+        start = summary['timestamp']['start']
+        step = 'action/0' if summary['domain'] == 'automation' else 'sequence/0'
+        steps = {step: [{'path': step, 'timestamp': start, 'changed_variables': {},
+                         'result': {'params': {}, 'running_script': False}}]}
+        if summary['domain'] == 'automation':
+            steps = {'trigger/0': [{'path': 'trigger/0', 'timestamp': start,
+                                    'changed_variables': {'trigger': {'platform': 'state'}}}], **steps}
+        if summary.get('error'):
+            steps[step][0]['error'] = summary['error']
+        return {**summary, 'trace': steps,
+                'config': self.configs[summary['domain']].get(summary['item_id'], {}),
+                'context': {'id': summary['run_id'], 'parent_id': None, 'user_id': None}}
+
+    def _stored_runs(self, domain, item_id):
+        index = self.positions[domain].get(item_id, 0)
+        for k in range(self.traces_per_item):
+            error = "Mock failure" if k == 0 and index % self.error_every == 0 else None
+            start = self.now - datetime.timedelta(seconds=60 * (k + 1))
+            yield self._summary(domain, item_id, f"{item_id}-{k}", start, error)
+
+    def trace_list(self, domain, item_id=None):
+        items = [item_id] if item_id else list(self.configs.get(domain, {}))
+        result = []
+        for item in items:
+            if item in self.configs.get(domain, {}):
+                result.extend(self._stored_runs(domain, item))
+            result.extend(self.runs.get((domain, item), {}).values())
+        return result
+
+    def trace_get(self, domain, item_id, run_id):
+        run = self.runs.get((domain, item_id), {}).get(run_id)
+        if run is not None:
+            return self._extended(run)
+        for summary in self._stored_runs(domain, item_id) if item_id in self.configs.get(domain, {}) else ():
+            if summary['run_id'] == run_id:
+                return self._extended(summary)
+        return None
+
+    def entity_registry(self):
+        return [{'entity_id': s['entity_id'], 'unique_id': s['entity_id'].split('.', 1)[1],
+                 'platform': s['entity_id'].split('.', 1)[0], 'device_id': None,
+                 'config_entry_id': None, 'disabled_by': None, 'name': None}
+                for s in self.states]
+
+    # ----- lifecycle ------------------------------------------------------
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def total_requests(self):
+        return sum(self.counts.values())
+
+    def reset_counts(self):
+        self.counts.clear()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._client, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        """Runs the server on its own event loop in a daemon thread; returns once it is listening."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            ready.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='mock-ha', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread:
+            asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    # ----- HTTP -----------------------------------------------------------
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = lines[0].split(' ', 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+                path = urllib.parse.urlsplit(target).path
+                if path == '/api/websocket' and headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, headers)
+                    return
+                status, payload = await self._rest(method, path, headers, body)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode('latin-1'))
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _rest(self, method, path, headers, body):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parts = path.strip('/').split('/')
+        route = path
+        if len(parts) >= 4 and parts[:2] == ['api', 'config'] and parts[3] == 'config':
+            route = '/api/config/{domain}/config' + ('/{id}' if len(parts) > 4 else '')
+        self.counts[f"{method} {route}"] += 1
+        if headers.get('authorization') != f"Bearer {self.token}":
+            return '401 Unauthorized', {'message': 'Unauthorized'}
+        if path.rstrip('/') == '/api':
+            return '200 OK', {'message': 'API running.'}
+        if path == '/api/states' and method == 'GET':
+            if self._states_body is None:
+                self._states_body = json.dumps(self.states).encode('utf-8')
+            return '200 OK', self._states_body
+        if route.startswith('/api/config/{domain}') and parts[2] in self.configs:
+            items = self.configs[parts[2]]
+            if len(parts) == 4 and method == 'GET':
+                return '200 OK', list(items.values())
+            item_id = '/'.join(parts[4:])
+            if method == 'GET':
+                if item_id in items:
+                    return '200 OK', items[item_id]
+                return '404 Not Found', {'message': 'Resource not found'}
+            if method == 'POST':
+                try:
+                    items[item_id] = json.loads(body or b'null')
+                except ValueError:
+                    return '400 Bad Request', {'message': 'Message format incorrect'}
+                return '200 OK', {'result': 'ok'}
+            if method == 'DELETE':
+                if items.pop(item_id, None) is None:
+                    return '404 Not Found', {'message': 'Resource not found'}
+                return '200 OK', {'result': 'ok'}
+        return '404 Not Found', {'message': 'Not found'}
+
+    # ----- WebSocket ------------------------------------------------------
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1(
+            (headers['sec-websocket-key'] + WS_GUID).encode('ascii')).digest()).decode('ascii')
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        conn = _WSConnection(reader, writer)
+        self.counts['ws connect'] += 1
+        tasks = set()
+        try:
+            await conn.send({'type': 'auth_required', 'ha_version': '2025.1.0'})
+            auth = await conn.recv()
+            if not auth or auth.get('access_token') != self.token:
+                await conn.send({'type': 'auth_invalid', 'message': 'Invalid access token or password'})
+                return
+            await conn.send({'type': 'auth_ok', 'ha_version': '2025.1.0'})
+            while True:
+                msg = await conn.recv()
+                if msg is None:
+                    return
+                task = asyncio.create_task(self._command(conn, msg))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            conn.closed = True
+
+    async def _command(self, conn, msg):
+        kind = msg.get('type', '?')
+        self.counts[f"ws {kind}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if kind == 'subscribe_events':
+            conn.subscriptions[msg['id']] = msg.get('event_type')
+            await conn.result(msg['id'], None)
+            if msg.get('event_type') == 'automation_triggered' and self.storm:
+                await self._storm(conn, msg['id'])
+            elif msg.get('event_type') == 'state_changed' and self.state_churn:
+                await self._churn(conn, msg['id'])
+        elif kind == 'get_states':
+            await conn.result(msg['id'], self.states)
+        elif kind == 'trace/list':
+            await conn.result(msg['id'], self.trace_list(msg.get('domain'), msg.get('item_id')))
+        elif kind == 'trace/get':
+            trace = self.trace_get(msg.get('domain'), msg.get('item_id'), msg.get('run_id'))
+            if trace is None:
+                await conn.error(msg['id'], 'not_found', 'The trace could not be found')
+            else:
+                await conn.result(msg['id'], trace)
+        elif kind == 'config/entity_registry/list':
+            await conn.result(msg['id'], self.entity_registry())
+        elif kind == 'ping':
+            await conn.send({'id': msg['id'], 'type': 'pong'})
+        else:
+            await conn.error(msg['id'], 'unknown_command', 'Unknown command.')
+
+    async def _storm(self, conn, sub_id):
+        items = list(self.configs['automation'])
+        if not items:
+            return
+        for i in range(self.storm):
+            if conn.closed:
+                return
+            self._storm_seq += 1
+            item_id = items[i % len(items)]
+            run_id = f"storm{self._storm_seq:08d}"
+            self.runs[('automation', item_id)][run_id] = self._summary(
+                'automation', item_id, run_id, datetime.datetime.now(datetime.timezone.utc), running=True)
+            await conn.event(sub_id, 'automation_triggered',
+                             {'name': item_id, 'entity_id': f"automation.{item_id}", 'source': 'mock storm'},
+                             run_id)
+            asyncio.get_running_loop().call_later(
+                self.run_time, lambda i=i, item_id=item_id, run_id=run_id:
+                asyncio.ensure_future(self._finish_run(conn, i, item_id, run_id)))
+            if self.storm_rate:
+                await asyncio.sleep(1 / self.storm_rate)
+            elif i % 100 == 99:
+                await asyncio.sleep(0)
+
+    async def _churn(self, conn, sub_id):
+        # Flips plain entities on/off one after another
+        plain = len(self.states) - sum(len(items) for items in self.configs.values())
+        while plain and not conn.closed:
+            i = self._churn_seq % plain
+            self._churn_seq += 1
+            old = self.states[i]
+            ts = iso(datetime.datetime.now(datetime.timezone.utc))
+            new = {**old, 'state': 'off' if old['state'] == 'on' else 'on', 'last_changed': ts, 'last_updated': ts}
+            self.states[i] = new
+            self._states_body = None
+            await conn.event(sub_id, 'state_changed',
+                             {'entity_id': new['entity_id'], 'old_state': old, 'new_state': new},
+                             f"churn{self._churn_seq:08d}")
+            await asyncio.sleep(1 / self.state_churn)
+
+    async def _finish_run(self, conn, i, item_id, run_id):
+        runs = self.runs[('automation', item_id)]
+        start = datetime.datetime.fromisoformat(runs[run_id]['timestamp']['start'])
+        error = "Mock failure" if i % self.error_every == 0 else None
+        runs[run_id] = self._summary('automation', item_id, run_id, start, error)
+        entity_id = f"automation.{item_id}"
+        for sub_id, event_type in list(conn.subscriptions.items()):
+            if event_type == 'state_changed' and not conn.closed:
+                await conn.event(sub_id, 'state_changed', {
+                    'entity_id': entity_id,
+                    'old_state': {'entity_id': entity_id, 'state': 'on', 'attributes': {'id': item_id, 'current': 1}},
+                    'new_state': {'entity_id': entity_id, 'state': 'on', 'attributes': {'id': item_id, 'current': 0}},
+                }, f"{run_id}-done")
+
+class _WSConnection:
+    """Minimal RFC 6455 server side: text frames (fragmented or not), ping/pong and close."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.subscriptions = {}
+        self.closed = False
+
+    async def recv(self):
+        """Returns the next JSON message, or None once the client closes."""
+        message = b''
+        while True:
+            b1, b2 = await self.reader.readexactly(2)
+            opcode = b1 & 0x0F
+            length = b2 & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            mask = await self.reader.readexactly(4) if b2 & 0x80 else None
+            data = await self.reader.readexactly(length)
+            if mask and length:
+                key = (mask * (length // 4 + 1))[:length]
+                data = (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+            if opcode == 0x8:
+                self._frame(0x8, data[:2])
+                self.closed = True
+                return None
+            if opcode == 0x9:
+                self._frame(0xA, data)
+                continue
+            if opcode == 0xA:
+                continue
+            message += data
+            if b1 & 0x80:
+                return json.loads(message)
+
+    def _frame(self, opcode, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError('client went away')
+        length = len(data)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self.writer.write(header + data)
+
+    async def send(self, payload):
+        self._frame(0x1, json.dumps(payload).encode('utf-8'))
+        await self.writer.drain()
+
+    async def result(self, msg_id, result):
+        await self.send({'id': msg_id, 'type': 'result', 'success': True, 'result': result})
+
+    async def error(self, msg_id, code, message):
+        await self.send({'id': msg_id, 'type': 'result', 'success': False,
+                         'error': {'code': code, 'message': message}})
+
+    async def event(self, sub_id, event_type, data, context_id):
+        await self.send({'id': sub_id, 'type': 'event', 'event': {
+            'event_type': event_type, 'data': data, 'origin': 'LOCAL',
+            'time_fired': iso(datetime.datetime.now(datetime.timezone.utc)),
+            'context': {'id': context_id, 'parent_id': None, 'user_id': None},
+        }})
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Home Assistant REST/WebSocket server.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--entities', type=int, default=100, help='Number of plain entities (default: 100)')
+    parser.add_argument('--automations', type=int, default=100, help='Number of automations (default: 100)')
+    parser.add_argument('--scripts', type=int, default=10, help='Number of scripts (default: 10)')
+    parser.add_argument('--traces-per-item', type=int, default=3, help='Stored traces per automation/script (default: 3)')
+    parser.add_argument('--latency', type=float, default=0, help='Delay added to every reply in ms (default: 0)')
+    parser.add_argument('--storm', type=int, default=0,
+                        help='Automation runs fired at each automation_triggered subscriber (default: 0)')
+    parser.add_argument('--storm-rate', type=float, default=0,
+                        help='Runs per second during a storm; 0 fires as fast as possible (default: 0)')
+    parser.add_argument('--state-churn', type=float, default=0,
+                        help='state_changed events per second sent to state_changed subscribers (default: 0)')
+    parser.add_argument('--token', type=str, default=DEFAULT_TOKEN, help=f'Access token (default: {DEFAULT_TOKEN})')
+    args = parser.parse_args()
+
+    server = MockHA(entities=args.entities, automations=args.automations, scripts=args.scripts,
+                    traces_per_item=args.traces_per_item, latency=args.latency / 1000,
+                    storm=args.storm, storm_rate=args.storm_rate, state_churn=args.state_churn,
+                    token=args.token)
+
+    async def serve():
+        await server.start('127.0.0.1', args.port)
+        print(f"Mock Home Assistant listening on {server.url} (token: {server.token})")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(f"\nServed {server.total_requests} request(s):")
+        for name, count in sorted(server.counts.items()):
+            print(f"  {name}: {count}")
+
+if __name__ == "__main__":
+    main()
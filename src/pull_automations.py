@@ -4,11 +4,22 @@ pull_automations.py
 
 Pulls the latest automations and scripts from a Home Assistant instance
 and saves them to the configured local directories.
+
+- Only files whose content changed are rewritten (atomically); a no-op pull
+  writes nothing but the manifest.
+- Items removed from Home Assistant are reported, or deleted with --prune.
 """
+import argparse
 from ha_helpers.common import get_config, pull_and_save_ha_items
 
 def main():
     """Main function to pull automations and scripts."""
+    parser = argparse.ArgumentParser(description="Pull Home Assistant automations/scripts into the configured folders.")
+    parser.add_argument('--prune', action='store_true',
+                        help='Delete local files for automations/scripts that no longer exist in Home Assistant.')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes used to render YAML (default: one per CPU).')
+    args = parser.parse_args()
     try:
         config = get_config()
         ha_url = config['HA_URL']
@@ -18,9 +29,11 @@ def main():
 
         print("Pulling automations and scripts from Home Assistant...")
         if automations_dir:
-            pull_and_save_ha_items('automation', '/api/config/automation/config', automations_dir, ha_url, ha_token)
+            pull_and_save_ha_items('automation', '/api/config/automation/config', automations_dir, ha_url, ha_token,
+                                   prune=args.prune, workers=args.workers, rate_limit=config.get('rate_limit'))
         if scripts_dir:
-            pull_and_save_ha_items('script', '/api/config/script/config', scripts_dir, ha_url, ha_token)
+            pull_and_save_ha_items('script', '/api/config/script/config', scripts_dir, ha_url, ha_token,
+                                   prune=args.prune, workers=args.workers, rate_limit=config.get('rate_limit'))
         print("\nPull complete!")
 
     except FileNotFoundError as e:
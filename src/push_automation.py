@@ -5,102 +5,215 @@ push_automation.py
 Pushes Home Assistant automations and scripts to your HA instance via the REST API.
 
 - Supports pushing all YAML files in automations/scripts folders, a single file,
-  or auto-detecting changes since the last git commit.
+  or auto-detecting changes: every commit since the last push is diffed with
+  one git plumbing call, and automations/scripts whose file was deleted are
+  deleted from HA after confirmation.
 - Can auto-overwrite existing automations/scripts with confirmation or --auto-overwrite flag.
-- Lints YAML before pushing and checks for existing entities.
+- Validates every file offline before any network call: trigger/condition/action
+  structure, entity references against the ha_entities.json snapshot, duplicate
+  ids and alias-derived ids (see --validate-only, --strict, --skip-validation).
+- Checks for existing entities before overwriting them.
+- Pushes many files concurrently over a pooled HTTP session; overwrite prompts
+  are asked up front and a per-file summary is printed at the end.
+- Skips files whose content hash matches the last push or pull (see --force and
+  --verify-remote).
 """
 import os
+import sys
+import time
 import glob
-import yaml
 import json
-import requests
+import collections
+import concurrent.futures
 import argparse
+import sqlite3
 from pathlib import Path
-import git
-from ha_helpers.common import get_config, get_config_path
+from ha_helpers.daemon_client import open_http_session
+from ha_helpers.ratelimit import get_limiter
+from ha_helpers.git_changes import (
+    GitError, EMPTY_TREE, repo_root, resolve_commit, diff_name_status, show_file,
+    load_last_pushed, save_last_pushed,
+)
+from ha_helpers.common import (
+    get_config, get_config_path, content_hash, manifest_key, load_manifest, save_manifest,
+)
+from ha_helpers.validator import validate_file, validate_files, derive_entity_id, item_type
+from ha_helpers.ref_index import RefIndex
 
 # Global flag for auto-overwrite
 AUTO_OVERWRITE = False
 
+# Number of files pushed concurrently
+DEFAULT_WORKERS = 8
+
+# Results after which a file needs no further push; anything else holds back the last-pushed marker
+DONE_STATUSES = {'pushed', 'unchanged', 'deleted', 'ignored'}
+
 def print_error(msg):
     print(f"\033[91m{msg}\033[0m")
 
-def get_changed_yaml_files():
-    """Returns a list of changed YAML files since the last commit."""
+ChangeSet = collections.namedtuple('ChangeSet', 'root head files deletions')
+
+def get_changed_yaml_files(since=None):
+    """Works out what to push from the commits since the last push.
+
+    Compares HEAD with `since`, else the commit recorded by the previous
+    successful --auto-detect-changes push, else HEAD's parent (the empty tree
+    for a first commit). Returns a ChangeSet with the files to push and the
+    items whose file was deleted, or renamed to a different entity ID; None if
+    change detection failed.
+    """
     try:
-        repo = git.Repo(search_parent_directories=True)
-        
-        # Compare HEAD with HEAD~1 to get only files changed in the last commit
-        # This assumes the user has already committed their changes.
-        if len(repo.heads) == 0:
+        root = repo_root()
+        head = resolve_commit(root, 'HEAD')
+        if head is None:
             print("No commits found in the repository.")
-            return []
-        
-        if len(repo.heads[0].commit.parents) == 0:
-            print("Only one commit found. Cannot compare with previous commit.")
-            return []
-
-        diff_index = repo.head.commit.diff(repo.head.commit.parents[0])
-        
-        changed_files = []
-        for item in diff_index:
-            if item.change_type in ('A', 'M', 'R'): # Added, Modified, Renamed
-                if item.b_path and item.b_path.endswith(('.yaml', '.yml')):
-                    changed_files.append(item.b_path)
-            elif item.change_type == 'D': # Deleted
-                # We don't push deleted files, but we might want to log them or handle them differently
-                pass
-        
-        if not changed_files:
-            print("No new YAML files detected in the last commit.")
-            return []
-
-        # Return full paths
-        return [os.path.join(repo.working_dir, f) for f in changed_files]
-    except git.InvalidGitRepositoryError:
-        print_error(f"Error: The current directory is not a Git repository. Please run this script from within your automations/scripts repository.")
-        return []
-    except Exception as e:
-        print_error(f"An error occurred while detecting git changes: {e}")
-        return []
-
-def push_file(filepath, ha_config, auto_overwrite=False):
-    """Pushes a single automation or script file to Home Assistant."""
+            return None
+        base = since or load_last_pushed(root)
+        label = since or 'the last push'
+        if base:
+            resolved = resolve_commit(root, base)
+            if resolved is None:
+                print_error(f"Commit {base} is no longer in the repository; comparing with the previous commit instead.")
+            base = resolved
+        if base is None:
+            base = resolve_commit(root, 'HEAD~1') or EMPTY_TREE
+            label = 'the last commit'
+        print(f"Detecting YAML changes since {label} ({base[:7]}..{head[:7]})")
+        changes = diff_name_status(root, base, head)
+    except GitError as e:
+        print_error(f"Error: could not detect git changes ({e}). "
+                    "Please run this script from within your automations/scripts repository.")
+        return None
+
+    import yaml
+    files = [os.path.join(root, c.path) for c in changes if c.status != 'D']
+    pushed_keys = set()
+    for path in files:
+        item = load_push_item(path, quiet=True)
+        if item:
+            pushed_keys.add(item['key'])
+    deletions = []
+    for change in changes:
+        old_path = change.path if change.status == 'D' else change.old_path
+        if change.status not in 'DR' or not old_path:
+            continue
+        try:
+            content = yaml.safe_load(show_file(root, base, old_path))
+        except (GitError, yaml.YAMLError, UnicodeDecodeError):
+            print_error(f"Could not read the previous version of {old_path}; not deleting anything for it.")
+            continue
+        item = describe_item(content, old_path, quiet=True)
+        # A renamed file that keeps its entity ID is just pushed again
+        if item and item['key'] not in pushed_keys:
+            deletions.append(item)
+    if not files and not deletions:
+        print("No YAML changes to push.")
+    return ChangeSet(root, head, files, deletions)
+
+def load_push_item(filepath, quiet=False):
+    """Reads an automation/script file and works out where it should be pushed.
+
+    Returns a dict with the file's content, entity ID and type, or None if the
+    file can't be pushed.
+    """
+    # yaml and requests are imported where they're used, so --validate-only and --help start quickly
+    import yaml
     try:
         with open(filepath, 'r') as f:
             content = yaml.safe_load(f)
     except yaml.YAMLError as e:
-        print_error(f"Error reading YAML file {filepath}: {e}")
-        return
+        if not quiet:
+            print_error(f"Error reading YAML file {filepath}: {e}")
+        return None
     except FileNotFoundError:
-        print_error(f"File not found: {filepath}")
-        return
+        if not quiet:
+            print_error(f"File not found: {filepath}")
+        return None
+    return describe_item(content, filepath, quiet=quiet)
 
+def describe_item(content, filepath, quiet=False):
+    """Works out the entity ID and type of parsed automation/script content (see load_push_item)."""
     if not isinstance(content, dict) or ('id' not in content and 'alias' not in content):
-        print_error(f"Invalid format in {filepath}. Each automation/script must be a dictionary with an 'id' or 'alias'.")
-        return
+        if not quiet:
+            print_error(f"Invalid format in {filepath}. Each automation/script must be a dictionary with an 'id' or 'alias'.")
+        return None
 
-    entity_id = content.get('id', content.get('alias', '').lower().replace(' ', '_'))
+    entity_id = derive_entity_id(content)
     if not entity_id:
-        print_error(f"Could not determine entity ID for {filepath}")
-        return
+        if not quiet:
+            print_error(f"Could not determine entity ID for {filepath}")
+        return None
 
     # Determine if it's an automation or script
-    is_automation = 'trigger' in content
-    is_script = 'sequence' in content and not is_automation
-    if not is_automation and not is_script:
-        print(f"Skipping {filepath} as it does not appear to be an automation or script.")
+    entity_type = item_type(content)
+    if entity_type is None:
+        if not quiet:
+            print(f"Skipping {filepath} as it does not appear to be an automation or script.")
+        return None
+
+    return {
+        'path': filepath,
+        'content': content,
+        'entity_id': entity_id,
+        'entity_type': entity_type,
+        'key': manifest_key(entity_type, entity_id),
+        'hash': content_hash(content),
+    }
+
+def make_session(ha_config, pool_size=DEFAULT_WORKERS):
+    """Returns a pooled, retrying HTTP session for Home Assistant (through ha-daemon if it runs).
+
+    Direct sessions share the instance's adaptive limiter (config.json "rate_limit").
+    """
+    limiter = get_limiter(ha_config['HA_URL'], ha_config.get('rate_limit'), max_concurrency=pool_size)
+    return open_http_session(ha_config['HA_TOKEN'], pool_size=pool_size, limiter=limiter)
+
+def item_url(item, ha_config):
+    return f"{ha_config['HA_URL']}/api/config/{item['entity_type']}/config/{item['entity_id']}"
+
+def entity_exists(session, item, ha_config):
+    """Checks whether the automation/script is already configured in Home Assistant."""
+    resp = session.get(item_url(item, ha_config))
+    return resp.status_code == 200
+
+def post_item(session, item, ha_config):
+    """Pushes one loaded automation/script. Raises on HTTP errors."""
+    resp = session.post(item_url(item, ha_config), data=json.dumps(item['content']))
+    resp.raise_for_status()
+
+def delete_item(session, item, ha_config):
+    """Deletes one automation/script from Home Assistant; a missing one counts as deleted."""
+    resp = session.delete(item_url(item, ha_config))
+    if resp.status_code != 404:
+        resp.raise_for_status()
+
+def confirm_deletions(deletions, auto_overwrite, results):
+    """Asks before deleting each removed item from Home Assistant; returns the confirmed ones."""
+    confirmed = []
+    for item in deletions:
+        name = f"{item['entity_type']}.{item['entity_id']}"
+        if not auto_overwrite:
+            answer = input(f"'{name}' was removed from {item['path']}. Delete it from Home Assistant? [y/N] ").lower()
+            if answer != 'y':
+                print(f"Kept {name} in Home Assistant.")
+                results.append(_result(item, 'skipped', 'not deleted'))
+                continue
+        confirmed.append(item)
+    return confirmed
+
+def push_file(filepath, ha_config, auto_overwrite=False, session=None):
+    """Pushes a single automation or script file to Home Assistant."""
+    item = load_push_item(filepath)
+    if not item:
         return
-        
-    entity_type = 'automation' if is_automation else 'script'
-    api_path = f"/api/config/{entity_type}/config/{entity_id}"
-    url = f"{ha_config['HA_URL']}{api_path}"
-    headers = {"Authorization": f"Bearer {ha_config['HA_TOKEN']}", "Content-Type": "application/json"}
+    import requests
+    session = session or make_session(ha_config, pool_size=1)
+    entity_id = item['entity_id']
 
     # Check if entity exists
     try:
-        resp = requests.get(url, headers=headers)
-        exists = resp.status_code == 200
+        exists = entity_exists(session, item, ha_config)
 
         if exists and not auto_overwrite:
             overwrite = input(f"'{entity_id}' already exists. Overwrite? [y/N] ").lower()
@@ -109,19 +222,239 @@ def push_file(filepath, ha_config, auto_overwrite=False):
                 return
 
         # Push the automation/script
-        resp = requests.post(url, headers=headers, data=json.dumps(content))
-        resp.raise_for_status()
-        print(f"Successfully pushed {entity_type}: {entity_id}")
+        post_item(session, item, ha_config)
+        print(f"Successfully pushed {item['entity_type']}: {entity_id}")
 
     except requests.exceptions.RequestException as e:
         print_error(f"Error pushing {entity_id}: {e}")
 
+def fetch_remote_hashes(session, ha_config, entity_types):
+    """Downloads the remote config of each entity type in one request per type.
+
+    Returns {manifest key: content hash} for every automation/script HA reports.
+    """
+    hashes = {}
+    for entity_type in entity_types:
+        resp = session.get(f"{ha_config['HA_URL']}/api/config/{entity_type}/config")
+        resp.raise_for_status()
+        for item in resp.json():
+            entity_id = item.get('id') or item.get('entity_id')
+            if entity_id:
+                hashes[manifest_key(entity_type, entity_id)] = content_hash(item)
+    return hashes
+
+def push_files(files, ha_config, auto_overwrite=False, workers=DEFAULT_WORKERS,
+               force=False, verify_remote=False, show_stats=False, deletions=(), invalid=()):
+    """Pushes many files over a shared connection pool and prints a summary.
+
+    Files whose content hash matches the manifest entry from the last push or
+    pull are skipped without any network call, unless `force` is set. With
+    `verify_remote`, the comparison is made against the hashes of the remote
+    configs instead, fetched in bulk.
+    Existence checks and overwrite prompts happen up front, so the worker pool
+    that performs the pushes never waits on user input. `deletions` are items
+    (from describe_item) to delete from Home Assistant after confirmation.
+    `invalid` lists (path, reason) for files rejected by offline validation.
+    Returns a list of per-file result dicts.
+    """
+    import requests
+    results = [{'path': path, 'entity_id': None, 'status': 'invalid', 'detail': detail} for path, detail in invalid]
+    items = []
+    for path in files:
+        item = load_push_item(path)
+        if item:
+            items.append(item)
+        else:
+            # Well-formed YAML that is neither an automation nor a script is skipped by design, not invalid
+            status = 'invalid' if validate_file(path)['errors'] else 'ignored'
+            results.append({'path': path, 'entity_id': None, 'status': status, 'detail': ''})
+
+    manifest = load_manifest()
+    session = make_session(ha_config, pool_size=workers)
+    if not force:
+        if verify_remote:
+            try:
+                known = fetch_remote_hashes(session, ha_config, {item['entity_type'] for item in items})
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print_error(f"Could not fetch remote configs for comparison: {e}")
+                known = {}
+        else:
+            known = manifest
+        changed = []
+        for item in items:
+            if known.get(item['key']) == item['hash']:
+                manifest[item['key']] = item['hash']
+                results.append(_result(item, 'unchanged'))
+            else:
+                changed.append(item)
+        items = changed
+        if not items and not deletions:
+            save_manifest(manifest)
+            print_summary(results)
+            return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # Pre-flight: find out which entities exist, then ask about overwrites serially
+        to_push = items
+        if not auto_overwrite:
+            checks = pool.map(lambda item: _try(entity_exists, session, item, ha_config), items)
+            to_push = []
+            for item, (exists, error) in zip(items, checks):
+                if error:
+                    results.append(_result(item, 'failed', error))
+                    continue
+                if exists:
+                    overwrite = input(f"'{item['entity_id']}' already exists. Overwrite? [y/N] ").lower()
+                    if overwrite != 'y':
+                        print(f"Skipped {item['entity_id']}.")
+                        results.append(_result(item, 'skipped', 'not overwritten'))
+                        continue
+                to_push.append(item)
+        to_delete = confirm_deletions(deletions, auto_overwrite, results)
+
+        for item, (_, error) in zip(to_push, pool.map(lambda item: _try(post_item, session, item, ha_config), to_push)):
+            if error:
+                print_error(f"Error pushing {item['entity_id']}: {error}")
+                results.append(_result(item, 'failed', error))
+            else:
+                print(f"Successfully pushed {item['entity_type']}: {item['entity_id']}")
+                manifest[item['key']] = item['hash']
+                results.append(_result(item, 'pushed'))
+
+        for item, (_, error) in zip(to_delete, pool.map(lambda item: _try(delete_item, session, item, ha_config), to_delete)):
+            name = f"{item['entity_type']}.{item['entity_id']}"
+            if error:
+                print_error(f"Error deleting {name}: {error}")
+                results.append(_result(item, 'failed', error))
+            else:
+                print(f"Deleted {name} from Home Assistant")
+                manifest.pop(item['key'], None)
+                results.append(_result(item, 'deleted'))
+
+    save_manifest(manifest)
+    print_summary(results)
+    if show_stats:
+        print(session.stats.summary())
+        if getattr(session, 'limiter', None):
+            print(session.limiter.summary())
+    return results
+
+def _try(func, *args):
+    # Runs a request in a worker and returns (result, error message)
+    import requests
+    try:
+        return func(*args), None
+    except requests.exceptions.RequestException as e:
+        return None, str(e)
+
+def _result(item, status, detail=''):
+    return {'path': item['path'], 'entity_id': item['entity_id'], 'status': status, 'detail': detail}
+
+def print_summary(results):
+    counts = collections.Counter(r['status'] for r in results)
+    extra = "".join(f"{status} {counts[status]}, " for status in ('deleted', 'ignored') if counts[status])
+    print(f"\nPushed {counts['pushed']}, unchanged {counts['unchanged']}, {extra}skipped {counts['skipped']}, "
+          f"failed {counts['failed']}, invalid {counts['invalid']} of {len(results)} file(s).")
+    for r in results:
+        if r['status'] == 'failed' or (r['status'] == 'invalid' and r['detail']):
+            print_error(f"  {r['path']}: {r['detail']}")
+
+def load_known_entities():
+    """Returns the entity_ids of the cached ha_entities snapshot, or None if there is none."""
+    from ha_helpers.common import find_entities_file, iter_entities
+    path = find_entities_file(os.path.dirname(get_config_path()))
+    if not path:
+        return None
+    try:
+        return {e['entity_id'] for e in iter_entities(path) if e.get('entity_id')}
+    except (OSError, ValueError) as e:
+        print_error(f"Could not read {path}: {e}")
+        return None
+
+def local_dirs(ha_config):
+    """The configured AUTOMATIONS_DIR and SCRIPTS_DIR that exist."""
+    return [ha_config[key] for key in ('AUTOMATIONS_DIR', 'SCRIPTS_DIR')
+            if ha_config.get(key) and os.path.isdir(ha_config[key])]
+
+def local_yaml_files(ha_config):
+    """Every automation/script YAML file in the configured AUTOMATIONS_DIR and SCRIPTS_DIR."""
+    files = []
+    for directory in local_dirs(ha_config):
+        files.extend(glob.glob(os.path.join(directory, '*.yaml')))
+    return files
+
+def validate_before_push(files, strict=False, directories=()):
+    """Validates files offline and prints the findings.
+
+    The YAML files in `directories` are checked for ids that the pushed files
+    would overwrite, via the reference index (only files changed since its
+    last refresh are re-read).
+    Returns (files that may be pushed, [(path, reason)] for rejected files).
+    """
+    start = time.perf_counter()
+    known = load_known_entities()
+    top = {os.path.abspath(d) for d in directories}
+
+    def defined_in(key):
+        # The index also covers subfolders; push only considers files directly in the folders
+        return [path for path in index.item_paths(key) if os.path.dirname(path) in top]
+
+    try:
+        with RefIndex() as index:
+            if directories:
+                index.update(directories)
+            reports = validate_files(files, known_entities=known, strict=strict,
+                                     defined_in=defined_in if directories else None)
+    except sqlite3.Error as e:
+        print(f"⚠️ Reference index unavailable ({e}); not checking ids against other local files.")
+        reports = validate_files(files, known_entities=known, strict=strict)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    valid, rejected = [], []
+    warnings = 0
+    for report in reports:
+        for warning in report['warnings']:
+            print(f"⚠️ {report['path']}: {warning}")
+        warnings += len(report['warnings'])
+        if report['errors']:
+            print_error(f"✗ {report['path']}")
+            for error in report['errors']:
+                print_error(f"    {error}")
+            rejected.append((report['path'], report['errors'][0]))
+        else:
+            valid.append(report['path'])
+    note = "" if known is not None else " (entity references not checked: no ha_entities.json snapshot)"
+    print(f"Validated {len(reports)} file(s) offline in {elapsed:.0f} ms: {len(rejected)} with errors, "
+          f"{warnings} warning(s){note}.")
+    return valid, rejected
+
 def main():
     parser = argparse.ArgumentParser(description="Push Home Assistant automations/scripts.")
     parser.add_argument('--push-file', type=str, help='Push a single automation/script YAML file.')
     parser.add_argument('--auto-overwrite', action='store_true', help='Auto-accept all confirmation prompts.')
-    parser.add_argument('--auto-detect-changes', action='store_true', help='Automatically push all changed YAML files since the last git commit.')
+    parser.add_argument('--auto-detect-changes', action='store_true',
+                        help='Push the YAML files changed in git since the last push (or in the last commit), '
+                             'and offer to delete removed ones.')
+    parser.add_argument('--since', type=str, metavar='COMMIT',
+                        help='With --auto-detect-changes, compare with this commit instead of the last push.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Number of files to push concurrently (default: {DEFAULT_WORKERS}).')
+    parser.add_argument('--force', action='store_true',
+                        help='Push files even if their content matches the last push or pull.')
+    parser.add_argument('--verify-remote', action='store_true',
+                        help="Compare against Home Assistant's current configs instead of the local manifest.")
+    parser.add_argument('--stats', action='store_true', help='Print per-request latency statistics at the end.')
+    parser.add_argument('--skip-validation', action='store_true',
+                        help='Push without validating the files offline first.')
+    parser.add_argument('--validate-only', action='store_true',
+                        help='Only validate the files offline; nothing is sent to Home Assistant.')
+    parser.add_argument('--strict', action='store_true',
+                        help='Treat validation warnings (unknown entities, alias-derived ids, ...) as errors.')
     args = parser.parse_args()
+    if args.since and not args.auto_detect_changes:
+        parser.error("--since requires --auto-detect-changes")
+    if args.validate_only and args.skip_validation:
+        parser.error("--validate-only and --skip-validation can't be combined")
 
     global AUTO_OVERWRITE
     AUTO_OVERWRITE = args.auto_overwrite
@@ -133,25 +466,40 @@ def main():
         return
 
     files_to_push = []
+    changes = None
     if args.auto_detect_changes:
-        files_to_push = get_changed_yaml_files()
+        changes = get_changed_yaml_files(since=args.since)
+        if changes is None:
+            return
+        files_to_push = changes.files
     elif args.push_file:
         files_to_push.append(args.push_file)
     else:
         # Default behavior: push all files from configured directories
-        automations_dir = ha_config.get('AUTOMATIONS_DIR')
-        scripts_dir = ha_config.get('SCRIPTS_DIR')
-        if automations_dir:
-            files_to_push.extend(glob.glob(os.path.join(automations_dir, '*.yaml')))
-        if scripts_dir:
-            files_to_push.extend(glob.glob(os.path.join(scripts_dir, '*.yaml')))
-
-    if not files_to_push:
+        files_to_push = local_yaml_files(ha_config)
+
+    rejected = []
+    if files_to_push and not args.skip_validation:
+        # Catch bad files locally before any network I/O
+        files_to_push, rejected = validate_before_push(files_to_push, strict=args.strict,
+                                                       directories=local_dirs(ha_config))
+    if args.validate_only:
+        sys.exit(1 if rejected else 0)
+
+    if changes is not None and not files_to_push and not changes.deletions and not rejected:
+        save_last_pushed(changes.root, changes.head)
+        return
+    if not files_to_push and not rejected and changes is None:
         print("No files to push.")
         return
 
-    for f in files_to_push:
-        push_file(f, ha_config, auto_overwrite=AUTO_OVERWRITE)
+    results = push_files(files_to_push, ha_config, auto_overwrite=AUTO_OVERWRITE, workers=args.workers,
+                         force=args.force, verify_remote=args.verify_remote, show_stats=args.stats,
+                         deletions=changes.deletions if changes else (), invalid=rejected)
+    # Only move the marker once everything went through; failed, skipped and invalid
+    # files are offered again by the next --auto-detect-changes run
+    if changes is not None and not rejected and all(r['status'] in DONE_STATUSES for r in results):
+        save_last_pushed(changes.root, changes.head)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+watchdog_log.py
+
+Queries the run-outcome log written by automation_watchdog.py.
+
+- Streams the log segments; segment indexes skip files outside the time range
+  or without the requested entity, so nothing is loaded into memory whole.
+- Default output is a per-automation summary: runs, failures and duration
+  percentiles (e.g. the p95 of automation.x over the last 24h).
+- --list prints the matching runs instead.
+- Runs from instances other than the default one are shown as
+  <instance>:<entity_id>; --instance narrows the query to some of them.
+
+Usage:
+  python watchdog_log.py [--logs-dir DIR] [--entity ENTITY_ID] [--since 24h|ISO] [--until 1h|ISO]
+                         [--failed] [--percentile P] [--list] [--limit N] [--instance a,b]
+
+Arguments:
+  --logs-dir DIR        Folder holding the event log (default: the HA-Tools logs folder)
+  --entity ENTITY_ID    Only this automation, e.g. automation.kitchen_lights
+  --since WHEN          Start of the range: a duration ago (30m, 24h, 7d) or an ISO timestamp
+  --until WHEN          End of the range, same format (default: now)
+  --failed              Only failed runs
+  --percentile P        Percentile reported next to p50 (default: 95)
+  --list                Print matching runs instead of the summary
+  --limit N             With --list, print only the newest N runs (default: 50; 0 = all)
+  --instance a,b        Only runs from these Home Assistant instances
+"""
+import argparse
+import collections
+import datetime
+import re
+import sys
+import time
+from ha_helpers.common import get_default_folders, DEFAULT_INSTANCE
+from ha_helpers.event_log import iter_records, DurationSketch
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_when(value, now=None):
+    """Turns '24h'-style durations (ago) or ISO timestamps into POSIX seconds.
+
+    Timestamps without a timezone are taken as local time.
+    """
+    now = time.time() if now is None else now
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([smhdw])', value.strip())
+    if match:
+        return now - float(match.group(1)) * DURATION_UNITS[match.group(2)]
+    ts = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        ts = ts.astimezone()
+    return ts.timestamp()
+
+def format_ts(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+def format_ms(value):
+    return '-' if value is None else f"{value:.0f}"
+
+def record_label(record):
+    """entity_id, prefixed with the instance name for runs not from the default instance."""
+    instance = record.get('instance', DEFAULT_INSTANCE)
+    entity = record.get('entity_id')
+    return entity if instance == DEFAULT_INSTANCE else f"{instance}:{entity}"
+
+def summarize(records, pct):
+    """Aggregates records per entity in bounded memory; returns {entity: summary dict}."""
+    sketches = collections.defaultdict(DurationSketch)
+    runs = collections.Counter()
+    failed = collections.Counter()
+    for record in records:
+        entity = record_label(record)
+        runs[entity] += 1
+        failed[entity] += bool(record.get('failed'))
+        if record.get('took_ms') is not None:
+            sketches[entity].add(record['took_ms'])
+    summary = {}
+    for entity in runs:
+        sketch = sketches.get(entity)
+        summary[entity] = {
+            'runs': runs[entity],
+            'failed': failed[entity],
+            'p50': sketch.percentile(50) if sketch else None,
+            'pct': sketch.percentile(pct) if sketch else None,
+            'max': sketch.max if sketch and sketch.count else None,
+        }
+    return summary
+
+def print_summary(summary, pct):
+    if not summary:
+        print("No runs logged in that range.")
+        return
+    label = f"p{pct:g} ms"
+    width = max(len('automation'), *(len(str(e)) for e in summary))
+    print(f"{'automation':<{width}} {'runs':>7} {'failed':>7} {'p50 ms':>9} {label:>9} {'max ms':>9}")
+    # Slowest first
+    for entity, row in sorted(summary.items(), key=lambda item: -(item[1]['pct'] or 0)):
+        print(f"{str(entity):<{width}} {row['runs']:>7} {row['failed']:>7} {format_ms(row['p50']):>9} "
+              f"{format_ms(row['pct']):>9} {format_ms(row['max']):>9}")
+
+def print_runs(records, limit):
+    # Only the newest `limit` records are held in memory
+    shown = collections.deque(maxlen=limit or None)
+    shown.extend(records)
+    for record in shown:
+        mark = '❌' if record.get('failed') else '✓'
+        line = (f"[{format_ts(record['ts'])}] {mark} {record_label(record)} "
+                f"{record.get('outcome')} {format_ms(record.get('took_ms'))} ms  (run {str(record.get('context_id'))[:7]})")
+        if record.get('error'):
+            line += f"\n    Error: {record['error']}"
+        print(line)
+    if not shown:
+        print("No runs logged in that range.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the automation watchdog's run-outcome log.")
+    parser.add_argument('--logs-dir', type=str, default=get_default_folders()[4],
+                        help='Folder holding the event log (default: the HA-Tools logs folder)')
+    parser.add_argument('--entity', type=str, help='Only this automation, e.g. automation.kitchen_lights')
+    parser.add_argument('--since', type=str, help='Start of the range: 30m, 24h, 7d or an ISO timestamp')
+    parser.add_argument('--until', type=str, help='End of the range, same format (default: now)')
+    parser.add_argument('--failed', action='store_true', help='Only failed runs')
+    parser.add_argument('--percentile', type=float, default=95, help='Percentile reported next to p50 (default: 95)')
+    parser.add_argument('--list', action='store_true', help='Print matching runs instead of the summary')
+    parser.add_argument('--limit', type=int, default=50, help='With --list, newest N runs only (default: 50; 0 = all)')
+    parser.add_argument('--instance', type=str, help='Comma-separated instance names to include (default: all)')
+    args = parser.parse_args()
+
+    try:
+        since = parse_when(args.since) if args.since else None
+        until = parse_when(args.until) if args.until else None
+    except ValueError as e:
+        parser.error(f"could not parse time range: {e}")
+    if not 0 < args.percentile <= 100:
+        parser.error("--percentile must be between 0 and 100")
+
+    records = iter_records(args.logs_dir, since=since, until=until, entity=args.entity)
+    if args.failed:
+        records = (r for r in records if r.get('failed'))
+    if args.instance:
+        instances = set(args.instance.split(','))
+        records = (r for r in records if r.get('instance', DEFAULT_INSTANCE) in instances)
+    try:
+        if args.list:
+            print_runs(records, args.limit)
+        else:
+            print_summary(summarize(records, args.percentile), args.percentile)
+    except BrokenPipeError:
+        # Output piped into head etc.
+        sys.stderr.close()
+
+if __name__ == "__main__":
+    main()